@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""
+端到端负载测试
+
+1. 在 MySQL 中新建一个临时库 (默认 psychat_loadtest)，按 database/psychat.sql 中的 CREATE TABLE 建表，
+   写入合成的资源和会话 (会话已绑定线程)。
+2. 启动 AnythingLLM 替身 (benchmarks/fake_anythingllm.py，延迟/抖动/错误率/流式可配置) 和后端 (uvicorn main:app)。
+3. 以固定到达速率 (开环，不等待上一个请求完成) 同时压测 /api/chat、/api/resources 和 /health。
+   延迟从计划发送时刻开始计算，客户端排队时间也计入，避免协调遗漏 (coordinated omission)。
+4. 输出每个端点的吞吐量和 p50/p95/p99 延迟 (JSON)，以及压测结束时后端的 /health 快照。
+
+数据库连接使用 backend/.env 中的 DB_HOST/DB_PORT/DB_USER/DB_PASSWORD，需要建库权限 (MySQL 8.0，ngram 全文索引)。
+本地没有 MySQL 时可以临时启动一个:
+    docker run -d --rm -p 3306:3306 -e MYSQL_ROOT_PASSWORD=root mysql:8.0
+
+用法:
+    python benchmarks/bench_load.py --duration 30 --chat-rate 20 --resources-rate 200 --health-rate 20 \\
+        --llm-latency 1.5 --llm-jitter 0.5 --llm-error-rate 0.01
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import httpx
+import pymysql
+from dotenv import load_dotenv
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_FILE = os.path.join(BACKEND_DIR, "database", "psychat.sql")
+
+CATEGORIES = ["crisis", "counseling", "support", "self-help", "education"]
+LOCATIONS = ["national", "beijing", "shanghai", "guangzhou", "online", "shenzhen"]
+QUESTIONS = ["最近总是失眠怎么办", "考试前很焦虑", "和家人吵架后心情很差", "工作压力太大了", "感觉很孤独", "怎么放松自己"]
+
+
+# --- Database ---
+
+def connect(database: Optional[str] = None):
+    return pymysql.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        database=database,
+        autocommit=True,
+    )
+
+
+def schema_statements() -> List[str]:
+    """CREATE TABLE statements from psychat.sql, so the load-test schema never drifts from the real one."""
+    with open(SCHEMA_FILE, encoding="utf-8") as f:
+        sql = "\n".join(re.sub(r"--.*$", "", line) for line in f)
+    return [statement.strip() for statement in sql.split(";") if statement.strip().upper().startswith("CREATE TABLE")]
+
+
+def prepare_database(name: str, resources: int, sessions: int, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+            cursor.execute(f"CREATE DATABASE `{name}` CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci")
+            cursor.execute(f"USE `{name}`")
+            for statement in schema_statements():
+                cursor.execute(statement)
+            cursor.executemany(
+                "INSERT INTO resources (title, description, category, location_tag, contact_info, url) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                [(f"资源{i}", f"合成资源描述{i}" * 5, rng.choice(CATEGORIES), rng.choice(LOCATIONS),
+                  f"400-000-{i:04d}", f"https://example.com/r/{i}") for i in range(resources)],
+            )
+            session_ids = [f"load-{i:08d}" for i in range(sessions)]
+            cursor.executemany(
+                "INSERT INTO chat_sessions (id, name, anythingllm_thread_id) VALUES (%s, %s, %s)",
+                [(session_id, f"Session {session_id}", f"fake-thread-{i}") for i, session_id in enumerate(session_ids)],
+            )
+    finally:
+        conn.close()
+    return session_ids
+
+
+def drop_database(name: str) -> None:
+    conn = connect()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{name}`")
+    finally:
+        conn.close()
+
+
+# --- Processes ---
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_process(args: List[str], env: Dict[str, str], name: str) -> subprocess.Popen:
+    """Output goes to <tmp>/<name>.log (a pipe nobody reads would fill up and block the server)."""
+    log = open(os.path.join(tempfile.gettempdir(), f"{name}.log"), "wb")
+    process = subprocess.Popen(args, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    process.log_path = log.name
+    log.close()
+    return process
+
+
+def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(process.log_path, "rb") as log:
+                raise RuntimeError(f"{url} exited early: {log.read().decode(errors='replace')[-2000:]}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def stop_process(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+# --- Load generation ---
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(samples: List[tuple], duration: float) -> Dict[str, object]:
+    """samples: (latency_ms, status) with status 0 for transport errors."""
+    latencies = sorted(latency for latency, status in samples if 200 <= status < 400)
+    statuses = Counter(str(status) for _, status in samples)
+    summary: Dict[str, object] = {
+        "requests": len(samples),
+        "ok": len(latencies),
+        "errors": len(samples) - len(latencies),
+        "status_counts": dict(statuses),
+        "throughput_rps": round(len(latencies) / duration, 2),
+    }
+    if latencies:
+        summary.update({
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "max_ms": round(latencies[-1], 2),
+        })
+    return summary
+
+
+async def drive(client: httpx.AsyncClient, rate: float, duration: float, make_request, samples: List[tuple]) -> None:
+    """Open-loop arrivals: request i is due at start + i / rate, whether or not earlier ones finished."""
+    if rate <= 0:
+        return
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    tasks = []
+
+    async def one(due: float):
+        method, url, kwargs = make_request()
+        try:
+            response = await client.request(method, url, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        samples.append(((loop.time() - due) * 1000, status))
+
+    for i in range(int(rate * duration)):
+        due = start + i / rate
+        delay = due - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(due)))
+    await asyncio.gather(*tasks)
+
+
+async def run_load(base_url: str, args, session_ids: List[str]) -> Dict[str, object]:
+    rng = random.Random(args.seed)
+
+    def chat_request():
+        question = rng.choice(QUESTIONS)
+        if not args.repeat_questions:
+            question = f"{question} #{rng.randrange(10**9)}"  # Defeat the stateless reply cache
+        body = {"message": question}
+        if rng.random() < args.session_ratio:
+            body["session_id"] = rng.choice(session_ids)
+        if rng.random() < args.stream_ratio:
+            return "POST", "/api/chat/stream?format=ndjson", {"json": body}
+        return "POST", "/api/chat", {"json": body}
+
+    def resources_request():
+        params = {"limit": 20}
+        if rng.random() < 0.5:
+            params["category"] = rng.choice(CATEGORIES)
+        if rng.random() < 0.3:
+            params["location"] = rng.choice(LOCATIONS)
+        return "GET", "/api/resources", {"params": params}
+
+    def health_request():
+        return "GET", "/health", {}
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    results: Dict[str, List[tuple]] = {"chat": [], "resources": [], "health": []}
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(
+            drive(client, args.chat_rate, args.duration, chat_request, results["chat"]),
+            drive(client, args.resources_rate, args.duration, resources_request, results["resources"]),
+            drive(client, args.health_rate, args.duration, health_request, results["health"]),
+        )
+        elapsed = time.perf_counter() - started
+        health = (await client.get("/health")).json()
+    return {
+        "elapsed_seconds": round(elapsed, 1),
+        "endpoints": {name: summarize(samples, elapsed) for name, samples in results.items() if samples},
+        "backend_health": health,
+    }
+
+
+def main():
+    load_dotenv(os.path.join(BACKEND_DIR, ".env"))
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load per run")
+    parser.add_argument("--chat-rate", type=float, default=20, help="chat requests per second (0 disables)")
+    parser.add_argument("--resources-rate", type=float, default=200, help="/api/resources requests per second")
+    parser.add_argument("--health-rate", type=float, default=20, help="/health requests per second")
+    parser.add_argument("--session-ratio", type=float, default=0.7, help="fraction of chats with a session_id")
+    parser.add_argument("--stream-ratio", type=float, default=0.0, help="fraction of chats sent to /api/chat/stream")
+    parser.add_argument("--repeat-questions", action="store_true", help="reuse a few FAQ questions (exercises the reply cache)")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-tokens", type=int, default=20)
+    parser.add_argument("--resources", type=int, default=5000, help="synthetic rows in resources")
+    parser.add_argument("--sessions", type=int, default=2000, help="synthetic rows in chat_sessions")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the backend")
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--db-name", default="psychat_loadtest")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the load-test database afterwards")
+    args = parser.parse_args()
+
+    session_ids = prepare_database(args.db_name, args.resources, args.sessions, args.seed)
+    llm_port, backend_port = free_port(), free_port()
+    env = dict(os.environ)
+    env.update({
+        "ANYTHINGLLM_API_BASE_URL": f"http://127.0.0.1:{llm_port}/api",
+        "ANYTHINGLLM_WORKSPACE_SLUG": "loadtest",
+        "DB_NAME": args.db_name,
+        "METRICS_ROLLUP_ENABLED": env.get("METRICS_ROLLUP_ENABLED", "false"),
+    })
+    llm = start_process([
+        sys.executable, "benchmarks/fake_anythingllm.py", "--port", str(llm_port),
+        "--latency", str(args.llm_latency), "--jitter", str(args.llm_jitter),
+        "--error-rate", str(args.llm_error_rate), "--tokens", str(args.llm_tokens), "--seed", str(args.seed),
+    ], env, "psychat-bench-llm")
+    backend = start_process([
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(backend_port),
+        "--workers", str(args.workers), "--log-level", "warning", "--no-access-log",
+    ], env, "psychat-bench-backend")
+    try:
+        wait_until_ready(f"http://127.0.0.1:{llm_port}/stats", llm)
+        wait_until_ready(f"http://127.0.0.1:{backend_port}/health", backend)
+        report = asyncio.run(run_load(f"http://127.0.0.1:{backend_port}", args, session_ids))
+        report["upstream_stats"] = httpx.get(f"http://127.0.0.1:{llm_port}/stats").json()
+        print(json.dumps({
+            "benchmark": "load",
+            "config": {key: value for key, value in vars(args).items() if key not in ("keep", "db_name")},
+            **report,
+        }, ensure_ascii=False, indent=2))
+    finally:
+        stop_process(backend)
+        stop_process(llm)
+        if not args.keep:
+            drop_database(args.db_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+请求路径日志开销基准测试
+
+在事件循环中模拟 --requests 个聊天请求，每个请求产生与 /api/chat 相同的日志调用
+(3 条 INFO、httpx 的 1 条 INFO、1 条包含完整 AnythingLLM 响应的 DEBUG)，对比:
+  * legacy: logging.basicConfig(level=INFO) + f-string，StreamHandler 在事件循环线程同步写出
+            (DEBUG 关闭时 f-string 仍会把整个响应格式化一遍)
+  * queued: logconfig.setup_logging()，%-style 延迟格式化，记录经队列交给后台线程写 JSON；
+            可选 --sample 对 main.chat / httpx 的 INFO 抽样
+
+统计的是每个请求中日志调用占用事件循环的时间。日志写入临时文件；--sink-delay-ms 给每次写入加上延迟，
+模拟慢速的终端、管道或日志采集器。不需要数据库和网络，结果以 JSON 输出到标准输出。
+
+用法:
+    python benchmarks/bench_logging.py --requests 5000 --sink-delay-ms 0.2 --sample 0.1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logconfig import request_id_var, setup_logging, stop_logging
+
+
+class SlowFile:
+    """File wrapper whose writes take at least ``delay`` seconds (a sink that cannot keep up)."""
+
+    def __init__(self, path: str, delay: float):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+
+    def write(self, data: str) -> int:
+        if self.delay:
+            time.sleep(self.delay)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def llm_response(i: int) -> Dict[str, object]:
+    return {
+        "id": f"chat-{i}",
+        "type": "textResponse",
+        "textResponse": "我理解你现在的感受。" * 150,
+        "sources": [{"title": f"资源 {n}", "text": "相关内容片段。" * 40} for n in range(3)],
+        "close": True,
+        "error": None,
+    }
+
+
+async def legacy_request(i: int, result: Dict[str, object], log: logging.Logger, chat: logging.Logger, http: logging.Logger) -> None:
+    session_id, url = f"session-{i}", "http://127.0.0.1:3001/api/v1/workspace/demo/thread/t/chat"
+    log.info(f"Chat request for session_id: {session_id}")
+    log.info(f"Found existing thread_id: thread-{i}")
+    log.info(f"Sending request to: {url}")
+    http.info(f'HTTP Request: POST {url} "HTTP/1.1 200 OK"')
+    log.debug(f"Raw response: {result}")
+
+
+async def queued_request(i: int, result: Dict[str, object], log: logging.Logger, chat: logging.Logger, http: logging.Logger) -> None:
+    session_id, url = f"session-{i}", "http://127.0.0.1:3001/api/v1/workspace/demo/thread/t/chat"
+    chat.info("Chat request for session_id: %s", session_id)
+    chat.info("Found existing thread_id: %s", f"thread-{i}")
+    chat.info("Sending request to: %s", url)
+    http.info('HTTP Request: %s %s "%s %d %s"', "POST", url, "HTTP/1.1", 200, "OK")
+    log.debug("Raw response: %s", result)
+
+
+async def drive(request, requests: int) -> List[float]:
+    log, chat, http = logging.getLogger("main"), logging.getLogger("main.chat"), logging.getLogger("httpx")
+    timings = []
+    for i in range(requests):
+        result = llm_response(i)  # The parsed upstream JSON; building it is not part of logging
+        token = request_id_var.set(f"req-{i:08d}")
+        started = time.perf_counter()
+        await request(i, result, log, chat, http)
+        timings.append((time.perf_counter() - started) * 1000)
+        request_id_var.reset(token)
+        if i % 50 == 0:
+            await asyncio.sleep(0)  # Let the loop breathe like a real server would
+    return timings
+
+
+def summarize(timings: List[float], elapsed: float, lines: int) -> Dict[str, object]:
+    timings.sort()
+    return {
+        "loop_ms_per_request_mean": round(statistics.mean(timings), 4),
+        "loop_ms_per_request_p50": round(timings[len(timings) // 2], 4),
+        "loop_ms_per_request_p99": round(timings[int(len(timings) * 0.99)], 4),
+        "total_s": round(elapsed, 3),
+        "lines_written": lines,
+    }
+
+
+def count_lines(path: str) -> int:
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--sink-delay-ms", type=float, default=0.0, help="extra latency of every write to the log sink")
+    parser.add_argument("--sample", type=float, default=1.0, help="rate kept for main.chat and httpx INFO lines (queued)")
+    args = parser.parse_args()
+    delay = args.sink_delay_ms / 1000
+    workdir = tempfile.mkdtemp(prefix="psychat-bench-logging-")
+    results = {}
+
+    # legacy: the previous basicConfig setup
+    path = os.path.join(workdir, "legacy.log")
+    sink = SlowFile(path, delay)
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(sink)]
+    root.handlers[0].setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    root.setLevel(logging.INFO)
+    started = time.perf_counter()
+    timings = asyncio.run(drive(legacy_request, args.requests))
+    elapsed = time.perf_counter() - started
+    sink.close()
+    results["legacy"] = summarize(timings, elapsed, count_lines(path))
+
+    # queued: logconfig.setup_logging with a JSON writer thread
+    path = os.path.join(workdir, "queued.log")
+    sink = SlowFile(path, delay)
+    rates = {"main.chat": args.sample, "httpx": args.sample} if args.sample < 1 else None
+    setup_logging("INFO", "json", rates, queue_size=args.requests * 10, target=logging.StreamHandler(sink))
+    started = time.perf_counter()
+    timings = asyncio.run(drive(queued_request, args.requests))
+    elapsed = time.perf_counter() - started
+    stop_logging()  # Drain the queue (not counted: it runs off the event loop)
+    sink.close()
+    results["queued"] = summarize(timings, elapsed, count_lines(path))
+
+    print(json.dumps({
+        "benchmark": "request_path_logging",
+        "config": vars(args),
+        **results,
+        "loop_ms_saved_per_request": round(
+            results["legacy"]["loop_ms_per_request_mean"] - results["queued"]["loop_ms_per_request_mean"], 4),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
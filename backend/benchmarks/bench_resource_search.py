@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+资源全文搜索基准测试
+
+在一张临时表中生成大量合成资源数据 (默认 300,000 行)，对比:
+  * like:     title/description LIKE '%关键词%' (全表扫描，搜索接口之前客户端只能这样做)
+  * fulltext: ngram FULLTEXT 索引 + MATCH ... AGAINST，按相关度排序 (/api/resources/search 的查询)
+
+使用 backend/.env 中的数据库配置，需要有建表权限。结果以 JSON 输出到标准输出，便于回归对比。
+
+用法:
+    python benchmarks/bench_resource_search.py --rows 300000 --repeat 20
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import pymysql
+from dotenv import load_dotenv
+
+TABLE = "resources_search_bench"
+
+# 合成文本的词表 (心理健康领域常见词)
+VOCABULARY = [
+    "失眠", "焦虑", "抑郁", "压力", "情绪", "热线", "咨询", "心理", "睡眠", "创伤",
+    "家庭", "青少年", "学业", "职场", "孤独", "自助", "冥想", "放松", "危机", "干预",
+    "支持", "小组", "课程", "讲座", "医院", "门诊", "志愿者", "陪伴", "倾听", "康复",
+]
+CATEGORIES = ["crisis", "counseling", "support", "self-help", "education"]
+LOCATIONS = ["national", "beijing", "shanghai", "guangzhou", "online", "shenzhen"]
+KEYWORDS = ["失眠", "焦虑热线", "青少年心理", "冥想放松"]
+
+
+def connect():
+    return pymysql.connect(
+        host=os.getenv("DB_HOST", "localhost"),
+        port=int(os.getenv("DB_PORT", "3306")),
+        user=os.getenv("DB_USER", "root"),
+        password=os.getenv("DB_PASSWORD", ""),
+        database=os.getenv("DB_NAME", "psychat"),
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=True,
+    )
+
+
+def synthetic_text(rng: random.Random, words: int) -> str:
+    return "".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def load_rows(conn, rows: int, batch: int, seed: int) -> float:
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(f"""
+            CREATE TABLE {TABLE} (
+              id INT AUTO_INCREMENT PRIMARY KEY,
+              title VARCHAR(255) NOT NULL,
+              description TEXT,
+              category VARCHAR(50),
+              location_tag VARCHAR(50),
+              created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+              INDEX idx_category_location_created (category, location_tag, created_at, id)
+            ) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci
+        """)
+        for offset in range(0, rows, batch):
+            values = [
+                (synthetic_text(rng, 4), synthetic_text(rng, 30), rng.choice(CATEGORIES), rng.choice(LOCATIONS))
+                for _ in range(min(batch, rows - offset))
+            ]
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (title, description, category, location_tag) VALUES (%s, %s, %s, %s)",
+                values,
+            )
+        # 批量导入后再建全文索引，比边插入边维护索引快得多
+        index_started = time.perf_counter()
+        cursor.execute(f"ALTER TABLE {TABLE} ADD FULLTEXT INDEX ft_title_description (title, description) WITH PARSER ngram")
+        print(f"fulltext index built in {time.perf_counter() - index_started:.1f}s", file=sys.stderr)
+    return time.perf_counter() - started
+
+
+def time_query(conn, sql: str, params, repeat: int):
+    timings = []
+    row_count = 0
+    with conn.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            cursor.execute(sql, params)
+            row_count = len(cursor.fetchall())
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "rows": row_count,
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=300_000)
+    parser.add_argument("--batch", type=int, default=5_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark table afterwards")
+    args = parser.parse_args()
+
+    conn = connect()
+    try:
+        load_seconds = load_rows(conn, args.rows, args.batch, args.seed)
+        results = []
+        for keyword in KEYWORDS:
+            like = time_query(
+                conn,
+                f"SELECT id, title FROM {TABLE} WHERE (title LIKE %s OR description LIKE %s) "
+                f"AND category = %s ORDER BY created_at DESC, id DESC LIMIT %s",
+                (f"%{keyword}%", f"%{keyword}%", "crisis", args.limit),
+                args.repeat,
+            )
+            match = "MATCH(title, description) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+            fulltext = time_query(
+                conn,
+                f"SELECT id, title, {match} AS relevance FROM {TABLE} WHERE {match} "
+                f"AND category = %s ORDER BY relevance DESC, id DESC LIMIT %s",
+                (keyword, keyword, "crisis", args.limit),
+                args.repeat,
+            )
+            results.append({"keyword": keyword, "like": like, "fulltext": fulltext})
+        print(json.dumps({
+            "benchmark": "resource_search",
+            "rows": args.rows,
+            "load_seconds": round(load_seconds, 1),
+            "repeat": args.repeat,
+            "results": results,
+        }, ensure_ascii=False, indent=2))
+    finally:
+        if not args.keep:
+            with conn.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+多 worker 扩展性测试
+
+对每个 worker 数 (--workers 1,2,4) 用 gunicorn.conf.py 启动一次生产模式后端，以固定并发 (闭环) 压测，
+输出每种配置的吞吐量、p50/p95/p99 延迟以及相对单 worker 的加速比。
+
+压测的端点不依赖 MySQL，只测后端本身的 CPU 开销:
+  * root: GET / (路由 + 中间件 + JSON 序列化的最小开销)
+  * chat: POST /api/chat 无会话、重复的常见问题，预热后全部命中回复缓存
+    (请求解析、消息归一化、缓存查找和响应序列化)，偶尔的未命中由 AnythingLLM 替身回答。
+压测客户端本身也占用 CPU，由 --clients 个进程并行发送请求；客户端与后端在同一台机器上时，
+worker 数超过 (CPU 核数 - 客户端进程数) 后吞吐量不会继续增长。
+
+用法:
+    python benchmarks/bench_workers.py --workers 1,2,4 --duration 15 --concurrency 64 --clients 2
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench_load import QUESTIONS, free_port, percentile, start_process, stop_process, wait_until_ready
+
+
+def client_process(base_url: str, target: str, concurrency: int, duration: float, seed: int) -> Dict[str, object]:
+    """One load-generating process: ``concurrency`` connections, each sending back-to-back requests."""
+    rng = random.Random(seed)
+
+    async def run():
+        latencies: List[float] = []
+        errors = 0
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+            deadline = time.perf_counter() + duration
+
+            async def connection():
+                nonlocal errors
+                while time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    try:
+                        if target == "chat":
+                            response = await client.post("/api/chat", json={"message": rng.choice(QUESTIONS)})
+                        else:
+                            response = await client.get("/")
+                        ok = response.status_code == 200
+                    except httpx.HTTPError:
+                        ok = False
+                    if ok:
+                        latencies.append((time.perf_counter() - started) * 1000)
+                    else:
+                        errors += 1
+
+            await asyncio.gather(*(connection() for _ in range(concurrency)))
+        return {"latencies": latencies, "errors": errors}
+
+    return asyncio.run(run())
+
+
+def run_load(base_url: str, target: str, args) -> Dict[str, object]:
+    per_client = max(1, args.concurrency // args.clients)
+    with multiprocessing.Pool(args.clients) as pool:
+        started = time.perf_counter()
+        results = pool.starmap(client_process, [
+            (base_url, target, per_client, args.duration, args.seed + i) for i in range(args.clients)
+        ])
+        elapsed = time.perf_counter() - started
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    summary: Dict[str, object] = {
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+    if latencies:
+        summary.update({
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+        })
+    return summary
+
+
+def bench_workers(workers: int, llm_port: int, args) -> Dict[str, object]:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "WEB_CONCURRENCY": str(workers),
+        "HOST": "127.0.0.1",
+        "PORT": str(port),
+        "ANYTHINGLLM_API_BASE_URL": f"http://127.0.0.1:{llm_port}/api",
+        "ANYTHINGLLM_WORKSPACE_SLUG": "bench",
+        "METRICS_ROLLUP_ENABLED": "false",
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(args.metrics_dir, f"w{workers}"),
+    })
+    server = start_process(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"], env, f"psychat-bench-w{workers}")
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(f"{base_url}/", server)
+        results = {}
+        for target in args.targets:
+            warmup = argparse.Namespace(**{**vars(args), "duration": args.warmup})
+            run_load(base_url, target, warmup)  # Fill every worker's reply cache, open keep-alive connections
+            results[target] = run_load(base_url, target, args)
+        return results
+    finally:
+        stop_process(server)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts to compare")
+    parser.add_argument("--targets", default="root,chat", help="comma-separated subset of: root, chat")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load per target and worker count")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--concurrency", type=int, default=64, help="total concurrent connections")
+    parser.add_argument("--clients", type=int, default=2, help="load-generator processes")
+    parser.add_argument("--metrics-dir", default=os.path.join(tempfile.gettempdir(), "psychat-bench-metrics"))
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    args.targets = [t.strip() for t in args.targets.split(",") if t.strip()]
+    worker_counts = [int(w) for w in args.workers.split(",")]
+
+    llm_port = free_port()
+    llm = start_process([
+        sys.executable, "benchmarks/fake_anythingllm.py", "--port", str(llm_port), "--latency", "0.05", "--jitter", "0",
+    ], dict(os.environ), "psychat-bench-llm")
+    try:
+        wait_until_ready(f"http://127.0.0.1:{llm_port}/stats", llm)
+        runs = {workers: bench_workers(workers, llm_port, args) for workers in worker_counts}
+    finally:
+        stop_process(llm)
+
+    baseline = runs[worker_counts[0]]
+    for results in runs.values():
+        for target, summary in results.items():
+            base_rps = baseline[target]["throughput_rps"]
+            summary["speedup"] = round(summary["throughput_rps"] / base_rps, 2) if base_rps else None
+    report = {
+        "benchmark": "workers",
+        "cpu_count": multiprocessing.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key != "metrics_dir"},
+        "runs": {str(workers): results for workers, results in runs.items()},
+    }
+    needed = max(worker_counts) + args.clients
+    if report["cpu_count"] < needed:
+        report["warning"] = (
+            f"{report['cpu_count']} CPU(s) for up to {max(worker_counts)} workers + {args.clients} client processes: "
+            f"the speedups above cannot show multi-core scaling; run on a host with at least {needed} cores")
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
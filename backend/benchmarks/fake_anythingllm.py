@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+AnythingLLM 替身服务 (用于负载测试)
+
+实现后端用到的 AnythingLLM 接口，回复内容为固定模板，延迟、抖动、错误率和流式分块数可配置:
+  POST   /api/v1/workspace/{slug}/thread/new
+  DELETE /api/v1/workspace/{slug}/thread/{thread}
+  GET    /api/ping
+  POST   /api/v1/workspace/{slug}/chat                 POST /api/v1/workspace/{slug}/thread/{thread}/chat
+  POST   /api/v1/workspace/{slug}/stream-chat          POST /api/v1/workspace/{slug}/thread/{thread}/stream-chat
+
+后端的 ANYTHINGLLM_API_BASE_URL 设为 http://127.0.0.1:<port>/api 即可。
+
+用法:
+    python benchmarks/fake_anythingllm.py --port 3901 --latency 1.5 --jitter 0.5 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+def create_app(latency: float, jitter: float, error_rate: float, tokens: int, seed: int = 0) -> FastAPI:
+    app = FastAPI(title="Fake AnythingLLM")
+    rng = random.Random(seed)
+    thread_ids = itertools.count(1)
+    stats = {"chat": 0, "stream": 0, "threads": 0, "errors": 0}
+
+    def sample_latency() -> float:
+        return max(0.0, rng.uniform(latency - jitter, latency + jitter))
+
+    def should_fail() -> bool:
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return True
+        return False
+
+    def error_response():
+        return JSONResponse(status_code=500, content={"error": {"message": "simulated upstream failure"}})
+
+    def reply_text(message: str) -> str:
+        return f"这是模拟回复：{message[:50]}"
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.get("/api/ping")
+    async def ping():
+        return {"online": True}
+
+    @app.post("/api/v1/workspace/{slug}/thread/new")
+    async def new_thread(slug: str):
+        await asyncio.sleep(sample_latency() / 10)  # 创建线程比生成回复快得多
+        if should_fail():
+            return error_response()
+        stats["threads"] += 1
+        thread_slug = f"fake-{next(thread_ids)}"
+        return {"thread": {"slug": thread_slug}, "threadSlug": thread_slug}
+
+    @app.delete("/api/v1/workspace/{slug}/thread/{thread}")
+    async def delete_thread(slug: str, thread: str):
+        return {"success": True}
+
+    async def chat(body: dict):
+        await asyncio.sleep(sample_latency())
+        if should_fail():
+            return error_response()
+        stats["chat"] += 1
+        return {"type": "textResponse", "textResponse": reply_text(body.get("message", "")), "close": True, "error": None}
+
+    async def stream_chat(body: dict):
+        if should_fail():
+            return error_response()
+        stats["stream"] += 1
+        text = reply_text(body.get("message", ""))
+        step = max(1, len(text) // tokens)
+        delay = sample_latency() / tokens
+
+        async def events():
+            for start in range(0, len(text), step):
+                await asyncio.sleep(delay)
+                chunk = {"type": "textResponseChunk", "textResponse": text[start:start + step], "close": False, "error": None}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps({'type': 'finalizeResponseStream', 'textResponse': '', 'close': True, 'error': None})}\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/api/v1/workspace/{slug}/chat")
+    async def workspace_chat(slug: str, body: dict):
+        return await chat(body)
+
+    @app.post("/api/v1/workspace/{slug}/thread/{thread}/chat")
+    async def thread_chat(slug: str, thread: str, body: dict):
+        return await chat(body)
+
+    @app.post("/api/v1/workspace/{slug}/stream-chat")
+    async def workspace_stream_chat(slug: str, body: dict):
+        return await stream_chat(body)
+
+    @app.post("/api/v1/workspace/{slug}/thread/{thread}/stream-chat")
+    async def thread_stream_chat(slug: str, thread: str, body: dict):
+        return await stream_chat(body)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3901)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per chat reply")
+    parser.add_argument("--jitter", type=float, default=0.3, help="latency is uniform in [latency-jitter, latency+jitter]")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with HTTP 500")
+    parser.add_argument("--tokens", type=int, default=20, help="chunks per streamed reply")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    app = create_app(args.latency, args.jitter, args.error_rate, args.tokens, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Circuit breaker for the AnythingLLM upstream.
+
+* closed:    calls go through; outcomes are kept for the last ``window`` seconds.
+             Once at least ``min_calls`` were seen and the failure ratio reaches
+             ``failure_threshold``, the circuit opens.
+* open:      calls are refused immediately with ``CircuitOpenError`` for
+             ``open_duration`` seconds.
+* half-open: up to ``half_open_calls`` probe calls are let through; one
+             success closes the circuit, one failure opens it again.
+
+Only errors that mean "the upstream is not answering" count as failures
+(timeouts, connect/transport errors, 5xx/429, see ``limiter.is_overload_error``).
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, Tuple
+
+from limiter import LimiterRejected, is_overload_error
+from metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """The circuit is open; the upstream is not called."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Circuit {name} is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_threshold: float = 0.5,
+        min_calls: int = 10,
+        window: float = 30.0,
+        open_duration: float = 30.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self._clock = clock
+        self.state = CLOSED
+        self._outcomes: Deque[Tuple[float, bool]] = deque()  # (timestamp, failed), closed state only
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.rejected = 0
+        self.publish()
+
+    def stats(self) -> Dict[str, Any]:
+        self._trim(self._clock())
+        return {
+            "state": self.state,
+            "recent_calls": len(self._outcomes),
+            "recent_failures": self._failures,
+            "rejected": self.rejected,
+        }
+
+    def publish(self) -> None:
+        """Export the current state (again after a fork: the preloading master's gauge value is not inherited)."""
+        CIRCUIT_STATE.set(_STATE_VALUES[self.state])
+
+    def retry_after(self) -> int:
+        remaining = self._opened_at + self.open_duration - self._clock()
+        return max(1, int(remaining + 0.999))
+
+    # --- Guarding calls ---
+
+    def allow(self) -> None:
+        """Raise ``CircuitOpenError`` unless a call may go to the upstream now."""
+        if self.state == OPEN:
+            if self._clock() - self._opened_at < self.open_duration:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self.retry_after())
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, 1)
+            self._probes += 1
+
+    def record(self, failed: bool) -> None:
+        now = self._clock()
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            self._transition(OPEN if failed else CLOSED)
+            return
+        if self.state == OPEN:
+            return  # A call admitted before the circuit opened; nothing new to learn
+        self._outcomes.append((now, failed))
+        if failed:
+            self._failures += 1
+        self._trim(now)
+        calls = len(self._outcomes)
+        if calls >= self.min_calls and self._failures / calls >= self.failure_threshold:
+            self._transition(OPEN)
+
+    def release_probe(self) -> None:
+        """A half-open probe ended without telling us anything (cancelled, rejected elsewhere)."""
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """``with breaker.guard():`` around one upstream call."""
+        self.allow()
+        try:
+            yield
+        except (asyncio.CancelledError, LimiterRejected):
+            self.release_probe()
+            raise
+        except BaseException as e:
+            if is_overload_error(e):
+                self.record(failed=True)
+            else:
+                self.record(failed=False)  # e.g. a 4xx: the upstream answered
+            raise
+        else:
+            self.record(failed=False)
+
+    # --- Internals ---
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            _, failed = self._outcomes.popleft()
+            if failed:
+                self._failures -= 1
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = self._clock()
+        if state != HALF_OPEN:
+            self._probes = 0
+        self._outcomes.clear()
+        self._failures = 0
+        self.publish()
+        CIRCUIT_TRANSITIONS.labels(state).inc()
@@ -0,0 +1,8 @@
+-- 迁移 1.1.0: 为 resources.updated_at 添加索引
+-- /api/resources 的响应缓存通过 COUNT(*) + MAX(updated_at) 判断表是否变化，
+-- 该索引让 MAX(updated_at) 只需读取索引的一端，而不是扫描全表。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.1.0_resources_updated_at_index.sql
+
+CREATE INDEX idx_updated ON resources (updated_at);
+
+INSERT INTO db_version (version, description) VALUES ('1.1.0', 'resources.updated_at 索引 (资源缓存失效检查)');
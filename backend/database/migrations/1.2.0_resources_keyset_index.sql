@@ -0,0 +1,10 @@
+-- 迁移 1.2.0: 资源列表游标分页的复合索引
+-- /api/resources 按 (created_at, id) 倒序做游标分页，并可按 category / location_tag 过滤。
+-- (category, location_tag, created_at, id) 让带过滤条件的分页成为索引范围扫描，不再需要 filesort。
+-- 原有的 idx_category 是新索引的前缀，因此删除。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.2.0_resources_keyset_index.sql
+
+CREATE INDEX idx_category_location_created ON resources (category, location_tag, created_at, id);
+DROP INDEX idx_category ON resources;
+
+INSERT INTO db_version (version, description) VALUES ('1.2.0', 'resources 游标分页复合索引');
@@ -0,0 +1,9 @@
+-- 迁移 1.3.0: 资源全文搜索索引 (ngram 解析器，支持中文)
+-- /api/resources/search 使用 MATCH(title, description) AGAINST (... IN NATURAL LANGUAGE MODE) 按相关度排序。
+-- ngram 解析器按 ngram_token_size (默认 2) 切分文本，"失眠"、"焦虑热线" 等中文关键词无需额外分词。
+-- 大表上建索引耗时较长，建议在低峰期执行。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.3.0_resources_fulltext_ngram.sql
+
+ALTER TABLE resources ADD FULLTEXT INDEX ft_title_description (title, description) WITH PARSER ngram;
+
+INSERT INTO db_version (version, description) VALUES ('1.3.0', 'resources 全文搜索索引 (ngram)');
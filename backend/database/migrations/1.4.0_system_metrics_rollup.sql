@@ -0,0 +1,13 @@
+-- 迁移 1.4.0: system_metrics 定期汇总
+-- 后端每分钟把请求数、错误数、p50/p95/p99 延迟等批量写入 system_metrics，
+-- 每小时把超过 METRICS_DOWNSAMPLE_AFTER_HOURS 的分钟数据合并为每小时一行，并删除超过 METRICS_RETENTION_DAYS 的数据。
+-- 复合索引用于按指标名查询时间范围 (报表) 以及降采样时的分组。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.4.0_system_metrics_rollup.sql
+
+ALTER TABLE system_metrics ADD INDEX idx_metric_name_measured (metric_name, measured_at);
+
+-- 应用账户需要写入、降采样和清理权限
+GRANT SELECT, INSERT, DELETE ON psychat.system_metrics TO 'psychat_app'@'%';
+FLUSH PRIVILEGES;
+
+INSERT INTO db_version (version, description) VALUES ('1.4.0', 'system_metrics 汇总索引与写入权限');
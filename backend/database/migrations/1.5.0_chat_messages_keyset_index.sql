@@ -0,0 +1,10 @@
+-- 迁移 1.5.0: 聊天记录游标分页的复合索引
+-- /api/sessions/{id}/messages 按 (created_at, id) 做游标分页。
+-- (session_id, created_at, id) 让每一页都是索引范围扫描，长会话也不需要 filesort。
+-- 原有的 idx_session 是新索引的前缀，外键可以改用新索引，因此删除。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.5.0_chat_messages_keyset_index.sql
+
+CREATE INDEX idx_session_created ON chat_messages (session_id, created_at, id);
+DROP INDEX idx_session ON chat_messages;
+
+INSERT INTO db_version (version, description) VALUES ('1.5.0', 'chat_messages 游标分页复合索引');
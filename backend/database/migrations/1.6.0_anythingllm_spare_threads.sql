@@ -0,0 +1,20 @@
+-- 迁移 1.6.0: 预先创建的 AnythingLLM 线程
+-- 新会话的第一条消息原本要先等待 POST /thread/new 再发起聊天。每个后端 worker 在后台预先创建少量线程，
+-- 新会话直接领取。未被领取的线程记录在此表中并租给持有它的 worker，重启或 worker 崩溃 (租约过期) 后由其他 worker 接管。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.6.0_anythingllm_spare_threads.sql
+
+CREATE TABLE IF NOT EXISTS anythingllm_spare_threads (
+  thread_slug VARCHAR(255) PRIMARY KEY,       -- 已在 AnythingLLM 中创建、尚未分配给会话的线程
+  workspace_slug VARCHAR(100) NOT NULL,
+  owner VARCHAR(100) NULL,                    -- 持有该线程的后端 worker (主机名:进程号:随机后缀)，NULL 表示无人持有
+  leased_until TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- 租约到期后其他 worker 可以接管
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_workspace_lease (workspace_slug, leased_until),
+  INDEX idx_owner (owner)
+);
+
+GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.anythingllm_spare_threads TO 'psychat_app'@'%';
+FLUSH PRIVILEGES;
+
+INSERT INTO db_version (version, description) VALUES ('1.6.0', '预先创建的 AnythingLLM 线程表');
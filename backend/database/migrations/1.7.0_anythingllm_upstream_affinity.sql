@@ -0,0 +1,12 @@
+-- 迁移 1.7.0: 多个 AnythingLLM 实例的会话亲和
+-- ANYTHINGLLM_API_BASE_URL 可配置多个实例。线程只存在于创建它的实例上，因此记录每个会话线程所在实例的基础URL，
+-- 之后该会话的消息都发往该实例；预先创建的备用线程同样按实例区分。NULL 表示主实例 (配置中的第一个)，即升级前的单实例。
+-- 用法: mysql -u <user> -p psychat < database/migrations/1.7.0_anythingllm_upstream_affinity.sql
+
+ALTER TABLE chat_sessions
+  ADD COLUMN anythingllm_upstream VARCHAR(255) NULL AFTER anythingllm_thread_id; -- 线程所在的 AnythingLLM 实例
+
+ALTER TABLE anythingllm_spare_threads
+  ADD COLUMN upstream VARCHAR(255) NULL AFTER workspace_slug; -- 创建该线程的 AnythingLLM 实例
+
+INSERT INTO db_version (version, description) VALUES ('1.7.0', '多个 AnythingLLM 实例的会话亲和');
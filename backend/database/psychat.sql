@@ -21,9 +21,11 @@ CREATE TABLE IF NOT EXISTS resources (
   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   
   -- 添加索引以提高筛选性能
-  INDEX idx_category (category),
+  INDEX idx_category_location_created (category, location_tag, created_at, id),  -- 游标分页 (带过滤条件)
   INDEX idx_location (location_tag),
-  INDEX idx_created (created_at)
+  INDEX idx_created (created_at),
+  INDEX idx_updated (updated_at),  -- 资源缓存通过 MAX(updated_at) 判断是否失效
+  FULLTEXT INDEX ft_title_description (title, description) WITH PARSER ngram  -- 全文搜索 (支持中文)
 );
 
 -- 插入示例资源数据
@@ -57,6 +59,7 @@ CREATE TABLE IF NOT EXISTS chat_sessions (
   id VARCHAR(36) PRIMARY KEY,     -- Application-specific session ID (e.g., UUID generated by client)
   name VARCHAR(255),              -- 会话名称，可以是基于第一条消息自动生成的
   anythingllm_thread_id VARCHAR(255) NULL, -- Stores the threadSlug from AnythingLLM
+  anythingllm_upstream VARCHAR(255) NULL, -- 线程所在的 AnythingLLM 实例 (基础URL)，NULL 表示主实例
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   
@@ -72,10 +75,35 @@ CREATE TABLE IF NOT EXISTS chat_messages (
   content TEXT NOT NULL,
   created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
   
-  INDEX idx_session (session_id),
+  INDEX idx_session_created (session_id, created_at, id),  -- 聊天记录游标分页
   FOREIGN KEY (session_id) REFERENCES chat_sessions(id) ON DELETE CASCADE
 );
 
+-- 预先创建的 AnythingLLM 线程 (新会话直接领取，后端重启后继续使用)
+CREATE TABLE IF NOT EXISTS anythingllm_spare_threads (
+  thread_slug VARCHAR(255) PRIMARY KEY,       -- 已在 AnythingLLM 中创建、尚未分配给会话的线程
+  workspace_slug VARCHAR(100) NOT NULL,
+  upstream VARCHAR(255) NULL,                 -- 创建该线程的 AnythingLLM 实例，NULL 表示主实例
+  owner VARCHAR(100) NULL,                    -- 持有该线程的后端 worker (主机名:进程号:随机后缀)，NULL 表示无人持有
+  leased_until TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP, -- 租约到期后其他 worker 可以接管
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+  INDEX idx_workspace_lease (workspace_slug, leased_until),
+  INDEX idx_owner (owner)
+);
+
+-- 添加统计和监控表
+CREATE TABLE IF NOT EXISTS system_metrics (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  metric_name VARCHAR(50) NOT NULL,
+  metric_value FLOAT NOT NULL,
+  measured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  
+  INDEX idx_metric_name (metric_name),
+  INDEX idx_measured_at (measured_at),
+  INDEX idx_metric_name_measured (metric_name, measured_at)
+);
+
 -- =============================================
 -- 生产环境配置
 -- =============================================
@@ -90,6 +118,8 @@ GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.resources TO 'psychat_app'@'%';
 GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.feedback TO 'psychat_app'@'%';
 GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.chat_sessions TO 'psychat_app'@'%';
 GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.chat_messages TO 'psychat_app'@'%';
+GRANT SELECT, INSERT, DELETE ON psychat.system_metrics TO 'psychat_app'@'%';
+GRANT SELECT, INSERT, UPDATE, DELETE ON psychat.anythingllm_spare_threads TO 'psychat_app'@'%';
 
 -- 只读账户 - 用于报表和监控
 GRANT SELECT ON psychat.* TO 'psychat_readonly'@'%';
@@ -104,17 +134,6 @@ FLUSH PRIVILEGES;
 ALTER TABLE chat_messages ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
 ALTER TABLE resources ROW_FORMAT=COMPRESSED KEY_BLOCK_SIZE=8;
 
--- 添加统计和监控表
-CREATE TABLE IF NOT EXISTS system_metrics (
-  id INT AUTO_INCREMENT PRIMARY KEY,
-  metric_name VARCHAR(50) NOT NULL,
-  metric_value FLOAT NOT NULL,
-  measured_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-  
-  INDEX idx_metric_name (metric_name),
-  INDEX idx_measured_at (measured_at)
-);
-
 -- 添加数据库版本跟踪表 (用于管理迁移和升级)
 CREATE TABLE IF NOT EXISTS db_version (
   id INT AUTO_INCREMENT PRIMARY KEY,
@@ -126,6 +145,14 @@ CREATE TABLE IF NOT EXISTS db_version (
 );
 
 INSERT INTO db_version (version, description) VALUES ('1.0.0', '初始数据库架构');
+-- 以下版本的变更已包含在本脚本中；已有数据库请执行 database/migrations/ 下对应的迁移脚本
+INSERT INTO db_version (version, description) VALUES ('1.1.0', 'resources.updated_at 索引 (资源缓存失效检查)');
+INSERT INTO db_version (version, description) VALUES ('1.2.0', 'resources 游标分页复合索引');
+INSERT INTO db_version (version, description) VALUES ('1.3.0', 'resources 全文搜索索引 (ngram)');
+INSERT INTO db_version (version, description) VALUES ('1.4.0', 'system_metrics 汇总索引与写入权限');
+INSERT INTO db_version (version, description) VALUES ('1.5.0', 'chat_messages 游标分页复合索引');
+INSERT INTO db_version (version, description) VALUES ('1.6.0', '预先创建的 AnythingLLM 线程表');
+INSERT INTO db_version (version, description) VALUES ('1.7.0', '多个 AnythingLLM 实例的会话亲和');
 
 -- =============================================
 -- 维护脚本说明 (生产环境)
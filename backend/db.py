@@ -0,0 +1,419 @@
+"""
+Async connection pool for MySQL built on top of PyMySQL.
+
+PyMySQL is a blocking driver, so every operation that touches the socket
+(connect, ping, query, close) is run in the threadpool. The event loop only
+awaits, and a slow handshake or query never freezes other requests.
+
+Connections are opened with ``autocommit=True`` so that a pooled connection
+never carries an open REPEATABLE READ snapshot from one request to the next.
+Use ``AsyncConnection.transaction()`` when several statements must be atomic.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import pymysql
+from starlette.concurrency import run_in_threadpool
+
+from metrics import DB_ACQUIRE_DURATION, DB_CONNECTIONS_IN_USE, DB_QUERY_DURATION
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection can no longer be trusted and must be dropped
+_DISCONNECT_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+
+class PoolTimeoutError(Exception):
+    """No connection became available within ``acquire_timeout`` seconds."""
+
+
+class PoolClosedError(Exception):
+    """The pool has been closed (application is shutting down)."""
+
+
+def _fetchone(raw, sql: str, params: Optional[Sequence[Any]]):
+    with raw.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def _fetchall(raw, sql: str, params: Optional[Sequence[Any]]):
+    with raw.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.description, cursor.fetchall()
+
+
+def _execute(raw, sql: str, params: Optional[Sequence[Any]]) -> int:
+    with raw.cursor() as cursor:
+        return cursor.execute(sql, params)
+
+
+def _executemany(raw, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> int:
+    with raw.cursor() as cursor:
+        return cursor.executemany(sql, seq_of_params) or 0
+
+
+def _open_unbuffered(raw, sql: str, params: Optional[Sequence[Any]]):
+    cursor = raw.cursor(pymysql.cursors.SSDictCursor)
+    cursor.execute(sql, params)
+    return cursor
+
+
+def _fetchmany(raw, cursor, size: int):
+    return cursor.fetchmany(size)
+
+
+class AsyncConnection:
+    """
+    Async facade over a single pooled PyMySQL connection.
+    Each helper runs one complete cursor round trip in the threadpool.
+    ``description`` holds the DB-API column metadata of the last fetchall()/stream() result.
+    """
+
+    __slots__ = ("raw", "created_at", "last_used", "broken", "description")
+
+    def __init__(self, raw):
+        self.raw = raw
+        now = time.monotonic()
+        self.created_at = now
+        self.last_used = now
+        self.broken = False
+        self.description: Optional[Tuple[Tuple[Any, ...], ...]] = None
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run ``fn(raw_connection, *args)`` in the threadpool."""
+        started = time.perf_counter()
+        try:
+            return await run_in_threadpool(fn, self.raw, *args)
+        except _DISCONNECT_ERRORS:
+            self.broken = True
+            raise
+        except asyncio.CancelledError:
+            # The statement may or may not have completed; do not reuse the connection
+            self.broken = True
+            raise
+        finally:
+            DB_QUERY_DURATION.observe(time.perf_counter() - started)
+
+    async def fetchone(self, sql: str, params: Optional[Sequence[Any]] = None) -> Optional[Dict[str, Any]]:
+        return await self.run(_fetchone, sql, params)
+
+    async def fetchall(self, sql: str, params: Optional[Sequence[Any]] = None) -> List[Dict[str, Any]]:
+        self.description, rows = await self.run(_fetchall, sql, params)
+        return rows
+
+    async def execute(self, sql: str, params: Optional[Sequence[Any]] = None) -> int:
+        return await self.run(_execute, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params: Sequence[Sequence[Any]]) -> int:
+        return await self.run(_executemany, sql, seq_of_params)
+
+    async def stream(
+        self, sql: str, params: Optional[Sequence[Any]] = None, *, batch_size: int = 500
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        Yield the result in lists of up to ``batch_size`` rows read from an unbuffered
+        (server-side) cursor, so a large result is never held in memory at once.
+
+        The connection cannot run other statements until the iterator is exhausted. If it is
+        closed early (client went away, error), the unread rows are still on the socket, so the
+        connection is marked broken and dropped by the pool instead of being drained. Wrap the
+        iterator in ``contextlib.aclosing()`` so this happens before the connection is released.
+        """
+        cursor = await self.run(_open_unbuffered, sql, params)
+        self.description = cursor.description
+        finished = False
+        try:
+            while True:
+                rows = await self.run(_fetchmany, cursor, batch_size)
+                if not rows:
+                    finished = True
+                    break
+                yield rows
+        finally:
+            if finished:
+                cursor.close()  # Result fully read; no I/O left
+            else:
+                self.broken = True
+
+    async def commit(self) -> None:
+        await self.run(lambda raw: raw.commit())
+
+    async def rollback(self) -> None:
+        await self.run(lambda raw: raw.rollback())
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator["AsyncConnection"]:
+        """Group several statements into one transaction (commit on success, rollback on error)."""
+        await self.run(lambda raw: raw.begin())
+        try:
+            yield self
+        except BaseException:
+            if not self.broken:
+                await self.rollback()
+            raise
+        else:
+            await self.commit()
+
+
+class DatabasePool:
+    """
+    Bounded pool of PyMySQL connections.
+
+    * ``minsize`` connections are opened on startup and kept warm.
+    * At most ``maxsize`` connections exist at any time; further acquirers wait
+      up to ``acquire_timeout`` seconds and then get ``PoolTimeoutError``.
+    * Idle connections above ``minsize`` are closed after ``idle_timeout`` seconds.
+    * Connections older than ``recycle`` seconds are replaced on checkout/release.
+    * With ``pre_ping`` enabled, a connection that sat idle for more than
+      ``ping_interval`` seconds is pinged before being handed out.
+    """
+
+    def __init__(
+        self,
+        *,
+        minsize: int = 1,
+        maxsize: int = 10,
+        idle_timeout: float = 300.0,
+        recycle: float = 3600.0,
+        pre_ping: bool = True,
+        ping_interval: float = 30.0,
+        acquire_timeout: float = 5.0,
+        **connect_kwargs: Any,
+    ):
+        if maxsize < 1 or minsize < 0 or minsize > maxsize:
+            raise ValueError(f"Invalid pool size: minsize={minsize}, maxsize={maxsize}")
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+        self.acquire_timeout = acquire_timeout
+        self._connect_kwargs = connect_kwargs
+
+        self._idle: Deque[AsyncConnection] = deque()  # right end = most recently used
+        self._size = 0  # idle + in use + being opened
+        self._waiting = 0
+        self._cond: Optional[asyncio.Condition] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._closed = False
+
+    # --- Introspection ---
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self._size,
+            "idle": len(self._idle),
+            "in_use": self._size - len(self._idle),
+            "waiting": self._waiting,
+            "maxsize": self.maxsize,
+        }
+
+    # --- Lifecycle ---
+
+    async def open(self) -> None:
+        """Warm up ``minsize`` connections and start the idle reaper. Never raises on DB errors."""
+        self._cond = asyncio.Condition()
+        self._closed = False
+        await self._fill_to_minsize()
+        self._reaper = asyncio.create_task(self._reap_idle())
+        logger.info(f"Database pool opened: {self.stats()}")
+
+    async def close(self) -> None:
+        """Close idle connections; connections still in use are closed when released."""
+        self._closed = True
+        if self._reaper:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        idle = list(self._idle)
+        self._idle.clear()
+        for conn in idle:
+            await self._discard(conn)
+        if self._cond:
+            async with self._cond:
+                self._cond.notify_all()
+        logger.info("Database pool closed.")
+
+    # --- Checkout / release ---
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[AsyncConnection]:
+        conn = await self.checkout()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    async def checkout(self) -> AsyncConnection:
+        started = time.perf_counter()
+        conn = await self._checkout()
+        DB_ACQUIRE_DURATION.observe(time.perf_counter() - started)
+        DB_CONNECTIONS_IN_USE.inc()
+        return conn
+
+    async def release(self, conn: AsyncConnection) -> None:
+        DB_CONNECTIONS_IN_USE.dec()
+        await self._return(conn)
+
+    # --- Internals ---
+
+    async def _checkout(self) -> AsyncConnection:
+        if self._cond is None:
+            raise PoolClosedError("Database pool is not open")
+        deadline = asyncio.get_running_loop().time() + self.acquire_timeout
+        while True:
+            conn = await self._reserve(deadline)
+            if conn is None:
+                # A slot was reserved for us: open a brand-new physical connection
+                try:
+                    return await self._open_connection()
+                except BaseException:
+                    await self._free_slot()
+                    raise
+            try:
+                usable = await self._is_usable(conn)
+            except BaseException:
+                # Cancelled during the pre-ping: the connection is out of the idle deque, so free its slot here
+                conn.broken = True
+                await self._discard(conn)
+                raise
+            if usable:
+                return conn
+            await self._discard(conn)
+
+    async def _return(self, conn: AsyncConnection) -> None:
+        if self._closed or conn.broken or self._expired(conn, time.monotonic()):
+            await self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        async with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def _connect(self):
+        return pymysql.connect(
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=True,
+            **self._connect_kwargs,
+        )
+
+    async def _open_connection(self) -> AsyncConnection:
+        # If the checkout is cancelled, the worker thread still finishes connecting;
+        # whichever side comes second (under the lock) closes the abandoned connection
+        lock = threading.Lock()
+        opened: List[Any] = []
+        abandoned = False
+
+        def connect() -> None:
+            raw = self._connect()
+            with lock:
+                if not abandoned:
+                    opened.append(raw)
+                    return
+            raw.close()
+
+        try:
+            await run_in_threadpool(connect)
+        except BaseException:
+            with lock:
+                abandoned = True
+            if opened:
+                try:
+                    await run_in_threadpool(opened[0].close)
+                except BaseException:
+                    pass
+            raise
+        return AsyncConnection(opened[0])
+
+    async def _reserve(self, deadline: float) -> Optional[AsyncConnection]:
+        """Pop an idle connection, or reserve a slot for a new one (returns None)."""
+        loop = asyncio.get_running_loop()
+        async with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolClosedError("Database pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.maxsize:
+                    self._size += 1
+                    return None
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    raise PoolTimeoutError(
+                        f"Timed out after {self.acquire_timeout}s waiting for a database connection"
+                    )
+                self._waiting += 1
+                try:
+                    await asyncio.wait_for(self._cond.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self._waiting -= 1
+
+    async def _free_slot(self) -> None:
+        async with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _expired(self, conn: AsyncConnection, now: float) -> bool:
+        return self.recycle > 0 and now - conn.created_at > self.recycle
+
+    async def _is_usable(self, conn: AsyncConnection) -> bool:
+        now = time.monotonic()
+        if self._expired(conn, now):
+            return False
+        if self.pre_ping and now - conn.last_used > self.ping_interval:
+            try:
+                await conn.run(lambda raw: raw.ping(reconnect=False))
+            except Exception as e:
+                logger.info(f"Discarding stale database connection (ping failed: {e})")
+                return False
+        return True
+
+    async def _discard(self, conn: AsyncConnection) -> None:
+        try:
+            await run_in_threadpool(conn.raw.close)
+        except Exception:
+            pass  # Already closed or the socket is gone; nothing else to clean up
+        await self._free_slot()
+
+    async def _fill_to_minsize(self) -> None:
+        while not self._closed and self._size < self.minsize:
+            async with self._cond:
+                self._size += 1
+            try:
+                conn = await self._open_connection()
+            except Exception as e:
+                await self._free_slot()
+                logger.warning(f"Database pool could not open a connection: {e}")
+                return
+            await self._return(conn)
+
+    async def _reap_idle(self) -> None:
+        interval = max(self.idle_timeout / 2, 1.0) if self.idle_timeout > 0 else 30.0
+        while not self._closed:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            stale: List[AsyncConnection] = []
+            async with self._cond:
+                # Oldest idle connections sit at the left end of the deque
+                while (
+                    self.idle_timeout > 0
+                    and self._idle
+                    and self._size - len(stale) > self.minsize
+                    and now - self._idle[0].last_used > self.idle_timeout
+                ):
+                    stale.append(self._idle.popleft())
+            for conn in stale:
+                await self._discard(conn)
+            await self._fill_to_minsize()
@@ -0,0 +1,74 @@
+"""
+Gunicorn settings for the production server (run from backend/):
+
+    gunicorn -c gunicorn.conf.py main:app
+
+* ``WEB_CONCURRENCY`` uvicorn worker processes (default: one per CPU core).
+* The app is imported once in the master (``PRELOAD_APP``) and forked, so a
+  broken import fails at boot instead of in every worker. Nothing that owns a
+  socket is created at import time: each worker opens its own DB pool and
+  HTTP client in the startup event and closes them in the shutdown event.
+* Each worker is restarted after ``MAX_REQUESTS`` (+ up to
+  ``MAX_REQUESTS_JITTER``) requests so slow leaks cannot accumulate.
+* On SIGTERM the master stops accepting connections and every worker finishes
+  its in-flight requests (streams included) for up to ``GRACEFUL_TIMEOUT``
+  seconds, then runs its shutdown event: queued chat messages, feedback and
+  metrics are flushed before the pool closes.
+* uvicorn's loggers are routed back to the app's log queue in each worker
+  (``post_worker_init``), so server lines share its format and request IDs.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+from dotenv import load_dotenv
+from uvicorn_worker import UvicornWorker
+
+load_dotenv()  # Same .env as main.py, read before the settings below
+
+# Prometheus multiprocess mode must be configured before prometheus_client is imported (preload)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "psychat-prometheus"))
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+preload_app = os.getenv("PRELOAD_APP", "true").lower() in ("1", "true", "yes")
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+accesslog = "-" if os.getenv("ACCESS_LOG", "false").lower() in ("1", "true", "yes") else None
+
+
+class PsyChatWorker(UvicornWorker):
+    # Stop waiting for open connections a few seconds before the master's SIGKILL,
+    # so the shutdown event (write-behind flush, pool close) always gets to run
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": max(1, graceful_timeout - 5),
+    }
+
+
+worker_class = PsyChatWorker
+
+
+def on_starting(server):
+    # Runs after the preload import: drop stale files from a previous run and the master's own
+    # (import-time) samples, which would otherwise be summed into every scrape
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def post_worker_init(worker):
+    # UvicornWorker gives uvicorn.error/uvicorn.access gunicorn's own handlers (and propagate=False)
+    # when it is created, after the preloaded app set up logging: route them back through the log queue
+    from logconfig import route_uvicorn_loggers
+    route_uvicorn_loggers(access_log=accesslog is not None)
+
+
+def child_exit(server, worker):
+    # Covers workers that were killed before their shutdown event could call mark_worker_exit()
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,137 @@
+"""
+Background health probing.
+
+A single task runs every registered check (e.g. ``SELECT 1`` through the DB
+pool, a ping to AnythingLLM) every ``interval`` seconds, each bounded by
+``timeout``, and keeps the last result in memory. Liveness/readiness endpoints
+answer from that snapshot, so a probe request never touches a dependency and
+cannot hang on a slow one, however often orchestrators and monitors call it.
+
+Readiness fails when a *critical* check is down, when no probe has completed
+yet, when the last probe is older than ``stale_after`` (the prober itself is
+stuck), and while the worker is shutting down. A failing non-critical check
+only marks the instance "degraded".
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+Check = Callable[[], Awaitable[Any]]
+
+
+class HealthProber:
+    def __init__(
+        self,
+        checks: Dict[str, Check],
+        *,
+        critical: Iterable[str] = (),
+        interval: float = 5.0,
+        timeout: float = 2.0,
+        stale_after: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.checks = checks
+        self.critical = set(critical)
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after if stale_after is not None else 3 * interval + timeout
+        self._clock = clock
+        self._results: Dict[str, Dict[str, Any]] = {}
+        self._last_probe: Optional[float] = None
+        self._started_at = clock()
+        self._task: Optional[asyncio.Task] = None
+        self.draining = False
+
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        self.draining = False
+        self._started_at = self._clock()
+        self._task = asyncio.create_task(self._run(), name="health-prober")
+
+    async def stop(self) -> None:
+        """Report not-ready from now on and stop probing."""
+        self.draining = True
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            started = self._clock()
+            await self.probe()
+            await asyncio.sleep(max(0.0, self.interval - (self._clock() - started)))
+
+    # --- Probing ---
+
+    async def probe(self) -> None:
+        """Run every check once, concurrently, and store the results."""
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._check(self.checks[name]) for name in names))
+        for name, result in zip(names, results):
+            previous = self._results.get(name)
+            if previous and previous["status"] != result["status"]:
+                log = logger.info if result["status"] == "up" else logger.warning
+                log(f"Health check {name}: {previous['status']} -> {result['status']} {result.get('error') or ''}")
+            self._results[name] = result
+        self._last_probe = self._clock()
+
+    async def _check(self, check: Check) -> Dict[str, Any]:
+        started = self._clock()
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+            status, error = "up", None
+        except asyncio.TimeoutError:
+            status, error = "down", f"timed out after {self.timeout}s"
+        except Exception as e:
+            status, error = "down", str(e) or type(e).__name__
+        finished = self._clock()
+        return {"status": status, "latency_ms": round((finished - started) * 1000, 2), "error": error, "at": finished}
+
+    # --- Reporting (no I/O) ---
+
+    def uptime(self) -> float:
+        return self._clock() - self._started_at
+
+    def last_probe_age(self) -> Optional[float]:
+        return None if self._last_probe is None else self._clock() - self._last_probe
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = self._clock()
+        age = self.last_probe_age()
+        checks = {
+            name: {
+                "status": result["status"],
+                "critical": name in self.critical,
+                "latency_ms": result["latency_ms"],
+                "age_seconds": round(now - result["at"], 3),
+                **({"error": result["error"]} if result["error"] else {}),
+            }
+            for name, result in self._results.items()
+        }
+        if self.draining:
+            status = "draining"
+        elif age is None:
+            status = "starting"
+        elif age > self.stale_after:
+            status = "stale"
+        elif any(c["status"] != "up" and c["critical"] for c in checks.values()):
+            status = "unavailable"
+        elif any(c["status"] != "up" for c in checks.values()):
+            status = "degraded"
+        else:
+            status = "ok"
+        return {
+            "status": status,
+            "ready": status in ("ok", "degraded"),
+            "last_probe_age_seconds": round(age, 3) if age is not None else None,
+            "checks": checks,
+        }
@@ -0,0 +1,191 @@
+"""
+Adaptive concurrency limit for calls to a slow upstream (AnythingLLM).
+
+The limit follows AIMD driven by observed latency:
+
+* every successful call whose latency stays within ``tolerance`` x the
+  long-term baseline raises the limit by ``1 / limit`` (about +1 per window);
+* a timeout, transport error, upstream 5xx/429, or a call slower than
+  ``tolerance`` x baseline multiplies the limit by ``backoff``, at most once per
+  baseline round trip so one burst of slow replies does not collapse it.
+
+Callers above the limit wait in a bounded FIFO queue for at most
+``queue_timeout`` seconds; when the queue is full or the wait times out they
+get ``LimiterRejected`` immediately instead of piling onto the upstream.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Deque, Dict, Optional
+
+import httpx
+
+from metrics import UPSTREAM_CONCURRENCY_LIMIT, UPSTREAM_QUEUE_DEPTH, UPSTREAM_REJECTED
+
+
+class LimiterRejected(Exception):
+    """The call was not admitted; ``reason`` is "queue_full" or "queue_timeout"."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Upstream concurrency limit reached ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """Errors that indicate the upstream is overloaded or unreachable."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500 or exc.response.status_code == 429
+    return isinstance(exc, httpx.TransportError)  # Timeouts, connect/read errors
+
+
+class Permit:
+    """One admitted call. ``release()`` must be called exactly once (extra calls are ignored)."""
+
+    __slots__ = ("_limiter", "started", "_released")
+
+    def __init__(self, limiter: "AdaptiveLimiter"):
+        self._limiter = limiter
+        self.started = limiter._clock()
+        self._released = False
+
+    def release(self, overloaded: bool = False, sample: bool = True) -> None:
+        """Free the slot; with ``sample`` the call's latency/outcome adjusts the limit."""
+        if self._released:
+            return
+        self._released = True
+        if sample:
+            self._limiter._on_sample(self._limiter._clock() - self.started, overloaded)
+        self._limiter._release_slot()
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        *,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        max_queue: int = 32,
+        queue_timeout: float = 5.0,
+        tolerance: float = 2.0,
+        backoff: float = 0.9,
+        smoothing: float = 0.05,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 1 <= min_limit <= initial_limit <= max_limit:
+            raise ValueError(f"Invalid limits for {name}: min={min_limit}, initial={initial_limit}, max={max_limit}")
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.smoothing = smoothing
+        self._clock = clock
+        self.in_flight = 0
+        self.baseline: Optional[float] = None  # EWMA of non-overloaded call latency (seconds)
+        self._last_decrease = -math.inf
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.publish()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "max_queue": self.max_queue,
+            "baseline_latency": round(self.baseline, 3) if self.baseline is not None else None,
+            "rejected": self.rejected,
+            "queue_timeouts": self.queue_timeouts,
+        }
+
+    def publish(self) -> None:
+        """Export the current limit (again after a fork: the preloading master's gauge value is not inherited)."""
+        UPSTREAM_CONCURRENCY_LIMIT.set(self.limit)
+
+    def retry_after(self) -> int:
+        """Seconds a rejected client should wait: roughly one upstream round trip."""
+        return max(1, min(30, math.ceil(self.baseline or 1)))
+
+    # --- Admission ---
+
+    async def acquire(self) -> Permit:
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return Permit(self)
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            UPSTREAM_REJECTED.labels("queue_full").inc()
+            raise LimiterRejected("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        UPSTREAM_QUEUE_DEPTH.inc()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # A slot was handed to us just as we gave up; pass it on
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.queue_timeouts += 1
+            UPSTREAM_REJECTED.labels("queue_timeout").inc()
+            raise LimiterRejected("queue_timeout", self.retry_after()) from None
+        finally:
+            UPSTREAM_QUEUE_DEPTH.dec()
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass  # Already popped by _wake()
+        return Permit(self)
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[Permit]:
+        """``async with limiter.slot():`` around one upstream call."""
+        permit = await self.acquire()
+        try:
+            yield permit
+        except asyncio.CancelledError:
+            permit.release(sample=False)  # The client went away; says nothing about the upstream
+            raise
+        except BaseException as e:
+            permit.release(overloaded=is_overload_error(e))
+            raise
+        else:
+            permit.release()
+
+    # --- Internals ---
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand free slots to queued callers in FIFO order."""
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def _on_sample(self, latency: float, overloaded: bool) -> None:
+        now = self._clock()
+        slow = self.baseline is not None and latency > self.tolerance * self.baseline
+        if overloaded or slow:
+            if now - self._last_decrease >= (self.baseline or 0):
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+        if not overloaded:
+            self.baseline = latency if self.baseline is None else (
+                (1 - self.smoothing) * self.baseline + self.smoothing * latency)
+        self.publish()
@@ -0,0 +1,290 @@
+"""
+Non-blocking, structured logging.
+
+``logging.basicConfig`` writes every record to stderr synchronously on the
+thread that logged it, which for this app is the event loop: a slow terminal,
+pipe or log collector stalls every request. ``setup_logging`` instead installs
+a single ``QueueHandler`` on the root logger and writes from a background
+``QueueListener`` thread, so the loop only pays for creating the record and a
+``put_nowait``:
+
+* Messages are formatted lazily on the listener thread. Call sites pass
+  ``%``-style arguments (``logger.info("... %s", value)``) instead of
+  f-strings, so records that are filtered out are never formatted at all.
+  Arguments must not be mutated after the call (they are formatted later).
+* Every record carries the ``request_id`` of the request that logged it
+  (``RequestIdMiddleware``, taken from ``X-Request-ID`` or generated), and is
+  written as one JSON object per line (``LOG_FORMAT=json``) or as text.
+* ``SamplingFilter`` keeps only a fraction of the INFO/DEBUG records of chosen
+  loggers (e.g. the per-message chat lines, httpx's per-request line).
+  Sampling is decided per request ID, so a kept request keeps all its lines.
+  Warnings and errors are never sampled.
+* Messages longer than ``max_message_chars`` are truncated (an LLM response
+  dumped at DEBUG can be megabytes).
+"""
+import atexit
+import datetime
+import logging
+import os
+import queue
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+import orjson
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+# Not copied into JSON lines as extras (color_message: uvicorn's ANSI-coloured copy of msg)
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "color_message"}
+
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdMiddleware:
+    """
+    Pure ASGI middleware giving each request an ID for log correlation.
+
+    The client's ``X-Request-ID`` is reused when present (so IDs from nginx or
+    the frontend carry through), otherwise a new one is generated. The ID is
+    echoed in the response's ``X-Request-ID`` header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:64]
+                break
+        request_id = request_id or uuid.uuid4().hex
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        token = request_id_var.set(request_id)
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps the current request ID on the record (runs on the thread that logged, before queueing)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps ``rate`` (0..1) of the records below WARNING from the configured
+    loggers and their children; the most specific configured name wins.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = {name: min(1.0, max(0.0, rate)) for name, rate in rates.items()}
+        self._resolved: Dict[str, float] = {}
+
+    def rate_for(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            logger_name = name
+            while logger_name:
+                if logger_name in self.rates:
+                    rate = self.rates[logger_name]
+                    break
+                logger_name = logger_name.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            # Same decision for every line of a request
+            return zlib.crc32(request_id.encode("utf-8")) % 10000 < rate * 10000
+        return zlib.crc32(f"{record.created}{record.lineno}".encode()) % 10000 < rate * 10000
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves message formatting to the listener thread.
+
+    The stdlib ``prepare`` formats the message (``msg % args``) on the calling
+    thread; here only the exception traceback is rendered eagerly, because the
+    traceback objects must not outlive the ``except`` block that logged them.
+    When the queue is full (the sink cannot keep up) the record is dropped
+    rather than blocking the caller.
+    """
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class MessageCapFilter(logging.Filter):
+    """Formats the message (on the listener thread) and truncates it to ``max_chars``."""
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.getMessage()
+        if self.max_chars and len(message) > self.max_chars:
+            message = f"{message[:self.max_chars]}...(+{len(message) - self.max_chars} chars)"
+        record.msg, record.args = message, None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, request_id, msg, exc and any ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        return orjson.dumps(entry, default=str).decode("utf-8")
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """``"httpx=0.05,main.chat=0.2"`` -> {"httpx": 0.05, "main.chat": 0.2}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.partition("=")
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(
+    level: str = "INFO",
+    fmt: str = "json",
+    sample_rates: Optional[Dict[str, float]] = None,
+    max_message_chars: int = 2000,
+    queue_size: int = 10000,
+    target: Optional[logging.Handler] = None,
+) -> QueueListener:
+    """
+    Route all logging through a queue to a background writer thread (stderr by default).
+
+    Replaces the root logger's handlers; uvicorn's loggers are made to propagate
+    to root so their lines go through the same queue.
+    """
+    global _listener
+    if target is None:
+        target = logging.StreamHandler(sys.stderr)
+    if fmt == "json":
+        target.setFormatter(JsonFormatter())
+    else:
+        target.setFormatter(logging.Formatter(TEXT_FORMAT))
+    target.addFilter(MessageCapFilter(max_message_chars))
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(queue_size)
+    handler = DeferredQueueHandler(log_queue)
+    handler.addFilter(RequestContextFilter())
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    route_uvicorn_loggers()
+
+    _listener = QueueListener(log_queue, target, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def route_uvicorn_loggers(access_log: bool = True) -> None:
+    """
+    Make uvicorn's loggers propagate to root (and so to the queue) instead of using their own handlers.
+
+    Call it again after anything that rewires them: gunicorn's UvicornWorker points
+    uvicorn.error/uvicorn.access at gunicorn's handlers when it is created, which with
+    preload_app is after the app (and this setup) was imported. ``access_log=False``
+    silences uvicorn.access, matching gunicorn without ``accesslog``.
+    """
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+        uvicorn_logger.setLevel(logging.NOTSET)  # Root's LOG_LEVEL decides
+    logging.getLogger("uvicorn.access").disabled = not access_log
+
+
+def stop_logging() -> None:
+    """Write out everything still queued and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork() -> None:
+    # Threads do not survive fork (gunicorn preload imports the app, and with it this
+    # setup, in the master): give each worker its own queue and writer thread
+    global _listener
+    if _listener is None:
+        return
+    old = _listener
+    handler = next((h for h in logging.getLogger().handlers if isinstance(h, DeferredQueueHandler)), None)
+    if handler is None:
+        return
+    handler.queue = queue.Queue(old.queue.maxsize)
+    _listener = QueueListener(handler.queue, *old.handlers, respect_handler_level=old.respect_handler_level)
+    _listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(stop_logging)
@@ -1,26 +1,59 @@
-from fastapi import FastAPI, HTTPException, Query, Depends, Request # 添加Request导入
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, WebSocket, WebSocketDisconnect # 添加Request导入
 from fastapi.middleware.cors import CORSMiddleware # 导入CORS中间件，用于处理跨域请求
-from pydantic import BaseModel # 导入Pydantic的BaseModel，用于定义请求体和响应体的数据模型
-from typing import List, Optional, Dict, Any, Annotated # 导入Python类型提示工具
+from pydantic import BaseModel, Field, ValidationError # 导入Pydantic的BaseModel，用于定义请求体和响应体的数据模型
+from typing import List, Optional, Dict, Any, Annotated, AsyncIterator, Iterable, NamedTuple, Tuple, Union # 导入Python类型提示工具
 import httpx # 导入httpx库，用于发送HTTP请求
 import pymysql # 导入pymysql库，用于连接MySQL数据库
 import os # 导入os模块，用于访问环境变量
 from dotenv import load_dotenv # 导入load_dotenv函数，用于从.env文件加载环境变量
 import logging # Import logging module
 import datetime # Import datetime module for timestamp
-from fastapi.responses import JSONResponse
+import json # 用于编码流式响应事件
+import asyncio # 用于限流排队和批量聊天的并发处理
+from collections import deque # 批量聊天的待处理队列
+import hashlib # 用于生成ETag
+import base64 # 用于编码分页游标
+import time # 用于生成按时间排序的消息ID
+import unicodedata # 用于归一化聊天消息 (全角/半角、标点)
+from contextlib import aclosing # 流式读取聊天记录时确保游标先于连接关闭
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.exceptions import RequestValidationError # 添加此导入
 from starlette.exceptions import HTTPException as StarletteHTTPException # 添加此导入
-
-# Configure basic logging # 配置基本日志记录
-logging.basicConfig(level=logging.INFO) # 设置日志级别为INFO
-logger = logging.getLogger(__name__) # 获取当前模块的logger实例
+from db import DatabasePool, AsyncConnection, PoolTimeoutError, PoolClosedError # 异步数据库连接池
+from cache import TTLCache, SingleFlight # 进程内 LRU+TTL 缓存 / 并发请求合并
+from writebehind import BatchWriter # 后台批量写入队列
+from metrics import PrometheusMiddleware, track_upstream, render_latest, mark_worker_exit # Prometheus 指标
+from rollup import rollup # 指标定期汇总写入 system_metrics
+from limiter import AdaptiveLimiter, LimiterRejected, Permit, is_overload_error # 上游自适应并发限制
+from breaker import CircuitBreaker, CircuitOpenError # 上游熔断器
+from serialize import dumps, dumps_rows, convert_rows # 数据库行直接序列化为 JSON 字节 (orjson)
+from health import HealthProber # 后台健康探测 (/health/live, /health/ready)
+from logconfig import setup_logging, parse_sample_rates, RequestIdMiddleware # 后台线程写日志 (JSON + 请求ID)
+from spares import SpareThreadPool # 预先创建的 AnythingLLM 线程 (新会话直接领取)
+from upstreams import UpstreamPool # 多个 AnythingLLM 实例: 最少未完成请求负载均衡 + 被动健康检查
+from timing import ServerTimingMiddleware, span # 请求各阶段耗时 (Server-Timing 响应头 + 日志)
+from profiler import sample_stacks, collapsed # 按需采样分析 (/admin/profile)
+import hmac # 管理端点令牌的常数时间比较
+import math # 校验搜索游标中的相关度
+import threading # 采样分析时排除事件循环以外的线程
+import anyio # 流式响应结束时的清理不受取消影响
 
 # Load environment variables # 加载环境变量
 load_dotenv() # 调用函数加载环境变量
 
+# Configure logging # 配置日志: 记录经队列交给后台线程格式化并写出，事件循环不做同步 I/O
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"), # 日志级别
+    fmt=os.getenv("LOG_FORMAT", "json"), # json: 每行一个 JSON 对象; text: 普通文本
+    sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")), # 如 "httpx=0.05,main.chat=0.2"，只对 INFO/DEBUG 抽样
+    max_message_chars=int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000")), # 单条日志消息的最大长度，超出截断
+)
+logger = logging.getLogger(__name__) # 获取当前模块的logger实例
+chat_logger = logging.getLogger(f"{__name__}.chat") # 每条聊天消息都会产生的 INFO 日志，可单独抽样
+
 # --- Configuration Validation ---
-ANYTHINGLLM_BASE_URL = os.getenv("ANYTHINGLLM_API_BASE_URL")
+ANYTHINGLLM_BASE_URL = os.getenv("ANYTHINGLLM_API_BASE_URL") # 多个实例用逗号分隔，第一个为主实例
+ANYTHINGLLM_BASE_URLS = [url.strip().rstrip("/") for url in (ANYTHINGLLM_BASE_URL or "").split(",") if url.strip()]
 WORKSPACE_SLUG = os.getenv("ANYTHINGLLM_WORKSPACE_SLUG")
 ANYTHINGLLM_API_KEY = os.getenv("ANYTHINGLLM_API_KEY") # 允许为空，但如果API需要则会报错
 HTTPX_TIMEOUT = float(os.getenv("HTTPX_TIMEOUT", "60.0")) # 从环境变量获取超时时间
@@ -31,6 +64,149 @@ DB_USER = os.getenv("DB_USER", "root")
 DB_PASSWORD = os.getenv("DB_PASSWORD", "")
 DB_NAME = os.getenv("DB_NAME", "mental_health_db")
 
+# Database connection pool # 数据库连接池配置
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1")) # 启动时预热并常驻的连接数
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10")) # 连接数上限
+DB_POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300")) # 超出最小连接数的空闲连接在此秒数后关闭
+DB_POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600")) # 连接最长存活秒数，超过后重建 (应小于MySQL的wait_timeout)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes") # 取出空闲连接前是否先ping
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5.0")) # 等待可用连接的最长秒数
+
+# Session -> thread cache # 会话到AnythingLLM线程的映射缓存 (映射一旦创建就不会改变)
+SESSION_CACHE_MAX_SIZE = int(os.getenv("SESSION_CACHE_MAX_SIZE", "10000"))
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "3600"))
+
+# Chat history write-behind # 聊天记录异步批量写入 chat_messages
+MESSAGE_QUEUE_MAX_SIZE = int(os.getenv("MESSAGE_QUEUE_MAX_SIZE", "10000")) # 内存队列上限
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", "200")) # 攒够多少条就立即写入
+MESSAGE_FLUSH_INTERVAL = float(os.getenv("MESSAGE_FLUSH_INTERVAL", "1.0")) # 最长攒批秒数
+MESSAGE_ENQUEUE_TIMEOUT = float(os.getenv("MESSAGE_ENQUEUE_TIMEOUT", "0.05")) # 队列满时最多等待秒数，超时则丢弃
+
+# Chat history API # 聊天记录查询 (/api/sessions/{id}/messages)
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50")) # JSON 模式未指定 limit 时的每页条数
+HISTORY_STREAM_BATCH_SIZE = int(os.getenv("HISTORY_STREAM_BATCH_SIZE", "500")) # NDJSON 模式每次从服务端游标读取的行数
+
+# Admin endpoints # 管理端点 (/admin/profile)，需携带 Authorization: Bearer <ADMIN_TOKEN>
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "") # 为空时管理端点关闭
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60")) # 单次采样分析的最长秒数
+
+# Background health probes # 后台健康探测，探活/就绪端点只读取内存中的结果
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "5")) # 两次探测的间隔秒数
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2")) # 单个依赖的探测超时秒数
+
+# Feedback write-behind # 用户反馈异步批量写入 feedback (同一 message_id 在队列中只保留最新一条)
+FEEDBACK_QUEUE_MAX_SIZE = int(os.getenv("FEEDBACK_QUEUE_MAX_SIZE", "10000")) # 内存队列上限 (按不同 message_id 计)
+FEEDBACK_BATCH_SIZE = int(os.getenv("FEEDBACK_BATCH_SIZE", "500")) # 攒够多少条就立即写入
+FEEDBACK_FLUSH_INTERVAL = float(os.getenv("FEEDBACK_FLUSH_INTERVAL", "2.0")) # 最长攒批秒数
+FEEDBACK_ENQUEUE_TIMEOUT = float(os.getenv("FEEDBACK_ENQUEUE_TIMEOUT", "0.05")) # 队列满时最多等待秒数，超时则丢弃
+FEEDBACK_BATCH_MAX_ITEMS = int(os.getenv("FEEDBACK_BATCH_MAX_ITEMS", "500")) # 单次批量提交的最大条数
+
+# Resources response cache # 资源列表响应缓存
+RESOURCES_CACHE_MAX_SIZE = int(os.getenv("RESOURCES_CACHE_MAX_SIZE", "256")) # 缓存的不同查询组合数量上限
+RESOURCES_CACHE_TTL = float(os.getenv("RESOURCES_CACHE_TTL", "300")) # 单个缓存条目最长存活秒数
+RESOURCES_VERSION_TTL = float(os.getenv("RESOURCES_VERSION_TTL", "5")) # 多久重新检查一次表版本 (行数/MAX(updated_at))
+RESOURCES_CACHE_MAX_AGE = int(os.getenv("RESOURCES_CACHE_MAX_AGE", "60")) # Cache-Control max-age，浏览器/代理可直接复用的秒数
+
+# Stateless chat reply cache # 无会话聊天回复缓存 (仅用于不带session_id的工作区对话)
+CHAT_REPLY_CACHE_ENABLED = os.getenv("CHAT_REPLY_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CHAT_REPLY_CACHE_MAX_SIZE = int(os.getenv("CHAT_REPLY_CACHE_MAX_SIZE", "1000")) # 缓存的不同问题数量上限
+CHAT_REPLY_CACHE_TTL = float(os.getenv("CHAT_REPLY_CACHE_TTL", "600")) # 回复缓存秒数
+CHAT_REPLY_CACHE_BYPASS_HEADER = "X-Cache-Bypass" # 请求带此头 (或 Cache-Control: no-cache) 时跳过缓存读取
+
+# Batch chat # 批量聊天
+CHAT_BATCH_MAX_ITEMS = int(os.getenv("CHAT_BATCH_MAX_ITEMS", "1000")) # 单次批量请求的最大条数
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", "8")) # 单次批量请求内同时进行的聊天数
+
+# WebSocket chat # WebSocket 聊天通道 (/ws/chat)
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "4")) # 每个连接同时处理的消息数上限，超出的消息返回429错误帧
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256")) # 每个连接待发送帧的缓冲上限，满了以后回复暂停读取上游
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "30")) # 发送缓冲持续满载超过此秒数视为客户端停止读取，关闭连接
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "20")) # 服务器发送ping帧的间隔秒数
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60")) # 超过此秒数未收到客户端任何帧 (包括pong) 则关闭连接
+
+# Upstream chat admission control # AnythingLLM 聊天调用的自适应并发限制 (AIMD)
+UPSTREAM_LIMIT_INITIAL = int(os.getenv("UPSTREAM_LIMIT_INITIAL", "8")) # 初始并发上限
+UPSTREAM_LIMIT_MIN = int(os.getenv("UPSTREAM_LIMIT_MIN", "1"))
+UPSTREAM_LIMIT_MAX = int(os.getenv("UPSTREAM_LIMIT_MAX", "64"))
+UPSTREAM_QUEUE_SIZE = int(os.getenv("UPSTREAM_QUEUE_SIZE", "32")) # 超过并发上限时最多排队的请求数
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "5.0")) # 最长排队秒数，超时返回503
+UPSTREAM_LATENCY_TOLERANCE = float(os.getenv("UPSTREAM_LATENCY_TOLERANCE", "2.0")) # 延迟超过基线的多少倍视为过载
+
+# Upstream circuit breaker # AnythingLLM 熔断器: 错误率过高时直接返回降级回复，不再等待超时
+CIRCUIT_FAILURE_THRESHOLD = float(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "0.5")) # 窗口内失败比例达到此值时熔断
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10")) # 窗口内至少多少次调用才计算失败比例
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "30")) # 统计窗口秒数
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30")) # 熔断持续秒数，之后放行一个探测请求
+CRISIS_RESOURCES_TTL = float(os.getenv("CRISIS_RESOURCES_TTL", "600")) # 降级回复中危机资源的缓存秒数
+
+# AnythingLLM instances # 每个实例独立的连接池，以及被动健康检查 (连续失败后暂时不再分配新请求)
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")) # 每个实例的最大连接数
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20")) # 每个实例保留的空闲长连接数
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "5.0")) # 空闲长连接保留秒数
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "false").lower() in ("1", "true", "yes") # 与实例之间使用HTTP/2 (仅https实例，需要h2包)
+UPSTREAM_EJECT_FAILURES = int(os.getenv("UPSTREAM_EJECT_FAILURES", "5")) # 连续失败 (连接错误、超时、502/503/504) 多少次后摘除实例
+UPSTREAM_EJECT_SECONDS = float(os.getenv("UPSTREAM_EJECT_SECONDS", "30")) # 首次摘除秒数，再次摘除时加倍
+UPSTREAM_EJECT_MAX_SECONDS = float(os.getenv("UPSTREAM_EJECT_MAX_SECONDS", "300")) # 摘除时长上限
+
+# Pre-created AnythingLLM threads # 后台预先创建线程，新会话的第一条消息不必等待 /thread/new
+THREAD_POOL_ENABLED = os.getenv("THREAD_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+THREAD_POOL_LOW_WATERMARK = int(os.getenv("THREAD_POOL_LOW_WATERMARK", "2")) # 每个 worker 在每个实例上的备用线程少于此数时开始补充
+THREAD_POOL_HIGH_WATERMARK = int(os.getenv("THREAD_POOL_HIGH_WATERMARK", "5")) # 补充到此数为止
+THREAD_POOL_LEASE_SECONDS = int(os.getenv("THREAD_POOL_LEASE_SECONDS", "600")) # 备用线程在数据库中的租约秒数 (worker 崩溃后过期，由其他 worker 接管)
+
+# system_metrics roll-up # 请求/上游指标定期汇总写入 system_metrics 表
+METRICS_ROLLUP_ENABLED = os.getenv("METRICS_ROLLUP_ENABLED", "true").lower() in ("1", "true", "yes")
+METRICS_ROLLUP_INTERVAL = float(os.getenv("METRICS_ROLLUP_INTERVAL", "60")) # 每隔多少秒批量写入一次
+METRICS_MAINTENANCE_INTERVAL = float(os.getenv("METRICS_MAINTENANCE_INTERVAL", "3600")) # 降采样/清理的执行间隔秒数
+METRICS_DOWNSAMPLE_AFTER_HOURS = float(os.getenv("METRICS_DOWNSAMPLE_AFTER_HOURS", "48")) # 超过此小时数的分钟数据合并为每小时一行
+METRICS_RETENTION_DAYS = float(os.getenv("METRICS_RETENTION_DAYS", "30")) # 超过此天数的数据删除
+
+class ThreadBinding(NamedTuple):
+    """An AnythingLLM thread and the base URL of the instance it lives on (chat_sessions.anythingllm_upstream)."""
+    thread_id: str
+    upstream: str
+
+# session_id -> (anythingllm_thread_id, instance), consulted before chat_sessions on every threaded message
+session_thread_cache: TTLCache[ThreadBinding] = TTLCache(maxsize=SESSION_CACHE_MAX_SIZE, ttl=SESSION_CACHE_TTL)
+# In-flight lookups/thread creations keyed by session_id, so racing first messages share one
+thread_resolutions: SingleFlight[ThreadBinding] = SingleFlight()
+# Admission control for AnythingLLM chat / stream-chat calls (thread creation is not limited)
+chat_limiter = AdaptiveLimiter(
+    "anythingllm-chat",
+    initial_limit=UPSTREAM_LIMIT_INITIAL,
+    min_limit=UPSTREAM_LIMIT_MIN,
+    max_limit=UPSTREAM_LIMIT_MAX,
+    max_queue=UPSTREAM_QUEUE_SIZE,
+    queue_timeout=UPSTREAM_QUEUE_TIMEOUT,
+    tolerance=UPSTREAM_LATENCY_TOLERANCE,
+)
+# Shared by every AnythingLLM call (thread creation, chat, stream-chat)
+chat_breaker = CircuitBreaker(
+    "anythingllm",
+    failure_threshold=CIRCUIT_FAILURE_THRESHOLD,
+    min_calls=CIRCUIT_MIN_CALLS,
+    window=CIRCUIT_WINDOW,
+    open_duration=CIRCUIT_OPEN_SECONDS,
+)
+# AnythingLLM instances: new work goes to the least busy healthy one, sessions stay on their thread's instance
+anythingllm_upstreams = UpstreamPool(
+    ANYTHINGLLM_BASE_URLS,
+    failure_threshold=UPSTREAM_EJECT_FAILURES,
+    eject_seconds=UPSTREAM_EJECT_SECONDS,
+    max_eject_seconds=UPSTREAM_EJECT_MAX_SECONDS,
+)
+# Threads created ahead of time and claimed by new sessions (stored in anythingllm_spare_threads), one pool per instance
+spare_threads: Dict[str, SpareThreadPool] = {
+    upstream.base_url: SpareThreadPool(
+        low_watermark=THREAD_POOL_LOW_WATERMARK,
+        high_watermark=THREAD_POOL_HIGH_WATERMARK,
+        lease_seconds=THREAD_POOL_LEASE_SECONDS,
+        upstream=upstream.base_url,
+        adopt_unpinned=upstream is anythingllm_upstreams.primary, # Spares stored before 1.7.0 were created there
+    )
+    for upstream in anythingllm_upstreams.upstreams
+}
+
 # --- Global HTTP Client ---
 # Declare a global variable for the httpx client
 # This client will be initialized on app startup and closed on shutdown
@@ -46,6 +222,15 @@ async def get_http_client() -> httpx.AsyncClient:
         raise HTTPException(status_code=500, detail="HTTP client not initialized.")
     return app.state.http_client
 
+async def get_db_pool() -> DatabasePool:
+    """
+    Dependency to get the shared DatabasePool.
+    The pool is created on app startup alongside the HTTP client.
+    """
+    if not hasattr(app.state, 'db_pool'):
+        raise HTTPException(status_code=500, detail="Database pool not initialized.")
+    return app.state.db_pool
+
 app = FastAPI(title="Mental Health Chatbot API") # 创建FastAPI应用实例，并设置标题
 
 # --- Lifespan Events for HTTP Client ---
@@ -55,8 +240,82 @@ async def startup_event():
     Initialize the httpx.AsyncClient when the application starts.
     Also, validate essential configurations.
     """
-    app.state.http_client = httpx.AsyncClient(timeout=HTTPX_TIMEOUT)
-    logger.info(f"HTTPX Client initialized with timeout: {HTTPX_TIMEOUT}s")
+    app.state.http_client = httpx.AsyncClient(
+        timeout=HTTPX_TIMEOUT,
+        # One connection pool per AnythingLLM instance; its transport also tracks the instance's load and health
+        mounts=anythingllm_upstreams.mounts(
+            httpx.Limits(
+                max_connections=UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+                keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+            ),
+            http2=UPSTREAM_HTTP2,
+        ),
+    )
+    logger.info(f"HTTPX Client initialized with timeout: {HTTPX_TIMEOUT}s, AnythingLLM instances: {ANYTHINGLLM_BASE_URLS}")
+
+    app.state.db_pool = DatabasePool(
+        minsize=DB_POOL_MIN_SIZE,
+        maxsize=DB_POOL_MAX_SIZE,
+        idle_timeout=DB_POOL_IDLE_TIMEOUT,
+        recycle=DB_POOL_RECYCLE,
+        pre_ping=DB_POOL_PRE_PING,
+        acquire_timeout=DB_POOL_ACQUIRE_TIMEOUT,
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        database=DB_NAME,
+    )
+    await app.state.db_pool.open()
+    await get_crisis_resources(app.state.db_pool) # Warm up so degraded replies never wait on the database
+
+    # Under gunicorn --preload these objects were built in the master; re-export their gauges from this worker
+    chat_limiter.publish()
+    chat_breaker.publish()
+
+    app.state.message_writer = BatchWriter(
+        "chat_messages",
+        write_chat_messages,
+        max_queue=MESSAGE_QUEUE_MAX_SIZE,
+        batch_size=MESSAGE_BATCH_SIZE,
+        flush_interval=MESSAGE_FLUSH_INTERVAL,
+        put_timeout=MESSAGE_ENQUEUE_TIMEOUT,
+    )
+    app.state.message_writer.start()
+
+    app.state.feedback_writer = BatchWriter(
+        "feedback",
+        write_feedback,
+        max_queue=FEEDBACK_QUEUE_MAX_SIZE,
+        batch_size=FEEDBACK_BATCH_SIZE,
+        flush_interval=FEEDBACK_FLUSH_INTERVAL,
+        put_timeout=FEEDBACK_ENQUEUE_TIMEOUT,
+        key=lambda row: row[0], # Coalesce re-submissions for the same message_id
+    )
+    app.state.feedback_writer.start()
+
+    if METRICS_ROLLUP_ENABLED:
+        rollup.start(
+            app.state.db_pool,
+            interval=METRICS_ROLLUP_INTERVAL,
+            maintenance_interval=METRICS_MAINTENANCE_INTERVAL,
+            downsample_after_hours=METRICS_DOWNSAMPLE_AFTER_HOURS,
+            retention_days=METRICS_RETENTION_DAYS,
+        )
+
+    if THREAD_POOL_ENABLED and ANYTHINGLLM_BASE_URL and WORKSPACE_SLUG:
+        for upstream in anythingllm_upstreams.upstreams:
+            spare_threads[upstream.base_url].start(
+                app.state.db_pool,
+                lambda upstream=upstream: create_anythingllm_thread(
+                    app.state.http_client, anythingllm_headers(), upstream.base_url),
+                WORKSPACE_SLUG,
+                # Refills are not admitted by the breaker, and an ejected instance should not get new threads; wait it out instead
+                paused=lambda upstream=upstream: chat_breaker.state == "open" or anythingllm_upstreams.ejected(upstream),
+            )
+
+    health_prober.start()
 
     if not ANYTHINGLLM_BASE_URL:
         logger.error("CRITICAL: ANYTHINGLLM_API_BASE_URL is not configured.")
@@ -67,11 +326,34 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     """
-    Close the httpx.AsyncClient when the application shuts down.
+    Close the httpx.AsyncClient and the database pool when the application shuts down.
+    Queued chat messages, feedback and the last metrics window are flushed before the pool goes away.
     """
+    await health_prober.stop() # /health/ready reports "draining" from here on
+    for spares in spare_threads.values():
+        await spares.stop() # Release the spares' leases for the next worker to adopt
     if hasattr(app.state, 'http_client'):
         await app.state.http_client.aclose()
         logger.info("HTTPX Client closed.")
+    if hasattr(app.state, 'message_writer'):
+        await app.state.message_writer.stop()
+        logger.info(f"Chat message writer drained: {app.state.message_writer.stats()}")
+    if hasattr(app.state, 'feedback_writer'):
+        await app.state.feedback_writer.stop()
+        logger.info(f"Feedback writer drained: {app.state.feedback_writer.stats()}")
+    await rollup.stop() # Write out the last partial minute
+    if hasattr(app.state, 'db_pool'):
+        await app.state.db_pool.close()
+    mark_worker_exit()
+
+# Request count / latency / in-flight metrics for every route # 记录每个路由的请求数、耗时和并发数
+app.add_middleware(PrometheusMiddleware)
+
+# Per-stage durations as a Server-Timing header and a log line # 记录请求各阶段耗时 (需在请求ID中间件内层，日志才带有请求ID)
+app.add_middleware(ServerTimingMiddleware)
+
+# Request ID for log correlation (X-Request-ID in and out) # 为每个请求分配ID并写入该请求的所有日志
+app.add_middleware(RequestIdMiddleware)
 
 # Configure CORS # 配置CORS（跨域资源共享）
 app.add_middleware( # 添加中间件
@@ -80,6 +362,7 @@ app.add_middleware( # 添加中间件
     allow_credentials=True, # 允许发送凭据（cookies, authorization headers）
     allow_methods=["*"], # 允许所有HTTP方法（GET, POST等）
     allow_headers=["*"], # 允许所有HTTP头
+    expose_headers=["ETag", "X-Next-Cursor", "X-Cache", "X-Request-ID", "Server-Timing"], # 允许前端读取缓存校验和分页游标响应头
 )
 
 # Pydantic models # Pydantic模型定义
@@ -89,117 +372,217 @@ class ChatRequest(BaseModel): # 定义聊天请求的数据模型
 
 class ChatResponse(BaseModel): # 定义聊天响应的数据模型
     reply: str # 响应内容，类型为字符串
+    degraded: bool = False # True when the LLM is unavailable and the reply is a canned message
+    resources: Optional[List[Dict[str, Any]]] = None # Crisis resources attached to degraded replies
+
+# --- Chat history (write-behind into chat_messages) ---
+_last_message_ms = 0
 
-# Database connection helper # 数据库连接帮助函数
-def get_db_connection(): # 定义获取数据库连接的函数
-    try: # 尝试连接数据库
-        connection = pymysql.connect( # 调用pymysql.connect建立连接
-            host=DB_HOST, # 数据库主机名
-            port=DB_PORT, # 数据库端口
-            user=DB_USER, # 数据库用户名
-            password=DB_PASSWORD, # 数据库密码
-            database=DB_NAME, # 数据库名称
-            cursorclass=pymysql.cursors.DictCursor # 使用字典光标，使查询结果以字典形式返回
-        ) # 连接参数结束
-        return connection # 返回建立的数据库连接
-    except pymysql.MySQLError as e: # 捕获pymysql的数据库错误
-        logger.error(f"Error connecting to MySQL: {e}") # 打印错误信息
-        raise HTTPException(status_code=500, detail="Database connection error") # 抛出HTTPException，表示数据库连接错误
+def new_message_id() -> str:
+    """
+    Time-ordered 36-char id (UUIDv7 layout) for chat_messages.id.
+    Sorting by id follows creation order, which breaks ties between rows that share a created_at second.
+    """
+    global _last_message_ms
+    ms = max(int(time.time() * 1000), _last_message_ms + 1)
+    _last_message_ms = ms
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (ms << 80) | (0x7 << 76) | ((rand >> 64) & 0xFFF) << 64 | (0b10 << 62) | (rand & ((1 << 62) - 1))
+    h = f"{value:032x}"
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+async def write_chat_messages(rows: List[tuple]) -> None:
+    """Flush callback for the message writer: one multi-row INSERT per batch."""
+    async with app.state.db_pool.acquire() as conn:
+        # PyMySQL rewrites executemany on INSERT ... VALUES into multi-row INSERT statements
+        await conn.executemany(
+            "INSERT INTO chat_messages (id, session_id, role, content, created_at) VALUES (%s, %s, %s, %s, %s)",
+            rows)
+
+async def record_chat_turn(session_id: str, user_message: str, reply: str) -> None:
+    """Queue a user/assistant turn for persistence. Never waits on the database."""
+    writer: Optional[BatchWriter] = getattr(app.state, "message_writer", None)
+    if writer is None:
+        return
+    now = datetime.datetime.now()
+    with span("history"): # Only waits when the queue is full (up to MESSAGE_ENQUEUE_TIMEOUT)
+        await writer.put((new_message_id(), session_id, "user", user_message, now))
+        await writer.put((new_message_id(), session_id, "assistant", reply, now))
 
 @app.get("/") # 定义根路径的GET请求处理函数
 async def root(): # 异步函数定义
     return {"status": "API is running"} # 返回API运行状态信息
 
-@app.post("/api/chat", response_model=ChatResponse) # 定义/api/chat路径的POST请求处理函数，响应模型为ChatResponse
-async def chat(
-    request: ChatRequest,
-    client: Annotated[httpx.AsyncClient, Depends(get_http_client)] # Use Depends for the client
-):
+def ensure_anythingllm_configured() -> None:
+    """Fail fast with a 500 if the AnythingLLM base URL or workspace slug is missing."""
     if not WORKSPACE_SLUG or not ANYTHINGLLM_BASE_URL:
         logger.error("AnythingLLM URL or workspace not configured properly.")
         raise HTTPException(status_code=500, detail="AnythingLLM service not configured")
 
-    # Set up proper headers according to API documentation
+def anythingllm_headers() -> Dict[str, str]:
+    """Set up proper headers according to API documentation"""
     headers = {
         "Content-Type": "application/json",
     }
     if ANYTHINGLLM_API_KEY:
         headers["Authorization"] = f"Bearer {ANYTHINGLLM_API_KEY}"
+    return headers
 
-    # Structure payload according to API docs
-    payload = {
-        "message": request.message,
-    }
+def stored_binding(row: Dict[str, Any]) -> ThreadBinding:
+    """The thread of a chat_sessions row; threads stored before instances were recorded live on the primary."""
+    return ThreadBinding(row["anythingllm_thread_id"], row.get("anythingllm_upstream") or anythingllm_upstreams.primary.base_url)
+
+async def resolve_thread_id(
+    session_id: str,
+    client: httpx.AsyncClient,
+    pool: DatabasePool,
+    headers: Dict[str, str],
+) -> ThreadBinding:
+    """
+    Map an application session_id to its AnythingLLM thread slug and the instance the thread lives on.
+    Looks the session up in chat_sessions and creates (and stores) a new thread if it has none.
+    Shared by every chat entry point so they all resolve threads the same way.
+    """
+    chat_logger.info("Chat request for session_id: %s", session_id)
+    binding = session_thread_cache.get(session_id)
+    if binding:
+        return binding
+
+    # Concurrent first messages for the same session share one lookup and at most one /thread/new
+    return await thread_resolutions.do(
+        session_id, lambda: _load_or_create_thread(session_id, client, pool, headers))
 
-    anything_llm_url = ""
-    current_thread_id = None
-    db_conn = None
+async def _load_or_create_thread(
+    session_id: str,
+    client: httpx.AsyncClient,
+    pool: DatabasePool,
+    headers: Dict[str, str],
+) -> ThreadBinding:
+    # Hold the connection only for the lookup, not across the upstream call
+    with span("db"):
+        async with pool.acquire() as db_conn:
+            session_row = await db_conn.fetchone(
+                "SELECT anythingllm_thread_id, anythingllm_upstream FROM chat_sessions WHERE id = %s", (session_id,))
 
+    if session_row and session_row.get("anythingllm_thread_id"):
+        binding = stored_binding(session_row)
+        chat_logger.info("Found existing thread_id: %s", binding.thread_id)
+        session_thread_cache.set(session_id, binding)
+        return binding
+
+    # A new session goes to the least busy healthy instance and stays there (the thread only exists on it).
+    # Take a pre-created thread of that instance if one is available, otherwise create one now
+    upstream = anythingllm_upstreams.pick()
+    spares = spare_threads[upstream.base_url]
+    thread_id = spares.claim()
+    claimed = thread_id is not None
+    if claimed:
+        chat_logger.info("Claimed pre-created thread: %s", thread_id)
+    else:
+        with chat_breaker.guard(), span("thread_new"):
+            thread_id = await create_anythingllm_thread(client, headers, upstream.base_url)
+    binding = ThreadBinding(thread_id, upstream.base_url)
+
+    # Save thread ID and its instance with an atomic upsert. If another backend process
+    # stored a thread for this session first, COALESCE keeps theirs and we adopt it.
+    # (Assignments run left to right, so the instance is only replaced while the thread is still unset.)
     try:
-        if request.session_id:
-            logger.info(f"Chat request for session_id: {request.session_id}")
-            db_conn = get_db_connection()
-            with db_conn.cursor() as cursor:
-                cursor.execute("SELECT anythingllm_thread_id FROM chat_sessions WHERE id = %s", (request.session_id,))
-                session_row = cursor.fetchone()
-
-                if session_row and session_row.get("anythingllm_thread_id"):
-                    current_thread_id = session_row["anythingllm_thread_id"]
-                    logger.info(f"Found existing thread_id: {current_thread_id}")
-                else:
-                    # Create a new thread using the proper API endpoint format
-                    new_thread_url = f"{ANYTHINGLLM_BASE_URL}/v1/workspace/{WORKSPACE_SLUG}/thread/new"
-                    logger.info(f"Creating new thread via: {new_thread_url}")
-                    
-                    new_thread_response = await client.post(new_thread_url, json={}, headers=headers)
-                    new_thread_response.raise_for_status()
-                    thread_data = new_thread_response.json()
-                    
-                    # Extract thread ID/slug from response according to API format
-                    current_thread_id = thread_data.get("threadSlug") or thread_data.get("slug")
-                    if not current_thread_id:
-                        logger.error(f"Failed to get thread ID from response: {thread_data}")
-                        raise HTTPException(status_code=500, detail="Failed to create thread")
-                    
-                    # Save thread ID to database
-                    if session_row:
-                        cursor.execute("UPDATE chat_sessions SET anythingllm_thread_id = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                                      (current_thread_id, request.session_id))
-                    else:
-                        cursor.execute("INSERT INTO chat_sessions (id, anythingllm_thread_id, name) VALUES (%s, %s, %s)",
-                                      (request.session_id, current_thread_id, f"Session {request.session_id[:8]}"))
-                    db_conn.commit()
-            
-            # Use the thread-specific chat endpoint format
-            anything_llm_url = f"{ANYTHINGLLM_BASE_URL}/v1/workspace/{WORKSPACE_SLUG}/thread/{current_thread_id}/chat"
-        
-        else: # No session_id, use general workspace chat
-            logger.info("Using general workspace chat")
-            anything_llm_url = f"{ANYTHINGLLM_BASE_URL}/v1/workspace/{WORKSPACE_SLUG}/chat"
-            payload["mode"] = "chat"
-
-        logger.info(f"Sending request to: {anything_llm_url}")
-        response = await client.post(anything_llm_url, json=payload, headers=headers)
-        response.raise_for_status()
+        with span("db"):
+            async with pool.acquire() as db_conn:
+                await db_conn.execute(
+                    "INSERT INTO chat_sessions (id, anythingllm_thread_id, anythingllm_upstream, name) VALUES (%s, %s, %s, %s) "
+                    "ON DUPLICATE KEY UPDATE "
+                    "anythingllm_upstream = IF(anythingllm_thread_id IS NULL, VALUES(anythingllm_upstream), anythingllm_upstream), "
+                    "anythingllm_thread_id = COALESCE(anythingllm_thread_id, VALUES(anythingllm_thread_id))",
+                    (session_id, thread_id, upstream.base_url, f"Session {session_id[:8]}"))
+                stored_row = await db_conn.fetchone(
+                    "SELECT anythingllm_thread_id, anythingllm_upstream FROM chat_sessions WHERE id = %s", (session_id,))
+                stored_thread_id = stored_row.get("anythingllm_thread_id") if stored_row else None
+                if claimed and stored_thread_id in (None, thread_id):
+                    await spares.forget(db_conn, thread_id) # The thread now belongs to this session
+    except Exception:
+        if claimed:
+            spares.give_back(thread_id)
+        raise
 
-        result = response.json()
-        logger.debug(f"Raw response: {result}")
-
-        # Parse response according to API format
-        reply_content = None
-        if "textResponse" in result:
-            reply_content = result["textResponse"]
-        elif "response" in result and "text" in result["response"]:
-            reply_content = result["response"]["text"]
-        elif result.get("type") == "textResponse" and "text" in result.get("content", {}):
-            reply_content = result["content"]["text"]
+    if stored_thread_id and stored_thread_id != thread_id:
+        logger.warning(f"Session {session_id} already bound to thread {stored_thread_id}; discarding duplicate thread {thread_id}")
+        if claimed:
+            spares.give_back(thread_id) # Still unused: keep it for the next new session
         else:
-            logger.warning(f"Unexpected response format: {result}")
-            reply_content = "抱歉，无法获取有效回复内容。"
+            await _delete_anythingllm_thread(client, headers, binding)
+        binding = stored_binding(stored_row)
+
+    session_thread_cache.set(session_id, binding)
+    return binding
+
+async def create_anythingllm_thread(client: httpx.AsyncClient, headers: Dict[str, str], base_url: str) -> str:
+    """POST /thread/new on the workspace of the instance at base_url; returns the new thread slug."""
+    # Create a new thread using the proper API endpoint format
+    new_thread_url = f"{base_url}/v1/workspace/{WORKSPACE_SLUG}/thread/new"
+    chat_logger.info("Creating new thread via: %s", new_thread_url)
 
-        return ChatResponse(reply=str(reply_content).strip())
+    with track_upstream("thread_new"):
+        new_thread_response = await client.post(new_thread_url, json={}, headers=headers)
+        new_thread_response.raise_for_status()
+    thread_data = new_thread_response.json()
 
-    except httpx.HTTPStatusError as e:
+    # Extract thread ID/slug from response according to API format
+    thread_id = thread_data.get("threadSlug") or thread_data.get("slug")
+    if not thread_id:
+        logger.error(f"Failed to get thread ID from response: {thread_data}")
+        raise HTTPException(status_code=500, detail="Failed to create thread")
+    return thread_id
+
+async def _delete_anythingllm_thread(client: httpx.AsyncClient, headers: Dict[str, str], thread: ThreadBinding) -> None:
+    """Best-effort removal of a thread that lost a creation race, so it is not orphaned upstream."""
+    url = f"{thread.upstream}/v1/workspace/{WORKSPACE_SLUG}/thread/{thread.thread_id}"
+    try:
+        response = await client.delete(url, headers=headers)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f"Failed to delete duplicate AnythingLLM thread {thread.thread_id}: {e}")
+
+def build_chat_target(message: str, thread: Optional[ThreadBinding], stream: bool = False):
+    """
+    Return the (url, payload) pair for an AnythingLLM chat call.
+    With a thread the thread-specific endpoint of the thread's instance is used,
+    otherwise the general workspace chat of the least busy instance.
+    """
+    action = "stream-chat" if stream else "chat"
+    # Structure payload according to API docs
+    payload: Dict[str, Any] = {
+        "message": message,
+    }
+    if thread:
+        upstream = anythingllm_upstreams.get(thread.upstream)
+        if upstream is None:
+            logger.error(f"Thread {thread.thread_id} lives on {thread.upstream}, which is no longer a configured AnythingLLM instance")
+            raise HTTPException(status_code=503, detail="该会话所在的LLM服务实例已下线，请开始新的会话")
+        # Use the thread-specific chat endpoint format
+        url = f"{upstream.base_url}/v1/workspace/{WORKSPACE_SLUG}/thread/{thread.thread_id}/{action}"
+    else: # No session_id, use general workspace chat
+        logger.info("Using general workspace chat")
+        url = f"{anythingllm_upstreams.pick().base_url}/v1/workspace/{WORKSPACE_SLUG}/{action}"
+        payload["mode"] = "chat"
+    return url, payload
+
+def chat_error_to_http(e: Exception, endpoint: str) -> HTTPException:
+    """Translate an exception raised while serving a chat request into an HTTPException."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail="LLM服务暂时不可用，请稍后重试",
+                             headers={"Retry-After": str(e.retry_after)})
+    if isinstance(e, LimiterRejected):
+        logger.warning(f"{endpoint}: rejected by upstream limiter ({e.reason}), stats={chat_limiter.stats()}")
+        # 排队已满说明请求过多 (429)；排队超时说明上游处理不过来 (503)
+        return HTTPException(
+            status_code=429 if e.reason == "queue_full" else 503,
+            detail="当前咨询人数较多，请稍后重试",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    if isinstance(e, httpx.HTTPStatusError):
         error_body = e.response.text
         try:
             error_json = e.response.json()
@@ -207,81 +590,1162 @@ async def chat(
         except ValueError: # If response is not JSON
             error_detail = error_body
         logger.error(f"AnythingLLM API error: {e.response.status_code} - Detail: {error_detail} - URL: {e.request.url}")
-        raise HTTPException(
+        return HTTPException(
             status_code=e.response.status_code, # Propagate status code from AnythingLLM
             detail=f"LLM服务错误: {error_detail}"
         )
-    except httpx.RequestError as e: # Covers ConnectError, TimeoutException, etc.
+    if isinstance(e, httpx.RequestError): # Covers ConnectError, TimeoutException, etc.
         logger.error(f"HTTP request error to AnythingLLM: {e} - URL: {e.request.url if e.request else 'Unknown URL'}")
-        raise HTTPException(status_code=503, detail=f"无法连接到LLM服务: {str(e)}")
+        return HTTPException(status_code=503, detail=f"无法连接到LLM服务: {str(e)}")
+    if isinstance(e, (PoolTimeoutError, PoolClosedError)):
+        logger.error(f"Database pool unavailable in {endpoint}: {e}")
+        return HTTPException(status_code=503, detail="数据库繁忙，请稍后重试")
+    if isinstance(e, pymysql.MySQLError):
+        logger.error(f"Database error in {endpoint}: {e}")
+        return HTTPException(status_code=500, detail=f"数据库错误: {str(e)}")
+    logger.exception(f"Unexpected error in {endpoint}: {e}")
+    return HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+
+FALLBACK_REPLY = "抱歉，无法获取有效回复内容。"
+
+# --- Degraded mode (circuit open) ---
+# Used only if the resources table cannot be read either (matches the seeded crisis hotline)
+CRISIS_FALLBACK_RESOURCES = [
+    {"title": "全国心理援助热线", "description": "提供24小时心理支持和危机干预", "contact_info": "400-161-9995", "url": None},
+]
+crisis_resources_cache: TTLCache[List[Dict[str, Any]]] = TTLCache(maxsize=1, ttl=CRISIS_RESOURCES_TTL)
+
+async def get_crisis_resources(pool: DatabasePool) -> List[Dict[str, Any]]:
+    """Crisis resources for degraded replies, cached for CRISIS_RESOURCES_TTL seconds."""
+    resources = crisis_resources_cache.get("crisis")
+    if resources is not None:
+        return resources
+    try:
+        with span("db"):
+            async with pool.acquire() as conn:
+                rows = await conn.fetchall(
+                    "SELECT title, description, contact_info, url FROM resources "
+                    "WHERE category = 'crisis' ORDER BY id LIMIT 10")
+    except Exception as e:
+        logger.error(f"Failed to load crisis resources: {e}")
+        return CRISIS_FALLBACK_RESOURCES
+    resources = list(rows) or CRISIS_FALLBACK_RESOURCES
+    crisis_resources_cache.set("crisis", resources)
+    return resources
+
+def build_degraded_reply(resources: List[Dict[str, Any]]) -> str:
+    """Canned reply pointing the user to crisis resources while the LLM is unavailable."""
+    lines = ["抱歉，AI助手暂时无法回复，请稍后再试。",
+             "如果你现在感到非常痛苦或有伤害自己的想法，请立即联系以下援助资源："]
+    for resource in resources:
+        contact = resource.get("contact_info") or resource.get("url")
+        lines.append(f"- {resource['title']}: {contact}" if contact else f"- {resource['title']}")
+    lines.append("如遇紧急危险，请拨打 110 或 120。")
+    return "\n".join(lines)
+
+async def degraded_chat_response(pool: DatabasePool) -> ChatResponse:
+    resources = await get_crisis_resources(pool)
+    return ChatResponse(reply=build_degraded_reply(resources), degraded=True, resources=resources)
+
+async def fetch_chat_reply(
+    client: httpx.AsyncClient, headers: Dict[str, str], message: str, thread: Optional[ThreadBinding]
+) -> Optional[str]:
+    """Call AnythingLLM chat once; returns the reply text, or None if the response format is unknown."""
+    anything_llm_url, payload = build_chat_target(message, thread)
+
+    chat_logger.info("Sending request to: %s", anything_llm_url)
+    with chat_breaker.guard(), span("upstream"): # Includes waiting for a limiter slot
+        async with chat_limiter.slot():
+            with track_upstream("chat"):
+                response = await client.post(anything_llm_url, json=payload, headers=headers)
+                response.raise_for_status()
+
+    result = response.json()
+    logger.debug("Raw response: %s", result)
+
+    # Parse response according to API format
+    if "textResponse" in result:
+        reply_content = result["textResponse"]
+    elif "response" in result and "text" in result["response"]:
+        reply_content = result["response"]["text"]
+    elif result.get("type") == "textResponse" and "text" in result.get("content", {}):
+        reply_content = result["content"]["text"]
+    else:
+        logger.warning("Unexpected response format: %s", result)
+        return None
+    return str(reply_content).strip()
+
+async def cached_stateless_reply(
+    message: str, client: httpx.AsyncClient, headers: Dict[str, str], bypass: bool
+) -> Tuple[Optional[str], str]:
+    """Stateless chat through the reply cache; returns (reply, cache status HIT/MISS/BYPASS)."""
+    global chat_reply_cache_bypasses
+    key = (WORKSPACE_SLUG, normalize_chat_message(message))
+    if bypass:
+        chat_reply_cache_bypasses += 1
+    else:
+        cached = chat_reply_cache.get(key)
+        if cached is not None:
+            return cached, "HIT"
+    if bypass:
+        # Asked for a fresh reply: do not join an identical call that is already in flight
+        reply = await fetch_chat_reply(client, headers, message, None)
+    else:
+        reply = await chat_reply_flights.do(key, lambda: fetch_chat_reply(client, headers, message, None))
+    if reply: # Never cache the fallback text or an empty reply
+        chat_reply_cache.set(key, reply)
+    return reply, "BYPASS" if bypass else "MISS"
+
+async def answer_chat(
+    request: ChatRequest,
+    client: httpx.AsyncClient,
+    pool: DatabasePool,
+    headers: Dict[str, str],
+    bypass_cache: bool,
+) -> Tuple[ChatResponse, Optional[str]]:
+    """
+    Answer one chat message; shared by /api/chat and /api/chat/batch.
+    Returns the response and the reply-cache status (HIT/MISS/BYPASS, None if the cache was not used).
+    """
+    try:
+        if request.session_id:
+            thread = await resolve_thread_id(request.session_id, client, pool, headers)
+            reply = await fetch_chat_reply(client, headers, request.message, thread) or FALLBACK_REPLY
+            await record_chat_turn(request.session_id, request.message, reply)
+            return ChatResponse(reply=reply), None
+
+        # 无会话的工作区对话没有上下文，相同问题可直接复用缓存的回复
+        if not CHAT_REPLY_CACHE_ENABLED:
+            reply = await fetch_chat_reply(client, headers, request.message, None)
+            return ChatResponse(reply=reply or FALLBACK_REPLY), None
+        reply, cache_status = await cached_stateless_reply(request.message, client, headers, bypass_cache)
+        return ChatResponse(reply=reply or FALLBACK_REPLY), cache_status
+
+    except CircuitOpenError:
+        # 上游不可用时立即返回带危机资源的降级回复，不让用户等待超时
+        logger.warning("Circuit open: returning degraded chat reply")
+        return await degraded_chat_response(pool), None
+
+@app.post("/api/chat", response_model=ChatResponse) # 定义/api/chat路径的POST请求处理函数，响应模型为ChatResponse
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    client: Annotated[httpx.AsyncClient, Depends(get_http_client)], # Use Depends for the client
+    pool: Annotated[DatabasePool, Depends(get_db_pool)] # Connections are only checked out when needed
+):
+    ensure_anythingllm_configured()
+    headers = anythingllm_headers()
+
+    try:
+        response, cache_status = await answer_chat(
+            request, client, pool, headers, wants_cache_bypass(http_request))
     except Exception as e:
-        logger.exception(f"Unexpected error in chat endpoint: {e}")
-        raise HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}")
+        raise chat_error_to_http(e, "chat endpoint")
+    # Serialized here (not by FastAPI after returning) so it shows up as its own Server-Timing span
+    with span("serialize"):
+        body = dumps(response.model_dump())
+    return Response(
+        content=body, media_type="application/json",
+        headers={"X-Cache": cache_status} if cache_status else None,
+    )
+
+# --- Stateless chat reply cache ---
+# (workspace_slug, normalized message) -> reply
+chat_reply_cache: TTLCache[str] = TTLCache(maxsize=CHAT_REPLY_CACHE_MAX_SIZE, ttl=CHAT_REPLY_CACHE_TTL)
+# Identical questions arriving together share one upstream call
+chat_reply_flights: SingleFlight[Optional[str]] = SingleFlight()
+chat_reply_cache_bypasses = 0
+
+def normalize_chat_message(message: str) -> str:
+    """
+    Fold a chat message to the form used as cache key:
+    NFKC (全角 -> 半角), case-folded, with all whitespace and punctuation removed.
+    "  失眠怎么办？ " and "失眠怎么办?" map to the same key.
+    """
+    folded = unicodedata.normalize("NFKC", message).casefold()
+    return "".join(
+        ch for ch in folded
+        if not ch.isspace() and not unicodedata.category(ch).startswith("P")
+    )
+
+def wants_cache_bypass(http_request: Request) -> bool:
+    """True if the client asked for a fresh reply (X-Cache-Bypass: 1 or Cache-Control: no-cache/no-store)."""
+    if http_request.headers.get(CHAT_REPLY_CACHE_BYPASS_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    cache_control = http_request.headers.get("cache-control", "").lower()
+    return "no-cache" in cache_control or "no-store" in cache_control
+
+def chat_reply_cache_stats() -> Dict[str, Any]:
+    stats = chat_reply_cache.stats()
+    stats["enabled"] = CHAT_REPLY_CACHE_ENABLED
+    stats["bypasses"] = chat_reply_cache_bypasses
+    return stats
+
+# --- Streaming chat ---
+STREAM_MEDIA_TYPES = {
+    "sse": "text/event-stream",
+    "ndjson": "application/x-ndjson",
+}
+
+def encode_stream_event(event: Dict[str, Any], stream_format: str) -> bytes:
+    """Encode one event as an SSE frame or an NDJSON line."""
+    data = json.dumps(event, ensure_ascii=False)
+    if stream_format == "sse":
+        return f"data: {data}\n\n".encode("utf-8")
+    return f"{data}\n".encode("utf-8")
+
+async def iter_anythingllm_stream(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Parse the SSE body of AnythingLLM's stream-chat endpoints into chunk dicts as they arrive.
+    Only the current partial line is buffered; nothing is accumulated across chunks.
+    """
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if not data:
+            continue
+        try:
+            yield json.loads(data)
+        except ValueError:
+            logger.warning(f"Skipping malformed stream chunk from AnythingLLM: {data[:200]}")
+
+async def open_chat_stream(
+    request: ChatRequest,
+    client: httpx.AsyncClient,
+    pool: DatabasePool,
+    headers: Dict[str, str],
+) -> Tuple[httpx.Response, Permit]:
+    """
+    Resolve the session's thread and open AnythingLLM's stream-chat; shared by /api/chat/stream and /ws/chat.
+    Returns the upstream response (headers received, body unread) and the limiter permit it holds;
+    both are handed to relay_chat_events(). Setup failures raise, with the permit already released.
+    """
+    permit: Optional[Permit] = None
+    try:
+        thread = None
+        if request.session_id:
+            thread = await resolve_thread_id(request.session_id, client, pool, headers)
+        anything_llm_url, payload = build_chat_target(request.message, thread, stream=True)
+
+        with chat_breaker.guard():
+            permit = await chat_limiter.acquire()
+            chat_logger.info("Opening stream to: %s", anything_llm_url)
+            with track_upstream("stream_chat"), span("upstream"):
+                upstream = await client.send(
+                    client.build_request("POST", anything_llm_url, json=payload, headers=headers),
+                    stream=True,
+                )
+                if upstream.is_error:
+                    await upstream.aread()
+                    await upstream.aclose()
+                    upstream.raise_for_status()
+    except BaseException as e:
+        if permit:
+            permit.release(overloaded=is_overload_error(e), sample=not isinstance(e, asyncio.CancelledError))
+        raise
+    return upstream, permit
+
+async def degraded_chat_events(pool: DatabasePool, session_id: Optional[str]) -> List[Dict[str, Any]]:
+    """The degraded reply (circuit open) as stream events: one token event and a done event with the resources."""
+    logger.warning("Circuit open: returning degraded chat stream")
+    degraded = await degraded_chat_response(pool)
+    return [
+        {"type": "token", "text": degraded.reply},
+        {"type": "done", "session_id": session_id, "degraded": True, "resources": degraded.resources},
+    ]
+
+async def relay_chat_events(
+    upstream: httpx.Response,
+    session_id: Optional[str],
+    user_message: Optional[str] = None,
+    permit: Optional[Permit] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Relay AnythingLLM text chunks as token events, then a done (or error) event.
+    The upstream response is always closed, including when the consumer stops mid-stream.
+    When session_id and user_message are given, the completed turn is queued for chat history.
+    A limiter permit is held until the stream ends and released with the stream's outcome.
+    """
+    record = bool(session_id and user_message is not None)
+    reply_parts: List[str] = []
+    overloaded = False
+    finished = False
+    try:
+        async for chunk in iter_anythingllm_stream(upstream):
+            if chunk.get("error"):
+                overloaded = finished = True
+                logger.error(f"AnythingLLM stream error: {chunk['error']}")
+                yield {"type": "error", "detail": f"LLM服务错误: {chunk['error']}"}
+                return
+            text = chunk.get("textResponse")
+            if text:
+                if record:
+                    reply_parts.append(text)
+                yield {"type": "token", "text": text}
+            if chunk.get("close"):
+                break
+        finished = True
+        yield {"type": "done", "session_id": session_id}
+        if record:
+            await record_chat_turn(session_id, user_message, "".join(reply_parts).strip())
+    except httpx.RequestError as e:
+        overloaded = finished = is_overload_error(e)
+        logger.error(f"HTTP request error while streaming from AnythingLLM: {e}")
+        yield {"type": "error", "detail": f"无法连接到LLM服务: {str(e)}"}
     finally:
-        if db_conn:
-            db_conn.close()
-            logger.debug("Database connection closed for chat endpoint.")
+        await upstream.aclose()
+        if permit:
+            # A client that disconnected mid-stream tells us nothing about upstream latency
+            permit.release(overloaded=overloaded, sample=finished)
+
+async def relay_chat_stream(
+    upstream: httpx.Response,
+    stream_format: str,
+    session_id: Optional[str],
+    user_message: Optional[str] = None,
+    permit: Optional[Permit] = None,
+) -> AsyncIterator[bytes]:
+    """relay_chat_events() encoded as SSE frames or NDJSON lines for /api/chat/stream."""
+    async with aclosing(relay_chat_events(upstream, session_id, user_message, permit)) as events:
+        async for event in events:
+            yield encode_stream_event(event, stream_format)
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always closes its body generator when the response ends.
+    Starlette does not aclose() the body when the client disconnects, so a generator paused at a
+    yield would keep what it holds (a pooled connection, batch workers, an upstream stream) until GC.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with anyio.CancelScope(shield=True):
+                await self.body_iterator.aclose() # Runs the generator's own cleanup if it had started
+                await self.close()
 
+    async def close(self) -> None:
+        """Cleanup for resources the body may never have reached (it may not have started at all)."""
+
+class UpstreamStreamingResponse(ClosingStreamingResponse):
+    """
+    Response for a relayed upstream stream. relay_chat_events() closes the upstream and releases
+    the permit in its finally block, but a client that disconnects before the first chunk never
+    starts it; this closes both in that case too.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], upstream: httpx.Response, permit: Optional[Permit], **kwargs: Any):
+        super().__init__(content, **kwargs)
+        self.upstream = upstream
+        self.permit = permit
+
+    async def close(self) -> None:
+        await self.upstream.aclose()
+        if self.permit:
+            self.permit.release(sample=False) # No-op when the relay already released it
+
+@app.post("/api/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
+    pool: Annotated[DatabasePool, Depends(get_db_pool)],
+    format: str = Query("sse", pattern="^(sse|ndjson)$", description="Stream framing: sse or ndjson"),
+):
+    """
+    流式聊天端点: 与 /api/chat 使用相同的会话/线程解析逻辑，
+    但调用 AnythingLLM 的 stream-chat 接口，并在 token 到达时立即转发给客户端。
+    每个事件为 {"type": "token" | "done" | "error", ...}。
+    """
+    ensure_anythingllm_configured()
+    headers = anythingllm_headers()
+
+    # Resolve the thread and open the upstream stream before responding,
+    # so setup failures still map to proper HTTP status codes.
+    try:
+        upstream, permit = await open_chat_stream(request, client, pool, headers)
+    except CircuitOpenError:
+        events = await degraded_chat_events(pool, request.session_id)
+        return StreamingResponse(
+            iter([encode_stream_event(event, format) for event in events]),
+            media_type=STREAM_MEDIA_TYPES[format],
+            headers={"Cache-Control": "no-cache"},
+        )
+    except Exception as e:
+        raise chat_error_to_http(e, "chat stream endpoint")
+
+    return UpstreamStreamingResponse(
+        relay_chat_stream(upstream, format, request.session_id, request.message, permit),
+        upstream,
+        permit,
+        media_type=STREAM_MEDIA_TYPES[format],
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no", # Disable nginx proxy buffering so tokens are flushed immediately
+        },
+    )
+
+# --- WebSocket chat ---
+class ChatSocketMessage(ChatRequest):
+    """A chat frame on /ws/chat; ``id`` is chosen by the client and echoed on every frame of the reply."""
+    id: str = Field(..., min_length=1, max_length=64)
+
+class SlowConsumer(Exception):
+    """The client stopped reading: its send queue stayed full for WS_SEND_TIMEOUT seconds."""
+
+websocket_stats: Dict[str, int] = {
+    "open": 0, "connections": 0, "messages": 0, "rejected": 0,
+    "cancelled": 0, "idle_timeouts": 0, "slow_consumers": 0,
+}
+
+@app.websocket("/ws/chat")
+async def chat_socket(
+    websocket: WebSocket,
+    client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
+    pool: Annotated[DatabasePool, Depends(get_db_pool)],
+):
+    """
+    WebSocket 聊天通道: 一个连接承载任意多条消息 (可属于不同会话)，省去每条消息的握手、CORS预检和请求头。
+    客户端发送 {"type": "chat", "id", "message", "session_id"}，回复以 {"id", "session_id", "type": "token" | "done" | "error", ...}
+    帧流式返回 (事件与 /api/chat/stream 相同，线程解析同样走 resolve_thread_id())。
+    同一会话的消息按到达顺序处理，不同会话并发处理，每个连接最多 WS_MAX_IN_FLIGHT 条。
+    其他帧: {"type": "cancel", "id"} 取消进行中的消息；{"type": "ping"} 回复 {"type": "pong"}；
+    服务器每 WS_HEARTBEAT_INTERVAL 秒发送 {"type": "ping"}，WS_IDLE_TIMEOUT 秒内未收到客户端任何帧则关闭连接。
+    """
+    await websocket.accept()
+    websocket_stats["connections"] += 1
+    websocket_stats["open"] += 1
+    loop = asyncio.get_running_loop()
+    last_received = loop.time()
+    # Every frame goes through one bounded queue drained by a single writer: when the client reads
+    # slowly, replies wait here, which in turn stops reading from AnythingLLM
+    outbox: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(WS_SEND_QUEUE_SIZE)
+    in_flight: Dict[str, asyncio.Task] = {}
+    session_tails: Dict[str, asyncio.Task] = {} # Latest message of each session, the next one waits for it
+    closed = asyncio.Event()
+    close_frame: Optional[Tuple[int, str]] = None
+
+    def close(code: int, reason: str) -> None:
+        nonlocal close_frame
+        if close_frame is None:
+            close_frame = (code, reason)
+        closed.set()
+
+    async def send(frame: Dict[str, Any]) -> None:
+        if not outbox.full():
+            outbox.put_nowait(frame)
+            return
+        putter = asyncio.ensure_future(outbox.put(frame))
+        try:
+            done, _ = await asyncio.wait((putter,), timeout=WS_SEND_TIMEOUT)
+        finally:
+            putter.cancel()
+        if not done:
+            raise SlowConsumer()
+
+    async def send_error(message_id: Optional[str], session_id: Optional[str], error: HTTPException) -> None:
+        frame = {"id": message_id, "session_id": session_id, "type": "error",
+                 "status_code": error.status_code, "detail": error.detail}
+        if error.headers and "Retry-After" in error.headers:
+            frame["retry_after"] = int(error.headers["Retry-After"])
+        await send(frame)
+
+    async def write_frames() -> None:
+        while True:
+            frame = await outbox.get()
+            await websocket.send_text(dumps(frame).decode("utf-8"))
+
+    async def heartbeat() -> None:
+        while True:
+            await asyncio.sleep(WS_HEARTBEAT_INTERVAL)
+            if loop.time() - last_received > WS_IDLE_TIMEOUT:
+                websocket_stats["idle_timeouts"] += 1
+                close(1000, "idle timeout")
+                return
+            if not outbox.full(): # A client this far behind is not idle
+                outbox.put_nowait({"type": "ping"})
+
+    async def relay(item: ChatSocketMessage) -> None:
+        reply = {"id": item.id, "session_id": item.session_id}
+        try:
+            ensure_anythingllm_configured()
+            upstream, permit = await open_chat_stream(item, client, pool, anythingllm_headers())
+        except CircuitOpenError:
+            for event in await degraded_chat_events(pool, item.session_id):
+                await send({**reply, **event})
+            return
+        except Exception as e:
+            await send_error(item.id, item.session_id, chat_error_to_http(e, "chat websocket endpoint"))
+            return
+        async with aclosing(relay_chat_events(upstream, item.session_id, item.message, permit)) as events:
+            async for event in events:
+                await send({**reply, **event})
+
+    async def answer(item: ChatSocketMessage, previous: Optional[asyncio.Task]) -> None:
+        try:
+            if previous is not None:
+                await asyncio.wait((previous,)) # Same session: continue the thread in order
+            await relay(item)
+        except SlowConsumer:
+            websocket_stats["slow_consumers"] += 1
+            close(1008, "client not reading")
+        except Exception as e:
+            logger.exception(f"Unexpected error in chat websocket endpoint: {e}")
+            await send_error(item.id, item.session_id, HTTPException(status_code=500, detail=f"内部服务器错误: {str(e)}"))
+
+    async def start_chat(frame: Dict[str, Any]) -> None:
+        message_id = frame.get("id") if isinstance(frame.get("id"), str) else None
+        try:
+            item = ChatSocketMessage.model_validate(frame)
+        except ValidationError as e:
+            websocket_stats["rejected"] += 1
+            await send_error(message_id, None, HTTPException(
+                status_code=422, detail=e.errors(include_url=False, include_context=False)))
+            return
+        if item.id in in_flight:
+            websocket_stats["rejected"] += 1
+            await send_error(item.id, item.session_id, HTTPException(status_code=409, detail="该消息ID正在处理中"))
+            return
+        if len(in_flight) >= WS_MAX_IN_FLIGHT:
+            websocket_stats["rejected"] += 1
+            await send_error(item.id, item.session_id, HTTPException(
+                status_code=429, detail="同时处理的消息过多，请等待之前的回复完成"))
+            return
+        websocket_stats["messages"] += 1
+        previous = session_tails.get(item.session_id) if item.session_id else None
+        task = asyncio.create_task(answer(item, previous))
+        in_flight[item.id] = task
+        task.add_done_callback(lambda _: in_flight.pop(item.id, None))
+        if item.session_id:
+            session_tails[item.session_id] = task
+            task.add_done_callback(
+                lambda done: session_tails.pop(item.session_id) if session_tails.get(item.session_id) is done else None)
+
+    async def receive_frames() -> None:
+        nonlocal last_received
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            last_received = loop.time()
+            try:
+                frame = json.loads(message["text"] if message.get("text") is not None else message["bytes"])
+            except (ValueError, KeyError, TypeError):
+                frame = None
+            if not isinstance(frame, dict):
+                websocket_stats["rejected"] += 1
+                await send_error(None, None, HTTPException(status_code=400, detail="无效的消息帧，应为JSON对象"))
+                continue
+            frame_type = frame.get("type", "chat")
+            if frame_type == "chat":
+                await start_chat(frame)
+            elif frame_type == "ping":
+                await send({"type": "pong"})
+            elif frame_type == "cancel":
+                task = in_flight.get(frame.get("id"))
+                if task is not None:
+                    task.cancel()
+                    websocket_stats["cancelled"] += 1
+                    await send({"id": frame["id"], "type": "cancelled"})
+            elif frame_type != "pong":
+                websocket_stats["rejected"] += 1
+                await send_error(None, None, HTTPException(status_code=400, detail=f"未知的消息类型: {frame_type}"))
+
+    workers = [asyncio.create_task(receive_frames()), asyncio.create_task(write_frames()),
+               asyncio.create_task(heartbeat()), asyncio.ensure_future(closed.wait())]
+    try:
+        done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            error = None if task.cancelled() else task.exception()
+            if isinstance(error, SlowConsumer): # The receive loop could not even queue a pong
+                websocket_stats["slow_consumers"] += 1
+                close(1008, "client not reading")
+            elif error is not None and not isinstance(error, WebSocketDisconnect): # Disconnect = client went away
+                logger.error(f"Chat websocket task failed: {error!r}")
+                close(1011, "internal error")
+    finally:
+        # Stop replies still being relayed: their upstream streams are closed and permits released
+        pending = [*workers, *in_flight.values()]
+        for task in pending:
+            task.cancel()
+        # asyncio.wait, not gather: a gather cancelled by the server's own cancel scope surfaces as a stray CancelledError
+        await asyncio.wait(pending)
+        websocket_stats["open"] -= 1
+    if close_frame is not None:
+        try:
+            await websocket.close(*close_frame)
+        except RuntimeError: # Already closed by the client
+            pass
+
+# --- Batch chat ---
+class ChatBatchRequest(BaseModel):
+    items: List[ChatRequest] = Field(..., min_length=1, max_length=CHAT_BATCH_MAX_ITEMS)
+
+async def preload_thread_ids(session_ids: Iterable[str], pool: DatabasePool) -> None:
+    """Look up the threads of many sessions with one chat_sessions query and put them in session_thread_cache."""
+    missing = [session_id for session_id in set(session_ids) if session_id not in session_thread_cache]
+    if not missing:
+        return
+    placeholders = ", ".join(["%s"] * len(missing))
+    async with pool.acquire() as conn:
+        rows = await conn.fetchall(
+            f"SELECT id, anythingllm_thread_id, anythingllm_upstream FROM chat_sessions WHERE id IN ({placeholders})", missing)
+    for row in rows:
+        if row.get("anythingllm_thread_id"):
+            session_thread_cache.set(row["id"], stored_binding(row))
+
+async def run_chat_batch(
+    items: List[ChatRequest],
+    client: httpx.AsyncClient,
+    pool: DatabasePool,
+    headers: Dict[str, str],
+    bypass_cache: bool,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Answer batch items with at most CHAT_BATCH_CONCURRENCY in flight, yielding each result as it completes.
+    Items that share a session_id run one after another in request order, since they continue the same
+    thread; stateless items and different sessions run concurrently. A failing item yields an error
+    result and does not affect the others.
+    """
+    groups: Dict[Any, List[int]] = {}
+    for index, item in enumerate(items):
+        groups.setdefault(item.session_id or ("stateless", index), []).append(index)
+    pending = deque(groups.values())
+    results: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    async def answer_item(index: int) -> Dict[str, Any]:
+        item = items[index]
+        try:
+            response, _ = await answer_chat(item, client, pool, headers, bypass_cache)
+        except Exception as e:
+            error = chat_error_to_http(e, "chat batch endpoint")
+            return {"index": index, "session_id": item.session_id,
+                    "error": {"status_code": error.status_code, "detail": error.detail}}
+        return {"index": index, "session_id": item.session_id, **response.model_dump(exclude_none=True)}
+
+    async def worker() -> None:
+        while pending:
+            for index in pending.popleft():
+                results.put_nowait(await answer_item(index))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(CHAT_BATCH_CONCURRENCY, len(pending)))]
+    try:
+        for _ in range(len(items)):
+            yield await results.get()
+    finally:
+        # Client went away (NDJSON) or all results are in: stop outstanding work either way
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+async def encode_batch_results(results: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """NDJSON body for /api/chat/batch; closing it closes run_chat_batch(), which cancels the outstanding items."""
+    async with aclosing(results):
+        async for result in results:
+            yield encode_stream_event(result, "ndjson")
+
+@app.post("/api/chat/batch")
+async def chat_batch(
+    batch: ChatBatchRequest,
+    http_request: Request,
+    client: Annotated[httpx.AsyncClient, Depends(get_http_client)],
+    pool: Annotated[DatabasePool, Depends(get_db_pool)],
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json: one response with all results; ndjson: one line per item as it completes"),
+):
+    """
+    批量聊天端点: 并发处理多条 ChatRequest (并发上限 CHAT_BATCH_CONCURRENCY)，每条单独返回结果或错误。
+    format=ndjson 时每条完成后立即输出一行，慢的条目不会阻塞其他条目。
+    """
+    ensure_anythingllm_configured()
+    headers = anythingllm_headers()
+
+    # One grouped query for every session in the batch; items fall back to per-session lookups if it fails
+    try:
+        await preload_thread_ids((item.session_id for item in batch.items if item.session_id), pool)
+    except Exception as e:
+        logger.warning(f"Batch thread preload failed, resolving sessions individually: {e}")
+
+    results = run_chat_batch(batch.items, client, pool, headers, wants_cache_bypass(http_request))
+    if format == "ndjson":
+        return ClosingStreamingResponse(
+            encode_batch_results(results),
+            media_type=STREAM_MEDIA_TYPES["ndjson"],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    async with aclosing(results):
+        collected = sorted([result async for result in results], key=lambda result: result["index"])
+    failed = sum(1 for result in collected if "error" in result)
+    return {"results": collected, "succeeded": len(collected) - failed, "failed": failed}
+
+# --- Feedback (write-behind into feedback) ---
+class FeedbackRequest(BaseModel):
+    message_id: str = Field(..., min_length=1, max_length=36) # 被评价的回复 (chat_messages.id 或前端生成的ID)
+    user_query: str
+    bot_response: str
+    rating: Optional[int] = Field(None, ge=-1, le=5) # 1/-1 为点赞/点踩，也可使用 1-5 分
+    comment: Optional[str] = Field(None, max_length=2000)
+
+class FeedbackBatchRequest(BaseModel):
+    items: List[FeedbackRequest] = Field(..., min_length=1, max_length=FEEDBACK_BATCH_MAX_ITEMS)
+
+async def write_feedback(rows: List[tuple]) -> None:
+    """Flush callback for the feedback writer: one multi-row INSERT per batch (already one row per message_id)."""
+    async with app.state.db_pool.acquire() as conn:
+        await conn.executemany(
+            "INSERT INTO feedback (message_id, user_query, bot_response, rating, comment, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows)
+
+@app.post("/api/feedback", status_code=202)
+async def submit_feedback(body: Union[FeedbackBatchRequest, FeedbackRequest]):
+    """
+    反馈端点: 接收单条反馈或 {"items": [...]} 批量反馈，放入内存队列后立即返回 202。
+    后台按 FEEDBACK_BATCH_SIZE / FEEDBACK_FLUSH_INTERVAL 批量写入；同一 message_id 尚未写入时重复提交只保留最新一条。
+    """
+    writer: Optional[BatchWriter] = getattr(app.state, "feedback_writer", None)
+    if writer is None:
+        raise HTTPException(status_code=503, detail="反馈服务暂不可用")
+    items = body.items if isinstance(body, FeedbackBatchRequest) else [body]
+    now = datetime.datetime.now()
+    accepted = 0
+    for item in items:
+        row = (item.message_id, item.user_query, item.bot_response, item.rating, item.comment, now)
+        if await writer.put(row):
+            accepted += 1
+    if not accepted:
+        raise HTTPException(status_code=503, detail="反馈提交人数较多，请稍后重试", headers={"Retry-After": "1"})
+    return {"accepted": accepted, "dropped": len(items) - accepted}
+
+# --- Resources response cache ---
+class ResourcesCacheEntry(NamedTuple):
+    version: Tuple[Any, ...] # (row count, MAX(updated_at)) of the resources table when cached
+    body: bytes # Serialized JSON body, reused as-is on every hit
+    etag: str # Strong ETag derived from the body
+    next_cursor: Optional[str] # Cursor for the following page, None on the last page
+
+# (category, location, limit, cursor, fields) -> serialized response
+resources_cache: TTLCache[ResourcesCacheEntry] = TTLCache(maxsize=RESOURCES_CACHE_MAX_SIZE, ttl=RESOURCES_CACHE_TTL)
+# Memoizes the table version so that cache hits do not need a query every time
+resources_version_cache: TTLCache[Tuple[Any, ...]] = TTLCache(maxsize=1, ttl=RESOURCES_VERSION_TTL)
+
+async def load_resources_version(conn: AsyncConnection) -> Tuple[Any, ...]:
+    """Cheap fingerprint of the resources table; changes on insert, delete and update."""
+    row = await conn.fetchone("SELECT COUNT(*) AS row_count, MAX(updated_at) AS last_updated FROM resources")
+    version = (row["row_count"], row["last_updated"]) if row else (0, None)
+    resources_version_cache.set("resources", version)
+    return version
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 7232 If-None-Match comparison (weak comparison, as required for GET)."""
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    return "*" in candidates or any(c.removeprefix("W/") == etag for c in candidates)
+
+# Columns that may be requested through ?fields=; id and created_at are always returned (cursor keys)
+RESOURCE_COLUMNS = ("id", "title", "description", "category", "location_tag", "contact_info", "url", "created_at", "updated_at")
+RESOURCE_KEY_COLUMNS = ("id", "created_at")
+
+def parse_resource_fields(fields: Optional[str]) -> Tuple[str, ...]:
+    """Validate a comma-separated ?fields= projection and return the columns to select, in table order."""
+    if not fields:
+        return RESOURCE_COLUMNS
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(RESOURCE_COLUMNS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(sorted(unknown))}")
+    requested.update(RESOURCE_KEY_COLUMNS)
+    return tuple(c for c in RESOURCE_COLUMNS if c in requested)
+
+def encode_cursor(*values: Any) -> str:
+    """Pack keyset values into an opaque, URL-safe cursor string."""
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Inverse of encode_cursor(); a malformed cursor is a client error (400)."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="无效的分页游标") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return values
+
+def encode_resource_cursor(row: Dict[str, Any]) -> str:
+    """Opaque keyset cursor: the (created_at, id) of the last row on the page."""
+    created_at = row["created_at"]
+    created_at = created_at.isoformat() if hasattr(created_at, "isoformat") else str(created_at)
+    return encode_cursor(created_at, row["id"])
+
+def decode_resource_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    created_at, row_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="无效的分页游标") from e
+
+def decode_search_cursor(cursor: str) -> Tuple[float, int]:
+    relevance, row_id = decode_cursor(cursor, 2)
+    try:
+        relevance, row_id = float(relevance), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="无效的分页游标") from e
+    if not math.isfinite(relevance):
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+    return relevance, row_id
 
 @app.get("/api/resources")
 async def get_resources(
+    request: Request,
     category: Optional[str] = Query(None, description="Filter by resource category"),
     location: Optional[str] = Query(None, description="Filter by location tag"),
-    limit: int = Query(50, ge=1, le=1000, description="Maximum number of records to return") # Added ge and le for validation
+    limit: int = Query(50, ge=1, le=1000, description="Maximum number of records to return"), # Added ge and le for validation
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return; id and created_at are always included"),
+    pool: DatabasePool = Depends(get_db_pool)
 ):
-    conn = get_db_connection()
+    """
+    获取心理健康资源列表。
+    按 (created_at, id) 倒序做游标分页：下一页的游标在 X-Next-Cursor 响应头中，最后一页没有该响应头。
+    fields 参数只查询列表需要的列 (例如不传输 description)。
+    序列化后的响应按查询参数缓存，表的行数或 MAX(updated_at) 变化时失效。
+    响应带强 ETag，客户端携带匹配的 If-None-Match 时返回 304 (不查询、不重新序列化)。
+    """
+    columns = parse_resource_fields(fields)
+    after = decode_resource_cursor(cursor) if cursor else None
+    cache_key = (category, location, limit, cursor, columns)
     try:
-        with conn.cursor() as cursor:
-            query = "SELECT * FROM resources WHERE 1=1"
-            params = []
-
-            if category:
-                query += " AND category = %s"
-                params.append(category)
-
-            if location:
-                query += " AND location_tag = %s" # Ensure column name is correct
-                params.append(location)
-
-            query += " ORDER BY created_at DESC LIMIT %s" # Ensure 'created_at' column exists
-            params.append(limit)
-
-            logger.debug(f"Executing DB query: {query} with params: {params}")
-            cursor.execute(query, tuple(params)) # Ensure params is a tuple
-            resources_data = cursor.fetchall()
-
-            # Convert decimal types to float and bytes to string for JSON serialization
-            processed_resources = []
-            for resource_row in resources_data:
-                processed_row = {}
-                for key, value in resource_row.items():
-                    if isinstance(value, bytes):
-                        try:
-                            processed_row[key] = value.decode('utf-8')
-                        except UnicodeDecodeError:
-                            logger.warning(f"Could not decode bytes to utf-8 for key '{key}'. Storing as repr.")
-                            processed_row[key] = repr(value) # Fallback for non-utf8 bytes
-                    elif hasattr(value, 'quantize'): # Check for Decimal type
-                        processed_row[key] = float(value)
-                    else:
-                        processed_row[key] = value
-                processed_resources.append(processed_row)
-
-            return processed_resources
+        version = resources_version_cache.get("resources")
+        entry = resources_cache.get(cache_key)
+        if version is None or entry is None or entry.version != version:
+            resources_data = None
+            with span("db"):
+                async with pool.acquire() as conn:
+                    if version is None:
+                        version = await load_resources_version(conn)
+                    if entry is None or entry.version != version:
+                        query = f"SELECT {', '.join(columns)} FROM resources WHERE 1=1"
+                        params = []
+
+                        if category:
+                            query += " AND category = %s"
+                            params.append(category)
+
+                        if location:
+                            query += " AND location_tag = %s" # Ensure column name is correct
+                            params.append(location)
+
+                        if after:
+                            # Keyset condition written out so MySQL can use it as an index range
+                            query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+                            params.extend([after[0], after[0], after[1]])
+
+                        # Fetch one extra row to learn whether another page exists
+                        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+                        params.append(limit + 1)
+
+                        logger.debug("Executing DB query: %s with params: %s", query, params)
+                        resources_data = await conn.fetchall(query, tuple(params)) # Ensure params is a tuple
+                        description = conn.description
+
+            # Serialize after the connection is back in the pool
+            if resources_data is not None:
+                next_cursor = None
+                if len(resources_data) > limit:
+                    resources_data = resources_data[:limit]
+                    next_cursor = encode_resource_cursor(resources_data[-1])
+
+                # Column converters come from cursor.description; rows go straight to JSON bytes
+                with span("serialize"):
+                    body = dumps_rows(resources_data, description)
+                entry = ResourcesCacheEntry(version, body, make_etag(body), next_cursor)
+                resources_cache.set(cache_key, entry)
+    except (PoolTimeoutError, PoolClosedError) as e:
+        logger.error(f"Database pool unavailable in get_resources endpoint: {e}")
+        raise HTTPException(status_code=503, detail="数据库繁忙，请稍后重试")
     except pymysql.MySQLError as e: # More specific exception for DB errors
         logger.error(f"Error querying database: {e}")
         raise HTTPException(status_code=500, detail=f"数据库查询错误: {str(e)}")
     except Exception as e:
         logger.exception(f"Unexpected error in get_resources endpoint: {e}")
         raise HTTPException(status_code=500, detail=f"获取资源时发生内部服务器错误: {str(e)}")
-    finally:
-        if conn: # Ensure conn is not None before closing
-            conn.close()
+
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={RESOURCES_CACHE_MAX_AGE}",
+    }
+    if entry.next_cursor:
+        headers["X-Next-Cursor"] = entry.next_cursor
+    if etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+# Full-text relevance over the ngram FULLTEXT index ft_title_description (see migration 1.3.0)
+RESOURCE_MATCH = "MATCH(title, description) AGAINST (%s IN NATURAL LANGUAGE MODE)"
+
+@app.get("/api/resources/search")
+async def search_resources(
+    q: str = Query(..., min_length=2, max_length=100, description="Search keywords (CJK-aware, at least 2 characters)"),
+    category: Optional[str] = Query(None, description="Filter by resource category"),
+    location: Optional[str] = Query(None, description="Filter by location tag"),
+    limit: int = Query(20, ge=1, le=100, description="Maximum number of records to return"),
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated columns to return; id and created_at are always included"),
+    pool: DatabasePool = Depends(get_db_pool)
+):
+    """
+    按关键词全文搜索资源 (title/description)，按相关度排序。
+    使用 ngram 解析器的 FULLTEXT 索引，中文关键词无需分词即可匹配 (ngram_token_size 默认为 2)。
+    可与 category/location 过滤组合；按 (relevance, id) 游标分页，下一页游标在 X-Next-Cursor 响应头中。
+    """
+    columns = parse_resource_fields(fields)
+    keywords = q.strip()
+    if len(keywords) < 2:
+        raise HTTPException(status_code=400, detail="搜索关键词至少需要2个字符")
+
+    query = f"SELECT {', '.join(columns)}, {RESOURCE_MATCH} AS relevance FROM resources WHERE {RESOURCE_MATCH}"
+    params: List[Any] = [keywords, keywords]
+
+    if category:
+        query += " AND category = %s"
+        params.append(category)
+
+    if location:
+        query += " AND location_tag = %s"
+        params.append(location)
+
+    if cursor:
+        relevance, row_id = decode_search_cursor(cursor)
+        # MATCH() is deterministic for a given index state, so relevance round-trips exactly
+        query += " HAVING (relevance < %s OR (relevance = %s AND id < %s))"
+        params.extend([relevance, relevance, row_id])
+
+    query += " ORDER BY relevance DESC, id DESC LIMIT %s"
+    params.append(limit + 1)
+
+    try:
+        async with pool.acquire() as conn:
+            logger.debug("Executing search query: %s with params: %s", query, params)
+            rows = await conn.fetchall(query, tuple(params))
+            description = conn.description
+    except (PoolTimeoutError, PoolClosedError) as e:
+        logger.error(f"Database pool unavailable in search_resources endpoint: {e}")
+        raise HTTPException(status_code=503, detail="数据库繁忙，请稍后重试")
+    except pymysql.MySQLError as e:
+        logger.error(f"Error searching resources: {e}")
+        raise HTTPException(status_code=500, detail=f"数据库查询错误: {str(e)}")
+
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(float(rows[-1]["relevance"]), rows[-1]["id"])
+    return Response(content=dumps_rows(rows, description), media_type="application/json", headers=headers)
+
+# --- Chat history ---
+MESSAGE_COLUMNS = "id, role, content, created_at"
+
+def decode_message_cursor(cursor: str) -> Tuple[datetime.datetime, str]:
+    created_at, message_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.datetime.fromisoformat(created_at), str(message_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="无效的分页游标") from e
+
+def session_messages_query(
+    session_id: str, after: Optional[Tuple[datetime.datetime, str]], order: str, limit: Optional[int]
+) -> Tuple[str, List[Any]]:
+    """Keyset query on (created_at, id), served by the (session_id, created_at, id) index."""
+    op, direction = (">", "ASC") if order == "asc" else ("<", "DESC")
+    query = f"SELECT {MESSAGE_COLUMNS} FROM chat_messages WHERE session_id = %s"
+    params: List[Any] = [session_id]
+    if after:
+        query += f" AND (created_at {op} %s OR (created_at = %s AND id {op} %s))"
+        params.extend([after[0], after[0], after[1]])
+    query += f" ORDER BY created_at {direction}, id {direction}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+def encode_message_cursor(row: Dict[str, Any]) -> str:
+    """Opaque keyset cursor: the (created_at, id) of the last message on the page."""
+    created_at = row["created_at"]
+    created_at = created_at.isoformat() if hasattr(created_at, "isoformat") else str(created_at)
+    return encode_cursor(created_at, row["id"])
+
+async def ensure_session_exists(conn: AsyncConnection, session_id: str) -> None:
+    if await conn.fetchone("SELECT 1 FROM chat_sessions WHERE id = %s", (session_id,)) is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+
+async def stream_session_messages(pool: DatabasePool, query: str, params: List[Any]) -> AsyncIterator[bytes]:
+    """
+    NDJSON body: one message per line, read from an unbuffered server-side cursor in batches.
+    The connection is taken when the first chunk is requested and held until the last one is sent.
+    """
+    try:
+        async with pool.acquire() as conn:
+            async with aclosing(conn.stream(query, params, batch_size=HISTORY_STREAM_BATCH_SIZE)) as batches:
+                async for rows in batches:
+                    yield b"".join(dumps(row) + b"\n" for row in convert_rows(rows, conn.description))
+    except (PoolTimeoutError, PoolClosedError) as e:
+        logger.error(f"Database pool unavailable while streaming chat history: {e}")
+        yield encode_stream_event({"type": "error", "detail": "数据库繁忙，请稍后重试"}, "ndjson")
+    except pymysql.MySQLError as e:
+        logger.error(f"Error streaming chat history: {e}")
+        yield encode_stream_event({"type": "error", "detail": "数据库查询错误"}, "ndjson")
+
+@app.get("/api/sessions/{session_id}/messages")
+async def get_session_messages(
+    session_id: str,
+    cursor: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description=f"Page size (json, default {HISTORY_PAGE_SIZE}); ndjson streams every message when omitted"),
+    order: str = Query("asc", pattern="^(asc|desc)$", description="asc: oldest first; desc: newest first"),
+    format: str = Query("json", pattern="^(json|ndjson)$", description="json: one page; ndjson: stream messages line by line"),
+    pool: DatabasePool = Depends(get_db_pool),
+):
+    """
+    获取会话的聊天记录，按 (created_at, id) 做游标分页：下一页的游标在 X-Next-Cursor 响应头中，最后一页没有该响应头。
+    format=ndjson 时从服务端游标分批读取并逐行输出，不在内存中构建整个列表，适合一次加载很长的会话。
+    仍在写入队列中 (尚未落库) 的最新消息不会出现在结果中。
+    """
+    after = decode_message_cursor(cursor) if cursor else None
+    try:
+        if format == "ndjson":
+            async with pool.acquire() as conn:
+                await ensure_session_exists(conn, session_id)
+            query, params = session_messages_query(session_id, after, order, limit)
+            return ClosingStreamingResponse(
+                stream_session_messages(pool, query, params),
+                media_type=STREAM_MEDIA_TYPES["ndjson"],
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        page_size = limit or HISTORY_PAGE_SIZE
+        query, params = session_messages_query(session_id, after, order, page_size + 1) # One extra row tells whether another page exists
+        async with pool.acquire() as conn:
+            await ensure_session_exists(conn, session_id)
+            rows = await conn.fetchall(query, tuple(params))
+            description = conn.description
+    except (PoolTimeoutError, PoolClosedError) as e:
+        logger.error(f"Database pool unavailable in get_session_messages endpoint: {e}")
+        raise HTTPException(status_code=503, detail="数据库繁忙，请稍后重试")
+    except pymysql.MySQLError as e:
+        logger.error(f"Error querying chat history: {e}")
+        raise HTTPException(status_code=500, detail=f"数据库查询错误: {str(e)}")
+
+    headers = {}
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers["X-Next-Cursor"] = encode_message_cursor(rows[-1])
+    return Response(content=dumps_rows(rows, description), media_type="application/json", headers=headers)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 抓取端点 (多 worker 时需设置 PROMETHEUS_MULTIPROC_DIR 以汇总所有 worker)"""
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+# --- Admin: on-demand profiling ---
+profile_lock = asyncio.Lock() # 同一 worker 同时只运行一次采样
+
+def require_admin(request: Request) -> None:
+    """管理端点鉴权: 未配置 ADMIN_TOKEN 时端点不存在 (404)，令牌不匹配返回 403。"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="无权访问管理端点")
+
+@app.get("/admin/profile", include_in_schema=False)
+async def admin_profile(
+    request: Request,
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS, description="Sampling duration"),
+    interval_ms: float = Query(5, ge=1, le=100, description="Milliseconds between samples"),
+    all_threads: bool = Query(False, description="Sample every thread instead of only the event loop"),
+):
+    """
+    对当前 worker 进程做采样分析，返回 collapsed stack 格式 (flamegraph.pl / speedscope 可直接读取)。
+    默认只采样事件循环线程: 能看到的是阻塞事件循环的 CPU 开销，挂起在 await 上的协程不会出现。
+    多 worker 部署时只分析接收到该请求的 worker (进程号见 X-Profile-Pid 响应头)。
+    """
+    require_admin(request)
+    if profile_lock.locked():
+        raise HTTPException(status_code=409, detail="已有采样分析正在进行")
+    async with profile_lock:
+        thread_ids = None if all_threads else {threading.get_ident()}
+        counts = await asyncio.get_running_loop().run_in_executor(
+            None, sample_stacks, seconds, interval_ms / 1000, thread_ids)
+    pid = os.getpid()
+    return Response(
+        content=collapsed(counts),
+        media_type="text/plain; charset=utf-8",
+        headers={
+            "Content-Disposition": f'attachment; filename="psychat-{pid}-{int(time.time())}.folded"',
+            "X-Profile-Pid": str(pid),
+            "X-Profile-Samples": str(sum(counts.values())),
+        },
+    )
+
+# --- Health probes ---
+async def probe_database() -> None:
+    async with app.state.db_pool.acquire() as conn:
+        await conn.fetchone("SELECT 1")
+
+async def probe_anythingllm() -> None:
+    """Up while at least one instance answers /ping (per-instance state is in /health's upstreams)."""
+    if not ANYTHINGLLM_BASE_URL:
+        raise RuntimeError("ANYTHINGLLM_API_BASE_URL is not configured")
+
+    async def ping(base_url: str) -> None:
+        response = await app.state.http_client.get(
+            f"{base_url}/ping", headers=anythingllm_headers(), timeout=HEALTH_PROBE_TIMEOUT)
+        response.raise_for_status()
+
+    results = await asyncio.gather(
+        *(ping(upstream.base_url) for upstream in anythingllm_upstreams.upstreams), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if len(errors) == len(results):
+        raise errors[0]
+
+# The database is required to serve anything; without AnythingLLM chat still answers (degraded replies)
+health_prober = HealthProber(
+    {"database": probe_database, "anythingllm": probe_anythingllm},
+    critical={"database"},
+    interval=HEALTH_PROBE_INTERVAL,
+    timeout=HEALTH_PROBE_TIMEOUT,
+)
+
+@app.get("/health/live")
+async def health_live():
+    """探活 (liveness)：进程和事件循环能响应即返回 200，不访问任何依赖。"""
+    age = health_prober.last_probe_age()
+    return {
+        "status": "alive",
+        "uptime_seconds": round(health_prober.uptime(), 3),
+        "last_probe_age_seconds": round(age, 3) if age is not None else None,
+    }
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    就绪 (readiness)：返回后台探测器最近一次的结果 (各依赖的状态、延迟和结果时长)，不访问任何依赖。
+    数据库不可用、尚未完成首次探测、探测结果过期或正在关闭时返回 503；仅 AnythingLLM 不可用时为 degraded (200)。
+    """
+    snapshot = health_prober.snapshot()
+    snapshot["upstream_circuit"] = chat_breaker.state
+    return JSONResponse(content=snapshot, status_code=200 if snapshot["ready"] else 503)
 
 @app.get("/health")
 async def health_check():
     """
-    健康检查端点，用于验证API和数据库连接状态
+    健康检查端点，用于验证API和数据库连接状态 (每次调用都实际查询数据库，并附带各组件统计；
+    供人工排查使用，编排系统和监控的探针请使用 /health/live 和 /health/ready)
     返回:
         dict: 包含API和数据库状态的字典
     """
@@ -293,24 +1757,37 @@ async def health_check():
         "version": "1.0.0"  # 可以从应用配置或版本文件中获取
     }
     
-    # 测试数据库连接
+    # 测试数据库连接 (通过连接池，不再为每次检查新建连接)
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cursor:
-            cursor.execute("SELECT 1")
-            result = cursor.fetchone()
-            if result and 1 in result.values():
-                health_status["database"] = "healthy"
-            else:
-                health_status["database"] = "unhealthy"
-                health_status["status"] = "degraded"
-        conn.close()
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            result = await conn.fetchone("SELECT 1")
+        if result and 1 in result.values():
+            health_status["database"] = "healthy"
+        else:
+            health_status["database"] = "unhealthy"
+            health_status["status"] = "degraded"
+        health_status["database_pool"] = pool.stats()
     except Exception as e:
         logger.error(f"Health check - Database connection error: {e}")
         health_status["database"] = "unhealthy"
         health_status["database_error"] = str(e)
         health_status["status"] = "degraded"
     
+    health_status["session_cache"] = session_thread_cache.stats()
+    health_status["resources_cache"] = resources_cache.stats()
+    health_status["chat_reply_cache"] = chat_reply_cache_stats()
+    health_status["metrics_rollup"] = rollup.stats()
+    health_status["upstream_limiter"] = chat_limiter.stats()
+    health_status["upstream_circuit"] = chat_breaker.stats()
+    health_status["upstreams"] = anythingllm_upstreams.stats()
+    health_status["spare_threads"] = [spares.stats() for spares in spare_threads.values()]
+    health_status["websocket"] = websocket_stats
+    if hasattr(app.state, 'message_writer'):
+        health_status["message_writer"] = app.state.message_writer.stats()
+    if hasattr(app.state, 'feedback_writer'):
+        health_status["feedback_writer"] = app.state.feedback_writer.stats()
+
     # 根据状态设置正确的HTTP响应码
     if health_status["status"] != "ok":
         return JSONResponse(
@@ -342,8 +1819,17 @@ async def custom_404_handler(request: Request, exc: StarletteHTTPException):
         "available_endpoints": [
             "/",
             "/health",
+            "/health/live",
+            "/health/ready",
+            "/metrics",
             "/api/chat",
+            "/api/chat/stream",
+            "/api/chat/batch",
+            "/ws/chat",
+            "/api/feedback",
+            "/api/sessions/{session_id}/messages",
             "/api/resources",
+            "/api/resources/search",
             "/docs",  # 添加Swagger文档路径
             "/redoc"  # 添加ReDoc文档路径
         ]
@@ -373,8 +1859,10 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 if __name__ == "__main__":
     import uvicorn
-    # For production, you might want to set reload=False and adjust workers
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True) # Changed host to 0.0.0.0 to be accessible externally if needed
+    # Development server: a single process (auto-reload unless UVICORN_RELOAD=false).
+    # Production uses several workers: gunicorn -c gunicorn.conf.py main:app (see gunicorn.conf.py)
+    reload = os.getenv("UVICORN_RELOAD", "true").lower() in ("1", "true", "yes")
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=reload) # Changed host to 0.0.0.0 to be accessible externally if needed
 
 
 
@@ -0,0 +1,161 @@
+"""
+Prometheus metrics for the backend.
+
+All metric objects live in this module so they are registered exactly once per
+process. Updates are in-process (one small lock per time series, no I/O), so
+recording a sample costs on the order of a microsecond.
+
+Multi-worker deployments: set ``PROMETHEUS_MULTIPROC_DIR`` to an empty,
+writable directory *before* the workers start. Each worker then writes its
+samples to memory-mapped files in that directory and ``/metrics`` (served by
+any worker) aggregates all of them.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+import httpx
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+from rollup import rollup
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Latency buckets (seconds) tuned to each stage
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+# --- HTTP ---
+HTTP_REQUESTS = Counter(
+    "psychat_http_requests_total", "HTTP requests handled", ["method", "route", "status"])
+HTTP_REQUEST_DURATION = Histogram(
+    "psychat_http_request_duration_seconds", "Time to fully send the HTTP response", ["method", "route"])
+HTTP_IN_FLIGHT = Gauge(
+    "psychat_http_requests_in_flight", "HTTP requests currently being served", multiprocess_mode="livesum")
+
+# --- Database ---
+DB_ACQUIRE_DURATION = Histogram(
+    "psychat_db_acquire_duration_seconds", "Time to check a connection out of the pool (including waiting)",
+    buckets=DB_BUCKETS)
+DB_QUERY_DURATION = Histogram(
+    "psychat_db_query_duration_seconds", "Time of one database round trip", buckets=DB_BUCKETS)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "psychat_db_connections_in_use", "Pool connections currently checked out", multiprocess_mode="livesum")
+
+# --- AnythingLLM ---
+UPSTREAM_DURATION = Histogram(
+    "psychat_upstream_request_duration_seconds",
+    "AnythingLLM call latency by call type (thread_new, chat, stream_chat: time until headers)",
+    ["call"], buckets=UPSTREAM_BUCKETS)
+UPSTREAM_ERRORS = Counter(
+    "psychat_upstream_errors_total", "Failed AnythingLLM calls by HTTP status (or 'network')", ["call", "status"])
+UPSTREAM_IN_FLIGHT = Gauge(
+    "psychat_upstream_requests_in_flight", "AnythingLLM calls currently in progress", ["call"],
+    multiprocess_mode="livesum")
+UPSTREAM_CONCURRENCY_LIMIT = Gauge(
+    "psychat_upstream_concurrency_limit", "Current adaptive limit on concurrent AnythingLLM chat calls",
+    multiprocess_mode="livesum")
+UPSTREAM_QUEUE_DEPTH = Gauge(
+    "psychat_upstream_queue_depth", "Chat calls waiting for an upstream slot", multiprocess_mode="livesum")
+UPSTREAM_REJECTED = Counter(
+    "psychat_upstream_rejected_total", "Chat calls rejected by the concurrency limiter", ["reason"])
+UPSTREAM_OUTSTANDING = Gauge(
+    "psychat_upstream_outstanding_requests", "Requests in progress per AnythingLLM instance (load-balancing input)",
+    ["upstream"], multiprocess_mode="livesum")
+UPSTREAM_EJECTIONS = Counter(
+    "psychat_upstream_ejections_total", "Times an AnythingLLM instance was ejected after consecutive failures",
+    ["upstream"])
+CIRCUIT_STATE = Gauge(
+    "psychat_upstream_circuit_state", "AnythingLLM circuit breaker state (0 closed, 1 half-open, 2 open)",
+    multiprocess_mode="livemax")
+CIRCUIT_TRANSITIONS = Counter(
+    "psychat_upstream_circuit_transitions_total", "Circuit breaker state changes by new state", ["state"])
+
+
+@contextmanager
+def track_upstream(call: str) -> Iterator[None]:
+    """Time one AnythingLLM call and count it as an error if it raises an httpx error."""
+    in_flight = UPSTREAM_IN_FLIGHT.labels(call)
+    in_flight.inc()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except httpx.HTTPStatusError as e:
+        failed = True
+        UPSTREAM_ERRORS.labels(call, str(e.response.status_code)).inc()
+        raise
+    except httpx.RequestError:
+        failed = True
+        UPSTREAM_ERRORS.labels(call, "network").inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        in_flight.dec()
+        UPSTREAM_DURATION.labels(call).observe(elapsed)
+        rollup.observe_upstream(call, elapsed, failed)
+
+
+class PrometheusMiddleware:
+    """
+    Pure ASGI middleware recording request count, latency and in-flight requests
+    (also fed to the system_metrics roll-up).
+
+    The ``route`` label is the matched path template (e.g. ``/api/resources``),
+    never the raw URL, so label cardinality stays bounded; requests that match
+    no route are labelled ``unmatched``.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+            HTTP_REQUEST_DURATION.labels(method, route).observe(elapsed)
+            rollup.observe_request(route, status_code, elapsed)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Exposition body and content type; aggregates all workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
+
+
+def mark_worker_exit() -> None:
+    """Drop this worker's live gauges from the shared directory (multiprocess mode only)."""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,232 @@
+"""
+Periodic roll-up of request and upstream metrics into the ``system_metrics`` table.
+
+Requests and AnythingLLM calls are aggregated in memory per route / call type.
+Once per ``interval`` the current window is swapped out and written as one
+multi-row INSERT (count, errors, p50/p95/p99 in ms, ...). Nothing touches the
+database on the request path.
+
+Maintenance runs every ``maintenance_interval``: rows older than
+``downsample_after`` are collapsed into one row per metric and hour, and rows
+older than ``retention`` are deleted. A MySQL named lock makes sure only one
+worker does this at a time.
+
+With several workers each one writes its own rows for the same minute;
+``*.count`` / ``*.errors`` rows add up, percentile rows are per worker.
+"""
+import asyncio
+import datetime
+import logging
+import math
+import random
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:  # db imports metrics, which imports this module
+    from db import DatabasePool
+
+logger = logging.getLogger(__name__)
+
+# Metrics whose hourly roll-up is the SUM of the minute rows; all others are averaged
+SUMMED_SUFFIXES = (".count", ".errors")
+METRIC_NAME_MAX_LENGTH = 50  # system_metrics.metric_name VARCHAR(50)
+MAINTENANCE_LOCK = "psychat_system_metrics_maintenance"
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted, non-empty list."""
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class _Window:
+    """Count, error count and a bounded uniform sample of latencies (reservoir sampling)."""
+
+    __slots__ = ("count", "errors", "samples", "max_samples")
+
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.errors = 0
+        self.samples: List[float] = []
+        self.max_samples = max_samples
+
+    def add(self, seconds: float, error: bool) -> None:
+        self.count += 1
+        if error:
+            self.errors += 1
+        if len(self.samples) < self.max_samples:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.max_samples:
+                self.samples[slot] = seconds
+
+    def rows(self, prefix: str, measured_at: datetime.datetime) -> List[Tuple[str, float, datetime.datetime]]:
+        latencies = sorted(self.samples)
+        values = [
+            ("count", self.count),
+            ("errors", self.errors),
+            ("error_rate", round(self.errors / self.count, 4)),
+            ("p50_ms", round(percentile(latencies, 50) * 1000, 2)),
+            ("p95_ms", round(percentile(latencies, 95) * 1000, 2)),
+            ("p99_ms", round(percentile(latencies, 99) * 1000, 2)),
+        ]
+        # Trim the prefix (route templates can be long) so the suffix always survives
+        room = METRIC_NAME_MAX_LENGTH - len(".error_rate")
+        return [(f"{prefix[:room]}.{name}", float(value), measured_at) for name, value in values]
+
+
+class MetricsRollup:
+    """
+    In-memory aggregator flushed to ``system_metrics`` by a background task.
+
+    ``observe_request`` / ``observe_upstream`` are synchronous and cheap; they
+    are called from the Prometheus middleware and ``track_upstream``.
+    """
+
+    def __init__(self, max_samples: int = 2000):
+        self.max_samples = max_samples
+        self._requests: Dict[str, _Window] = {}
+        self._upstream: Dict[str, _Window] = {}
+        self._pool: Optional["DatabasePool"] = None
+        self._task: Optional[asyncio.Task] = None
+        self.interval = 60.0
+        self.maintenance_interval = 3600.0
+        self.downsample_after = datetime.timedelta(hours=48)
+        self.retention = datetime.timedelta(days=30)
+        self.rows_written = 0
+        self.failed_flushes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "rows_written": self.rows_written,
+            "failed_flushes": self.failed_flushes,
+        }
+
+    # --- Recording (request path) ---
+
+    def observe_request(self, route: str, status_code: int, seconds: float) -> None:
+        window = self._requests.get(route)
+        if window is None:
+            window = self._requests[route] = _Window(self.max_samples)
+        window.add(seconds, status_code >= 500)
+
+    def observe_upstream(self, call: str, seconds: float, error: bool) -> None:
+        window = self._upstream.get(call)
+        if window is None:
+            window = self._upstream[call] = _Window(self.max_samples)
+        window.add(seconds, error)
+
+    def collect(self, measured_at: datetime.datetime) -> List[Tuple[str, float, datetime.datetime]]:
+        """Swap out the current window and return its system_metrics rows."""
+        requests, self._requests = self._requests, {}
+        upstream, self._upstream = self._upstream, {}
+        rows: List[Tuple[str, float, datetime.datetime]] = []
+        if requests:
+            total = _Window(self.max_samples * len(requests))
+            for route, window in requests.items():
+                rows.extend(window.rows(f"http.{route}", measured_at))
+                total.count += window.count
+                total.errors += window.errors
+                total.samples.extend(window.samples)
+            rows.extend(total.rows("http", measured_at))
+        for call, window in upstream.items():
+            rows.extend(window.rows(f"upstream.{call}", measured_at))
+        return rows
+
+    # --- Lifecycle ---
+
+    def start(
+        self,
+        pool: "DatabasePool",
+        *,
+        interval: float = 60.0,
+        maintenance_interval: float = 3600.0,
+        downsample_after_hours: float = 48,
+        retention_days: float = 30,
+    ) -> None:
+        self._pool = pool
+        self.interval = interval
+        self.maintenance_interval = maintenance_interval
+        self.downsample_after = datetime.timedelta(hours=downsample_after_hours)
+        self.retention = datetime.timedelta(days=retention_days)
+        self._task = asyncio.create_task(self._run(), name="system-metrics-rollup")
+
+    async def stop(self) -> None:
+        """Stop the background task and write out the last (partial) window."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self.flush()
+
+    # --- Database side ---
+
+    async def flush(self) -> int:
+        rows = self.collect(datetime.datetime.now().replace(microsecond=0))
+        if not rows or self._pool is None:
+            return 0
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.executemany(
+                    "INSERT INTO system_metrics (metric_name, metric_value, measured_at) VALUES (%s, %s, %s)",
+                    rows)
+        except Exception as e:
+            # Metrics are best effort: drop this window rather than let a backlog build up
+            self.failed_flushes += 1
+            logger.warning(f"Failed to write {len(rows)} system_metrics rows: {e}")
+            return 0
+        self.rows_written += len(rows)
+        return len(rows)
+
+    async def maintain(self, now: Optional[datetime.datetime] = None) -> None:
+        """Downsample old minute rows to hourly rows and delete rows past retention."""
+        now = now or datetime.datetime.now()
+        async with self._pool.acquire() as conn:
+            locked = await conn.fetchone("SELECT GET_LOCK(%s, 0) AS locked", (MAINTENANCE_LOCK,))
+            if not locked or not locked.get("locked"):
+                return  # Another worker is doing it
+            try:
+                deleted = await conn.execute(
+                    "DELETE FROM system_metrics WHERE measured_at < %s", (now - self.retention,))
+                groups = await conn.fetchall(
+                    "SELECT metric_name, DATE_FORMAT(measured_at, '%%Y-%%m-%%d %%H:00:00') AS bucket, "
+                    "COUNT(*) AS n, SUM(metric_value) AS total, AVG(metric_value) AS average, MAX(id) AS max_id "
+                    "FROM system_metrics WHERE measured_at < %s "
+                    "GROUP BY metric_name, bucket HAVING n > 1",
+                    (now - self.downsample_after,))
+                if groups:
+                    async with conn.transaction():
+                        await conn.executemany(
+                            "INSERT INTO system_metrics (metric_name, metric_value, measured_at) VALUES (%s, %s, %s)",
+                            [(g["metric_name"],
+                              float(g["total"] if g["metric_name"].endswith(SUMMED_SUFFIXES) else g["average"]),
+                              g["bucket"]) for g in groups])
+                        await conn.executemany(
+                            "DELETE FROM system_metrics WHERE metric_name = %s AND measured_at >= %s "
+                            "AND measured_at < %s + INTERVAL 1 HOUR AND id <= %s",
+                            [(g["metric_name"], g["bucket"], g["bucket"], g["max_id"]) for g in groups])
+                logger.info(f"system_metrics maintenance: pruned {deleted} rows, downsampled {len(groups)} hourly groups")
+            finally:
+                await conn.fetchone("SELECT RELEASE_LOCK(%s)", (MAINTENANCE_LOCK,))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_maintenance = loop.time() + self.maintenance_interval
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+            if loop.time() >= next_maintenance:
+                next_maintenance = loop.time() + self.maintenance_interval
+                try:
+                    await self.maintain()
+                except Exception as e:
+                    logger.warning(f"system_metrics maintenance failed: {e}")
+
+
+# Process-wide aggregator fed by metrics.PrometheusMiddleware and metrics.track_upstream
+rollup = MetricsRollup()
@@ -0,0 +1,93 @@
+"""
+Fast JSON serialization for database rows.
+
+orjson encodes dicts, str, int, float, None and datetime/date natively (in C),
+so rows from the DictCursor can usually be dumped as they are. Only columns
+whose values orjson cannot encode, or would encode differently from the API's
+contract, need Python work, and which columns those are is known from
+``cursor.description`` before the first row is looked at:
+
+* DECIMAL -> float (as before, so clients keep getting JSON numbers)
+* TIME (``datetime.timedelta``) -> "HH:MM:SS"
+* BIT -> int
+
+Converters are built once per result and applied only to those columns. Any
+other value orjson does not know (e.g. ``bytes`` from a binary column) goes
+through ``_default``, which is only called for such values.
+"""
+import datetime
+import decimal
+import logging
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import orjson
+from pymysql.constants import FIELD_TYPE
+
+logger = logging.getLogger(__name__)
+
+Converter = Callable[[Any], Any]
+
+
+def _time_to_str(value: Any) -> Any:
+    if isinstance(value, datetime.timedelta):
+        seconds = int(value.total_seconds())
+        sign = "-" if seconds < 0 else ""
+        hours, rest = divmod(abs(seconds), 3600)
+        return f"{sign}{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+    return value
+
+
+def _bit_to_int(value: Any) -> Any:
+    return int.from_bytes(value, "big") if isinstance(value, bytes) else value
+
+
+_CONVERTERS: Dict[int, Converter] = {
+    FIELD_TYPE.DECIMAL: float,
+    FIELD_TYPE.NEWDECIMAL: float,
+    FIELD_TYPE.TIME: _time_to_str,
+    FIELD_TYPE.BIT: _bit_to_int,
+}
+
+
+def column_converters(description: Optional[Sequence[Sequence[Any]]]) -> List[Tuple[str, Converter]]:
+    """(column name, converter) for the columns of a result that need converting; [] if none or unknown."""
+    if not description:
+        return []
+    return [(column[0], _CONVERTERS[column[1]]) for column in description if column[1] in _CONVERTERS]
+
+
+def _default(value: Any) -> Any:
+    """Fallback for values orjson cannot encode (called per value, only for those values)."""
+    if isinstance(value, bytes):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            logger.warning("Could not decode bytes to utf-8 while serializing a row. Storing as repr.")
+            return repr(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.timedelta):
+        return _time_to_str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON (same output shape as json.dumps(ensure_ascii=False, separators=(",", ":")))."""
+    return orjson.dumps(obj, default=_default)
+
+
+def convert_rows(rows: List[Dict[str, Any]], description: Optional[Sequence[Sequence[Any]]]) -> List[Dict[str, Any]]:
+    """Apply the per-column converters in place and return ``rows``."""
+    converters = column_converters(description)
+    if converters:
+        for row in rows:
+            for name, convert in converters:
+                value = row.get(name)
+                if value is not None:
+                    row[name] = convert(value)
+    return rows
+
+
+def dumps_rows(rows: List[Dict[str, Any]], description: Optional[Sequence[Sequence[Any]]] = None) -> bytes:
+    """Serialize a list of DictCursor rows to a JSON array."""
+    return dumps(convert_rows(rows, description))
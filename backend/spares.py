@@ -0,0 +1,267 @@
+"""
+Pre-created AnythingLLM threads for new sessions.
+
+A session's first message would otherwise wait for ``POST .../thread/new``
+before the chat call itself. Each worker keeps a small in-memory stock of
+threads created in the background; ``claim()`` hands one out without any I/O
+and falls back to ``None`` (create on demand) when the stock is empty.
+
+* Refill: when a claim leaves fewer than ``low_watermark`` spares, a
+  background task creates threads one at a time until ``high_watermark`` is
+  reached. Refilling pauses while ``paused()`` is true (e.g. the upstream
+  circuit is open) and backs off after a failure.
+* Persistence: every spare is also stored in ``anythingllm_spare_threads``
+  (migration 1.6.0), leased to the worker that holds it. Leases are renewed
+  while the worker runs (on their own schedule, even while refills fail) and
+  released on shutdown; on startup a worker adopts unleased spares (from a
+  previous run or a crashed worker) before creating new ones, so restarts do
+  not leak threads. A spare whose lease may have lapsed is never handed out:
+  ``claim()`` drops stored spares once the last successful renewal is
+  ``lease_seconds`` old, and each renewal drops spares whose row another
+  worker has taken over. The caller deletes the row with ``forget()`` once
+  the claimed thread is bound to a session.
+* Instances: a thread exists only on the AnythingLLM instance that created it,
+  so with several instances there is one pool per instance (``upstream``, its
+  base URL, stored with each row; migration 1.7.0). Rows stored before that
+  (NULL) are adopted by the pool with ``adopt_unpinned`` (the primary instance).
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+if TYPE_CHECKING:
+    from db import AsyncConnection, DatabasePool
+
+logger = logging.getLogger(__name__)
+
+
+class SpareThreadPool:
+    def __init__(
+        self,
+        low_watermark: int = 2,
+        high_watermark: int = 5,
+        *,
+        lease_seconds: int = 600,
+        retry_delay: float = 5.0,
+        upstream: Optional[str] = None,
+        adopt_unpinned: bool = True,
+    ):
+        self.low_watermark = low_watermark
+        self.high_watermark = max(high_watermark, low_watermark)
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.upstream = upstream
+        self.adopt_unpinned = adopt_unpinned
+        self.owner = ""
+        self._spares: Deque[str] = deque()
+        self._unstored: Set[str] = set()  # Spares whose row could not be stored: no lease, nobody else knows them
+        self._lease_deadline = float("inf")  # time.monotonic() by which the held leases lapse unless renewed (set by start())
+        self._wakeup = asyncio.Event()
+        self._pool: Optional["DatabasePool"] = None
+        self._create: Optional[Callable[[], Awaitable[str]]] = None
+        self._paused: Callable[[], bool] = lambda: False
+        self._workspace = ""
+        self._task: Optional[asyncio.Task] = None
+        self.claims = 0
+        self.misses = 0
+        self.created = 0
+        self.adopted = 0
+        self.failures = 0
+        self.lost = 0
+
+    def __len__(self) -> int:
+        return len(self._spares)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "upstream": self.upstream,
+            "running": self._task is not None,
+            "spares": len(self._spares),
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "claims": self.claims,
+            "misses": self.misses,
+            "created": self.created,
+            "adopted": self.adopted,
+            "failures": self.failures,
+            "lost": self.lost,
+        }
+
+    # --- Request path (no I/O) ---
+
+    def claim(self) -> Optional[str]:
+        """Take a spare thread slug, or None if there is none (create one on demand)."""
+        if self._spares and time.monotonic() >= self._lease_deadline:
+            # Renewals have been failing for a whole lease: another worker may have adopted the stored spares
+            self._drop(slug for slug in self._spares if slug not in self._unstored)
+        if not self._spares:
+            if self._task is not None:
+                self.misses += 1
+                self._wakeup.set()
+            return None
+        slug = self._spares.popleft()
+        self.claims += 1
+        if len(self._spares) < self.low_watermark:
+            self._wakeup.set()
+        return slug
+
+    def give_back(self, slug: str) -> None:
+        """Return a claimed thread that ended up unused (its row was not forgotten)."""
+        self._spares.appendleft(slug)
+        self.claims -= 1
+
+    async def forget(self, conn: "AsyncConnection", slug: str) -> None:
+        """Delete the stored row of a claimed thread; call on the connection that binds it to a session."""
+        await conn.execute("DELETE FROM anythingllm_spare_threads WHERE thread_slug = %s", (slug,))
+        self._unstored.discard(slug)
+
+    def _drop(self, slugs) -> None:
+        lost = set(slugs)
+        if not lost:
+            return
+        self._spares = deque(slug for slug in self._spares if slug not in lost)
+        self.lost += len(lost)
+        logger.warning(f"Dropped {len(lost)} spare threads whose lease this worker no longer holds")
+
+    # --- Lifecycle ---
+
+    def start(
+        self,
+        pool: "DatabasePool",
+        create: Callable[[], Awaitable[str]],
+        workspace: str,
+        *,
+        paused: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        # Set here, not at import: with gunicorn's preload every worker is forked from the same import
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"[:100]
+        self._pool = pool
+        self._create = create
+        self._workspace = workspace
+        if paused is not None:
+            self._paused = paused
+        self._wakeup = asyncio.Event()
+        self._lease_deadline = time.monotonic() + self.lease_seconds  # Rows leased from now on last at least this long
+        self._task = asyncio.create_task(self._run(), name="spare-thread-refill")
+
+    async def stop(self) -> None:
+        """Stop refilling and release the leases so the next worker to start adopts the spares."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            async with self._pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE anythingllm_spare_threads SET owner = NULL, leased_until = NOW() WHERE owner = %s",
+                    (self.owner,))
+        except Exception as e:
+            logger.warning(f"Failed to release {len(self._spares)} spare threads: {e}")
+        self._spares.clear()
+        self._unstored.clear()
+
+    # --- Background side ---
+
+    async def adopt(self) -> List[str]:
+        """Lease stored spares nobody holds (up to the high watermark) and add them to the stock."""
+        wanted = self.high_watermark - len(self._spares)
+        if wanted <= 0:
+            return []
+        if self.upstream is None:
+            instance, instance_params = "upstream IS NULL", ()
+        elif self.adopt_unpinned:
+            instance, instance_params = "(upstream = %s OR upstream IS NULL)", (self.upstream,)
+        else:
+            instance, instance_params = "upstream = %s", (self.upstream,)
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE anythingllm_spare_threads SET owner = %s, leased_until = NOW() + INTERVAL %s SECOND "
+                f"WHERE workspace_slug = %s AND {instance} AND leased_until <= NOW() ORDER BY created_at LIMIT %s",
+                (self.owner, self.lease_seconds, self._workspace, *instance_params, wanted))
+            rows = await conn.fetchall(
+                "SELECT thread_slug FROM anythingllm_spare_threads WHERE owner = %s ORDER BY created_at",
+                (self.owner,))
+        held = set(self._spares)
+        adopted = [row["thread_slug"] for row in rows if row["thread_slug"] not in held]
+        self._spares.extend(adopted)
+        self.adopted += len(adopted)
+        return adopted
+
+    async def refill(self) -> int:
+        """Create threads until the high watermark is reached; returns how many were created."""
+        created = 0
+        while len(self._spares) < self.high_watermark and not self._paused():
+            slug = await self._create()
+            try:
+                async with self._pool.acquire() as conn:
+                    await conn.execute(
+                        "INSERT INTO anythingllm_spare_threads (thread_slug, workspace_slug, upstream, owner, leased_until) "
+                        "VALUES (%s, %s, %s, %s, NOW() + INTERVAL %s SECOND)",
+                        (slug, self._workspace, self.upstream, self.owner, self.lease_seconds))
+            except Exception as e:
+                # Still usable; it just would not survive a restart
+                logger.warning(f"Failed to store spare thread {slug}: {e}")
+                self._unstored.add(slug)
+            self._spares.append(slug)
+            self.created += 1
+            created += 1
+        return created
+
+    async def renew_leases(self) -> None:
+        """Extend the held leases, then drop spares whose row this worker no longer owns."""
+        started = time.monotonic()
+        async with self._pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE anythingllm_spare_threads SET leased_until = NOW() + INTERVAL %s SECOND WHERE owner = %s",
+                (self.lease_seconds, self.owner))
+            rows = await conn.fetchall(
+                "SELECT thread_slug FROM anythingllm_spare_threads WHERE owner = %s", (self.owner,))
+        self._lease_deadline = started + self.lease_seconds
+        owned = {row["thread_slug"] for row in rows}
+        self._drop(slug for slug in self._spares if slug not in owned and slug not in self._unstored)
+
+    async def _run(self) -> None:
+        try:
+            adopted = await self.adopt()
+            if adopted:
+                logger.info(f"Adopted {len(adopted)} stored spare threads")
+        except Exception as e:
+            logger.warning(f"Failed to adopt stored spare threads: {e}")
+        loop = asyncio.get_running_loop()
+        renew_every = self.lease_seconds / 3
+        next_renewal = loop.time() + renew_every
+        while True:
+            self._wakeup.clear()  # Before refilling, so a claim made meanwhile is not missed
+            # Renewal runs on its own schedule: a refill that keeps failing must not let the leases lapse
+            if loop.time() >= next_renewal:
+                try:
+                    await self.renew_leases()
+                    next_renewal = loop.time() + renew_every
+                except Exception as e:
+                    self.failures += 1
+                    logger.warning(f"Spare thread lease renewal failed: {e}")
+                    next_renewal = loop.time() + self.retry_delay
+            try:
+                await self.refill()
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"Spare thread refill failed: {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+            # Woken by a claim below the low watermark, or periodically to renew leases / retry while paused.
+            # (asyncio.wait rather than wait_for: on 3.11 wait_for can swallow a cancel that races the wakeup)
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            timeout = min(renew_every, self.retry_delay * 6, max(next_renewal - loop.time(), 0))
+            try:
+                await asyncio.wait((waiter,), timeout=timeout)
+            finally:
+                waiter.cancel()
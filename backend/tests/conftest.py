@@ -0,0 +1,123 @@
+# 测试共享的夹具 (fixtures)
+# 提供一个内存中的假数据库连接池，替代真实的 MySQL 连接池
+import json
+import os
+import sys
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, chat_reply_cache, get_http_client, session_thread_cache
+
+
+class FakeDbConnection:
+    """模拟 db.AsyncConnection，所有查询方法都是 AsyncMock"""
+
+    def __init__(self):
+        self.fetchone = AsyncMock(return_value=None)
+        self.fetchall = AsyncMock(return_value=[])
+        self.execute = AsyncMock(return_value=1)
+        self.executemany = AsyncMock(return_value=0)
+        self.commit = AsyncMock()
+        self.rollback = AsyncMock()
+        self.broken = False
+        self.description = None  # 列元数据未知时序列化器只依赖 orjson 的 default 回退
+        self.stream_rows = []  # stream() 返回的行
+        self.streamed = []  # 每次 stream() 调用的 (sql, params)
+
+    async def stream(self, sql, params=None, *, batch_size=500):
+        self.streamed.append((sql, params))
+        for start in range(0, len(self.stream_rows), batch_size):
+            yield self.stream_rows[start:start + batch_size]
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield self
+        await self.commit()
+
+
+class FakeDbPool:
+    """模拟 db.DatabasePool；设置 acquire_error 可模拟获取连接失败"""
+
+    def __init__(self):
+        self.conn = FakeDbConnection()
+        self.acquire_error = None
+        self.checkouts = 0
+        self.releases = 0
+
+    async def checkout(self):
+        if self.acquire_error:
+            raise self.acquire_error
+        self.checkouts += 1
+        return self.conn
+
+    async def release(self, conn):
+        self.releases += 1
+
+    @asynccontextmanager
+    async def acquire(self):
+        conn = await self.checkout()
+        try:
+            yield conn
+        finally:
+            await self.release(conn)
+
+    def stats(self):
+        return {"size": 1, "idle": 1, "in_use": 0, "waiting": 0, "maxsize": 1}
+
+
+@pytest.fixture
+def fake_db_pool():
+    return FakeDbPool()
+
+
+def sse_body(*chunks):
+    """构造 AnythingLLM stream-chat 风格的 SSE 响应体"""
+    return "".join(f"data: {json.dumps(c, ensure_ascii=False)}\n\n" for c in chunks).encode("utf-8")
+
+
+@pytest.fixture
+def upstream_requests(fake_db_pool):
+    """用 MockTransport 模拟 AnythingLLM，并记录收到的请求"""
+    seen = []
+
+    def handler(request: httpx.Request):
+        seen.append(request)
+        if request.url.path.endswith("/thread/new"):
+            return httpx.Response(200, json={"thread": {"slug": "t-1"}, "threadSlug": "t-1"})
+        return httpx.Response(200, content=sse_body(
+            {"type": "textResponseChunk", "textResponse": "你好", "close": False, "error": None},
+            {"type": "textResponseChunk", "textResponse": "，朋友", "close": False, "error": None},
+            {"type": "finalizeResponseStream", "textResponse": "", "close": True, "error": None},
+        ), headers={"Content-Type": "text/event-stream"})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    session_thread_cache.clear()
+    yield seen
+    app.dependency_overrides.pop(get_http_client, None)
+    del app.state.db_pool
+
+
+@pytest.fixture
+def workspace_chat_calls(fake_db_pool):
+    """模拟工作区 chat 接口 (JSON 回复)，记录上游调用"""
+    calls = []
+
+    def handler(request: httpx.Request):
+        calls.append(json.loads(request.content))
+        return httpx.Response(200, json={"textResponse": f"回复{len(calls)}"})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    chat_reply_cache.clear()
+    yield calls
+    app.dependency_overrides.pop(get_http_client, None)
+    del app.state.db_pool
+    chat_reply_cache.clear()
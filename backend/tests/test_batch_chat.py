@@ -0,0 +1,132 @@
+# 批量聊天 /api/chat/batch 的测试
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import app, chat_reply_cache, get_http_client, session_thread_cache
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def batch_upstream(fake_db_pool):
+    """工作区/线程 chat 接口；消息为 "坏" 时返回 500"""
+    calls = []
+
+    def handler(request: httpx.Request):
+        body = json.loads(request.content)
+        calls.append((request.url.path, body.get("message")))
+        if body.get("message") == "坏":
+            return httpx.Response(500, json={"error": {"message": "boom"}})
+        return httpx.Response(200, json={"textResponse": f"答:{body['message']}"})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    session_thread_cache.clear()
+    chat_reply_cache.clear()
+    yield calls
+    app.dependency_overrides.pop(get_http_client, None)
+    del app.state.db_pool
+
+
+def test_chat_batch_returns_per_item_results(batch_upstream, fake_db_pool):
+    fake_db_pool.conn.fetchall.return_value = [
+        {"id": "s-a", "anythingllm_thread_id": "t-a"},
+        {"id": "s-b", "anythingllm_thread_id": "t-b"},
+    ]
+    items = [
+        {"message": "一", "session_id": "s-a"},
+        {"message": "坏"},
+        {"message": "二", "session_id": "s-b"},
+        {"message": "三", "session_id": "s-a"},
+    ]
+
+    response = client.post("/api/chat/batch", json={"items": items}, headers={"X-Cache-Bypass": "1"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["succeeded"], body["failed"]) == (3, 1)
+    results = body["results"]
+    assert [r["index"] for r in results] == [0, 1, 2, 3]
+    assert results[0]["reply"] == "答:一"
+    assert results[1]["error"]["status_code"] == 500
+    # 所有会话的线程通过一次 IN 查询解析
+    fake_db_pool.conn.fetchall.assert_awaited_once()
+    sql, params = fake_db_pool.conn.fetchall.call_args.args
+    assert "WHERE id IN (%s, %s)" in sql and sorted(params) == ["s-a", "s-b"]
+    fake_db_pool.conn.fetchone.assert_not_awaited()
+    # 同一会话内的消息按请求顺序发送到同一线程
+    thread_a = [message for path, message in batch_upstream if "/thread/t-a/" in path]
+    assert thread_a == ["一", "三"]
+
+
+def test_chat_batch_streams_ndjson_as_items_complete(batch_upstream):
+    response = client.post("/api/chat/batch?format=ndjson", json={"items": [{"message": "甲"}, {"message": "乙"}]})
+
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    assert sorted(line["index"] for line in lines) == [0, 1]
+    assert {line["reply"] for line in lines} == {"答:甲", "答:乙"}
+
+
+def test_chat_batch_ndjson_stops_upstream_calls_when_client_disconnects(fake_db_pool, monkeypatch):
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(json.loads(request.content)["message"])
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json={"textResponse": "答"})
+
+    monkeypatch.setattr(main, "CHAT_BATCH_CONCURRENCY", 1)
+    app.dependency_overrides[get_http_client] = lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.state.db_pool = fake_db_pool
+    chat_reply_cache.clear()
+
+    body = json.dumps({"items": [{"message": str(i)} for i in range(6)]}).encode()
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/chat/batch", "raw_path": b"/api/chat/batch",
+        "query_string": b"format=ndjson", "headers": [(b"content-type", b"application/json")],
+        "scheme": "http", "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+        "http_version": "1.1", "asgi": {"version": "3.0"},
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            raise OSError("client disconnected")  # 第一行结果送出时客户端已断开
+        sent.append(message)
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await app(scope, receive, send)
+        await asyncio.sleep(0.2)  # 若批量仍在后台运行，其余条目会在此期间发往上游
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        del app.state.db_pool
+
+    assert sent[0]["status"] == 200
+    # 断开时至多有下一条已在进行中，其余条目从未发往上游
+    assert len(calls) <= 2
+
+
+def test_chat_batch_validates_size(batch_upstream):
+    assert client.post("/api/chat/batch", json={"items": []}).status_code == 422
@@ -0,0 +1,93 @@
+# 上游熔断器 (breaker.CircuitBreaker) 的单元测试
+import os
+import sys
+
+import httpx
+import pytest
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+REQUEST = httpx.Request("POST", "http://llm/chat")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fail(breaker):
+    with pytest.raises(httpx.ConnectTimeout):
+        with breaker.guard():
+            raise httpx.ConnectTimeout("timed out", request=REQUEST)
+
+
+def succeed(breaker):
+    with breaker.guard():
+        pass
+
+
+def make_breaker(clock):
+    return CircuitBreaker("test", failure_threshold=0.5, min_calls=4, window=10, open_duration=30, clock=clock)
+
+
+def test_opens_when_failure_rate_reaches_threshold():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    succeed(breaker)
+    succeed(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED  # 调用次数不足 min_calls
+    fail(breaker)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError) as excinfo:
+        succeed(breaker)
+    assert excinfo.value.retry_after == 30
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_client_errors_do_not_count_as_failures():
+    breaker = make_breaker(FakeClock())
+    for _ in range(6):
+        with pytest.raises(httpx.HTTPStatusError):
+            with breaker.guard():
+                raise httpx.HTTPStatusError("bad request", request=REQUEST, response=httpx.Response(400))
+    assert breaker.state == CLOSED
+
+
+def test_old_outcomes_leave_the_window():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    fail(breaker)
+    fail(breaker)
+    clock.now = 11
+    succeed(breaker)
+    succeed(breaker)
+    fail(breaker)
+    assert breaker.state == CLOSED  # 窗口内只剩 3 次调用
+
+
+def test_half_open_probe_closes_or_reopens():
+    clock = FakeClock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        fail(breaker)
+    assert breaker.state == OPEN
+
+    clock.now = 31
+    fail(breaker)  # 探测失败，重新熔断
+    assert breaker.state == OPEN
+
+    clock.now = 62
+    with breaker.guard():
+        assert breaker.state == HALF_OPEN
+        # 探测期间其他请求仍被拒绝
+        with pytest.raises(CircuitOpenError):
+            breaker.allow()
+    assert breaker.state == CLOSED
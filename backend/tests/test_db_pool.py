@@ -0,0 +1,169 @@
+# 数据库连接池 (db.DatabasePool) 的单元测试
+# 使用假的 PyMySQL 连接，不需要真实的 MySQL 服务
+import asyncio
+import os
+import sys
+import time
+import pytest
+from unittest.mock import MagicMock
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import DatabasePool, PoolTimeoutError
+
+
+def make_pool(monkeypatch, **kwargs):
+    """创建一个使用假连接的连接池，返回 (pool, 已创建的原始连接列表)"""
+    created = []
+
+    def fake_connect(self):
+        raw = MagicMock()
+        created.append(raw)
+        return raw
+
+    monkeypatch.setattr(DatabasePool, "_connect", fake_connect)
+    return DatabasePool(**kwargs), created
+
+
+def test_pool_reuses_connections(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=1, maxsize=2)
+
+    async def scenario():
+        await pool.open()
+        for _ in range(5):
+            async with pool.acquire():
+                pass
+        stats = pool.stats()
+        await pool.close()
+        return stats
+
+    stats = asyncio.run(scenario())
+    # 顺序请求只会复用预热的那一个连接
+    assert len(created) == 1
+    assert stats["size"] == 1 and stats["idle"] == 1
+    created[0].close.assert_called_once()
+
+
+def test_pool_acquire_timeout(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=0, maxsize=1, acquire_timeout=0.05)
+
+    async def scenario():
+        await pool.open()
+        held = await pool.checkout()
+        with pytest.raises(PoolTimeoutError):
+            await pool.checkout()
+        # 归还后等待者可以拿到同一个连接
+        await pool.release(held)
+        async with pool.acquire() as conn:
+            assert conn is held
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert len(created) == 1
+
+
+def test_pool_discards_broken_and_recycled(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=0, maxsize=2, recycle=3600)
+
+    async def scenario():
+        await pool.open()
+        async with pool.acquire() as conn:
+            conn.broken = True  # 例如执行中遇到 OperationalError
+        assert pool.stats()["size"] == 0
+
+        async with pool.acquire() as conn:
+            conn.created_at -= 7200  # 超过 recycle 时间
+        assert pool.stats()["size"] == 0
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert len(created) == 2
+    assert all(raw.close.called for raw in created)
+
+
+def test_pool_pre_ping_replaces_dead_connection(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=1, maxsize=1, ping_interval=0)
+
+    async def scenario():
+        await pool.open()
+        created[0].ping.side_effect = Exception("MySQL server has gone away")
+        async with pool.acquire() as conn:
+            assert conn.raw is created[1]
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert len(created) == 2
+
+
+def test_cancelled_pre_ping_frees_the_slot(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=1, maxsize=1, ping_interval=0, acquire_timeout=0.1)
+
+    async def scenario():
+        await pool.open()
+        created[0].ping.side_effect = lambda reconnect: time.sleep(0.1)  # 很慢的 ping
+        checkout = asyncio.ensure_future(pool.checkout())
+        await asyncio.sleep(0.02)
+        checkout.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await checkout
+        # 被取消的连接被丢弃，名额归还，之后仍能取得新连接
+        assert pool.stats()["size"] == 0
+        async with pool.acquire() as conn:
+            assert conn.raw is created[1]
+        await pool.close()
+
+    asyncio.run(scenario())
+    created[0].close.assert_called_once()
+
+
+def test_cancelled_connect_closes_the_connection(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=0, maxsize=1)
+    slow_connect = DatabasePool._connect
+
+    def connect(self):
+        time.sleep(0.1)
+        return slow_connect(self)
+
+    monkeypatch.setattr(DatabasePool, "_connect", connect)
+
+    async def scenario():
+        await pool.open()
+        checkout = asyncio.ensure_future(pool.checkout())
+        await asyncio.sleep(0.02)
+        checkout.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await checkout
+        assert pool.stats()["size"] == 0
+        await asyncio.sleep(0.15)  # 工作线程完成连接后自行关闭
+        await pool.close()
+
+    asyncio.run(scenario())
+    assert len(created) == 1
+    created[0].close.assert_called_once()
+
+
+def test_stream_reads_in_batches_and_drops_abandoned_connection(monkeypatch):
+    pool, created = make_pool(monkeypatch, minsize=0, maxsize=1)
+    rows = [{"id": i} for i in range(5)]
+
+    async def scenario():
+        await pool.open()
+        async with pool.acquire() as conn:
+            cursor = conn.raw.cursor.return_value
+            cursor.fetchmany.side_effect = lambda size: [rows.pop(0) for _ in range(min(size, len(rows)))]
+            batches = [batch async for batch in conn.stream("SELECT id FROM t", None, batch_size=2)]
+            assert [len(batch) for batch in batches] == [2, 2, 1]
+            assert not conn.broken  # 读完的连接可以继续使用
+
+            rows.extend({"id": i} for i in range(5))
+            stream = conn.stream("SELECT id FROM t", None, batch_size=2)
+            await stream.__anext__()
+            await stream.aclose()
+            assert conn.broken  # 未读完的结果还在连接上，不能归还复用
+        await pool.close()
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["size"] == 0
+    created[0].close.assert_called_once()
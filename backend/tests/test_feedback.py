@@ -0,0 +1,74 @@
+# /api/feedback 端点测试
+import asyncio
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.main import app, write_feedback
+
+client = TestClient(app)
+
+
+@pytest.fixture
+def feedback_writer():
+    writer = MagicMock()
+    writer.put = AsyncMock(return_value=True)
+    app.state.feedback_writer = writer
+    yield writer
+    del app.state.feedback_writer
+
+
+def feedback(message_id, rating=1):
+    return {"message_id": message_id, "user_query": "最近睡不好", "bot_response": "试试规律作息", "rating": rating}
+
+
+def test_single_feedback_is_queued(feedback_writer):
+    response = client.post("/api/feedback", json=feedback("m-1", rating=-1))
+
+    assert response.status_code == 202
+    assert response.json() == {"accepted": 1, "dropped": 0}
+    row = feedback_writer.put.await_args.args[0]
+    assert row[:5] == ("m-1", "最近睡不好", "试试规律作息", -1, None)
+
+
+def test_batch_feedback_is_queued(feedback_writer):
+    response = client.post("/api/feedback", json={"items": [feedback("m-1"), feedback("m-2", rating=5)]})
+
+    assert response.status_code == 202
+    assert response.json()["accepted"] == 2
+    assert [c.args[0][0] for c in feedback_writer.put.await_args_list] == ["m-1", "m-2"]
+
+
+def test_feedback_returns_503_when_queue_is_full(feedback_writer):
+    feedback_writer.put.return_value = False
+
+    response = client.post("/api/feedback", json=feedback("m-1"))
+
+    assert response.status_code == 503
+    assert "Retry-After" in response.headers
+
+
+def test_feedback_rejects_invalid_rating(feedback_writer):
+    response = client.post("/api/feedback", json=feedback("m-1", rating=9))
+
+    assert response.status_code == 422
+    feedback_writer.put.assert_not_awaited()
+
+
+def test_write_feedback_uses_one_executemany(fake_db_pool):
+    app.state.db_pool = fake_db_pool
+    rows = [("m-1", "q", "a", 1, None, None), ("m-2", "q", "a", -1, "太笼统", None)]
+    try:
+        asyncio.run(write_feedback(rows))
+    finally:
+        del app.state.db_pool
+
+    fake_db_pool.conn.executemany.assert_awaited_once()
+    sql, params = fake_db_pool.conn.executemany.call_args.args
+    assert sql.startswith("INSERT INTO feedback")
+    assert params == rows
@@ -2,7 +2,6 @@ import pytest
 from fastapi.testclient import TestClient
 import sys
 import os
-from unittest.mock import patch, MagicMock
 
 # 添加父目录到Python路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -13,15 +12,17 @@ from main import app
 # 创建测试客户端
 client = TestClient(app)
 
+# 将假连接池挂到 app.state 上 (TestClient 未进入上下文时不会触发 startup 事件)
+@pytest.fixture
+def db_pool(fake_db_pool):
+    app.state.db_pool = fake_db_pool
+    yield fake_db_pool
+    del app.state.db_pool
+
 # 测试健康检查端点 - 正常情况
-@patch("main.get_db_connection")
-def test_health_check_success(mock_get_db):
-    # 设置模拟数据库连接
-    mock_cursor = MagicMock()
-    mock_cursor.fetchone.return_value = {"column1": 1}  # 假设查询结果包含1
-    mock_conn = MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-    mock_get_db.return_value = mock_conn
+def test_health_check_success(db_pool):
+    # 设置模拟查询结果
+    db_pool.conn.fetchone.return_value = {"column1": 1}  # 假设查询结果包含1
     
     # 发送请求到健康检查端点
     response = client.get("/health")
@@ -31,15 +32,16 @@ def test_health_check_success(mock_get_db):
     assert response.json()["status"] == "ok"
     assert response.json()["api"] == "healthy"
     assert response.json()["database"] == "healthy"
+    assert "database_pool" in response.json()
     
-    # 验证数据库连接被正确调用
-    mock_get_db.assert_called_once()
+    # 验证从连接池获取了连接
+    assert db_pool.checkouts == 1
+    db_pool.conn.fetchone.assert_awaited_once()
 
 # 测试健康检查端点 - 数据库连接失败
-@patch("main.get_db_connection")
-def test_health_check_db_failure(mock_get_db):
+def test_health_check_db_failure(db_pool):
     # 设置模拟数据库连接失败
-    mock_get_db.side_effect = Exception("Database connection failed")
+    db_pool.acquire_error = Exception("Database connection failed")
     
     # 发送请求到健康检查端点
     response = client.get("/health")
@@ -0,0 +1,106 @@
+import asyncio
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from health import HealthProber
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+async def up():
+    return None
+
+
+async def down():
+    raise ConnectionError("refused")
+
+
+async def hang():
+    await asyncio.sleep(10)
+
+
+def test_starting_until_first_probe():
+    prober = HealthProber({"database": up}, critical={"database"}, clock=FakeClock())
+    snapshot = prober.snapshot()
+    assert snapshot["status"] == "starting"
+    assert snapshot["ready"] is False
+    assert snapshot["last_probe_age_seconds"] is None
+
+
+def test_ok_after_probe():
+    clock = FakeClock()
+    prober = HealthProber({"database": up, "anythingllm": up}, critical={"database"}, clock=clock)
+    asyncio.run(prober.probe())
+    clock.now += 1.5
+
+    snapshot = prober.snapshot()
+    assert snapshot["status"] == "ok"
+    assert snapshot["ready"] is True
+    assert snapshot["last_probe_age_seconds"] == 1.5
+    assert snapshot["checks"]["database"] == {"status": "up", "critical": True, "latency_ms": 0.0, "age_seconds": 1.5}
+
+
+def test_non_critical_failure_is_degraded():
+    prober = HealthProber({"database": up, "anythingllm": down}, critical={"database"}, clock=FakeClock())
+    asyncio.run(prober.probe())
+
+    snapshot = prober.snapshot()
+    assert snapshot["status"] == "degraded"
+    assert snapshot["ready"] is True
+    assert snapshot["checks"]["anythingllm"]["error"] == "refused"
+
+
+def test_critical_failure_is_unavailable():
+    prober = HealthProber({"database": down, "anythingllm": up}, critical={"database"}, clock=FakeClock())
+    asyncio.run(prober.probe())
+
+    snapshot = prober.snapshot()
+    assert snapshot["status"] == "unavailable"
+    assert snapshot["ready"] is False
+
+
+def test_slow_check_times_out():
+    prober = HealthProber({"database": hang}, critical={"database"}, timeout=0.05)
+    asyncio.run(prober.probe())
+
+    check = prober.snapshot()["checks"]["database"]
+    assert check["status"] == "down"
+    assert "timed out" in check["error"]
+
+
+def test_stale_probe_is_not_ready():
+    clock = FakeClock()
+    prober = HealthProber({"database": up}, critical={"database"}, interval=5, timeout=2, clock=clock)
+    asyncio.run(prober.probe())
+    clock.now += prober.stale_after + 1
+
+    assert prober.snapshot()["status"] == "stale"
+    assert prober.snapshot()["ready"] is False
+
+
+def test_background_loop_and_draining():
+    calls = []
+
+    async def check():
+        calls.append(1)
+
+    async def run():
+        prober = HealthProber({"database": check}, critical={"database"}, interval=0.01)
+        prober.start()
+        await asyncio.sleep(0.05)
+        assert prober.snapshot()["status"] == "ok"
+        await prober.stop()
+        return prober
+
+    prober = asyncio.run(run())
+    assert len(calls) >= 2
+    assert prober.snapshot()["status"] == "draining"
+    assert prober.snapshot()["ready"] is False
@@ -0,0 +1,73 @@
+# /health/live 和 /health/ready 端点的测试 (读取后台探测器缓存的结果)
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, health_prober
+
+client = TestClient(app)
+
+# 将假连接池挂到 app.state 上 (TestClient 未进入上下文时不会触发 startup 事件)
+@pytest.fixture
+def db_pool(fake_db_pool):
+    app.state.db_pool = fake_db_pool
+    yield fake_db_pool
+    del app.state.db_pool
+
+@pytest.fixture
+def prober(db_pool, monkeypatch):
+    def ping(request):
+        return httpx.Response(200, json={"online": True})
+    monkeypatch.setattr("main.ANYTHINGLLM_BASE_URL", "http://llm.test/api")
+    app.state.http_client = httpx.AsyncClient(transport=httpx.MockTransport(ping))
+    health_prober._results.clear()
+    health_prober._last_probe = None
+    health_prober.draining = False
+    yield health_prober
+    health_prober._results.clear()
+    health_prober._last_probe = None
+    asyncio.run(app.state.http_client.aclose())
+    del app.state.http_client
+
+def test_health_ready_before_first_probe(prober):
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+def test_health_ready_after_probe(prober):
+    asyncio.run(prober.probe())
+    checkouts = app.state.db_pool.checkouts
+
+    response = client.get("/health/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ok"
+    assert body["checks"]["database"]["status"] == "up"
+    assert body["checks"]["anythingllm"]["status"] == "up"
+    assert "latency_ms" in body["checks"]["database"]
+    assert body["last_probe_age_seconds"] is not None
+    # 端点本身不访问数据库
+    assert app.state.db_pool.checkouts == checkouts
+
+def test_health_ready_database_down(prober, db_pool):
+    db_pool.acquire_error = Exception("Database connection failed")
+    asyncio.run(prober.probe())
+
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "unavailable"
+    assert "Database connection failed" in response.json()["checks"]["database"]["error"]
+
+def test_health_live_does_not_touch_dependencies(db_pool):
+    db_pool.acquire_error = Exception("Database connection failed")
+    response = client.get("/health/live")
+    assert response.status_code == 200
+    assert response.json()["status"] == "alive"
+    assert db_pool.checkouts == 0
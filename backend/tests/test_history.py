@@ -0,0 +1,122 @@
+# /api/sessions/{id}/messages 聊天记录端点测试
+import asyncio
+import datetime
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).parent.parent.parent))
+
+from backend.main import app, encode_cursor
+
+client = TestClient(app)
+
+
+def make_messages(n):
+    start = datetime.datetime(2024, 5, 1, 12, 0, 0)
+    return [
+        {"id": f"m-{i:04d}", "role": "user" if i % 2 == 0 else "assistant", "content": f"消息{i}",
+         "created_at": start + datetime.timedelta(seconds=i // 2)}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def history_db(fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {"1": 1}  # 会话存在
+    app.state.db_pool = fake_db_pool
+    yield fake_db_pool
+    del app.state.db_pool
+
+
+def test_first_page_returns_next_cursor(history_db):
+    history_db.conn.fetchall.return_value = make_messages(4)  # limit + 1 行
+
+    response = client.get("/api/sessions/s-1/messages?limit=3")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [m["id"] for m in body] == ["m-0000", "m-0001", "m-0002"]
+    assert body[0]["created_at"] == "2024-05-01T12:00:00"
+    assert response.headers["X-Next-Cursor"] == encode_cursor("2024-05-01T12:00:01", "m-0002")
+    sql, params = history_db.conn.fetchall.call_args.args
+    assert "ORDER BY created_at ASC, id ASC LIMIT %s" in sql
+    assert params == ("s-1", 4)
+
+
+def test_cursor_continues_after_last_row(history_db):
+    history_db.conn.fetchall.return_value = make_messages(2)
+    cursor = encode_cursor("2024-05-01T12:00:01", "m-0002")
+
+    response = client.get(f"/api/sessions/s-1/messages?limit=3&order=desc&cursor={cursor}")
+
+    assert response.status_code == 200
+    assert "X-Next-Cursor" not in response.headers
+    sql, params = history_db.conn.fetchall.call_args.args
+    assert "(created_at < %s OR (created_at = %s AND id < %s))" in sql
+    assert params[1:4] == (datetime.datetime(2024, 5, 1, 12, 0, 1), datetime.datetime(2024, 5, 1, 12, 0, 1), "m-0002")
+
+
+def test_unknown_session_returns_404(history_db):
+    history_db.conn.fetchone.return_value = None
+
+    response = client.get("/api/sessions/missing/messages")
+
+    assert response.status_code == 404
+    history_db.conn.fetchall.assert_not_awaited()
+
+
+def test_invalid_cursor_returns_400(history_db):
+    response = client.get("/api/sessions/s-1/messages?cursor=not-a-cursor")
+
+    assert response.status_code == 400
+
+
+def test_ndjson_streams_from_unbuffered_cursor(history_db):
+    history_db.conn.stream_rows = make_messages(1200)
+
+    response = client.get("/api/sessions/s-1/messages?format=ndjson")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 1200
+    assert lines[-1]["id"] == "m-1199"
+    # 不使用 fetchall，且不加 LIMIT
+    history_db.conn.fetchall.assert_not_awaited()
+    sql, params = history_db.conn.streamed[0]
+    assert "LIMIT" not in sql and params == ["s-1"]
+
+
+def test_ndjson_releases_connection_when_client_disconnects_mid_stream(history_db):
+    history_db.conn.stream_rows = make_messages(1200)
+    scope = {
+        "type": "http", "method": "GET", "path": "/api/sessions/s-1/messages", "raw_path": b"/api/sessions/s-1/messages",
+        "query_string": b"format=ndjson", "headers": [],
+        "scheme": "http", "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    chunks = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks.append(message["body"])
+            if len(chunks) == 2:
+                raise OSError("client disconnected")  # 读了两批后客户端断开
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await app(scope, receive, send)
+        # 在事件循环关闭 (顺带回收挂起的生成器) 之前检查，连接必须已经还回连接池
+        assert history_db.checkouts >= 1 and history_db.releases == history_db.checkouts
+
+    asyncio.run(scenario())
+    assert len(chunks) == 2
@@ -0,0 +1,101 @@
+# 上游自适应并发限制 (limiter.AdaptiveLimiter) 的单元测试
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from limiter import AdaptiveLimiter, LimiterRejected, is_overload_error
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_limit_grows_on_fast_calls_and_backs_off_on_slow_ones():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter("test", initial_limit=4, max_limit=8, tolerance=2.0, backoff=0.5, clock=clock)
+
+    async def call(latency, overloaded=False):
+        permit = await limiter.acquire()
+        clock.now += latency
+        permit.release(overloaded=overloaded)
+
+    async def scenario():
+        for _ in range(20):
+            await call(1.0)
+        grown = limiter.limit
+        assert grown > 4
+        await call(5.0)  # 超过基线 2 倍
+        assert limiter.limit == pytest.approx(grown * 0.5)
+        # 同一个基线周期内不会连续下调
+        await call(0.0, overloaded=True)
+        assert limiter.limit == pytest.approx(grown * 0.5)
+        clock.now += 2.0
+        await call(0.0, overloaded=True)
+        assert limiter.limit == pytest.approx(grown * 0.25)
+
+    asyncio.run(scenario())
+    assert limiter.min_limit <= limiter.limit <= limiter.max_limit
+
+
+def test_rejects_when_queue_is_full():
+    limiter = AdaptiveLimiter("test", initial_limit=1, max_queue=1, queue_timeout=1.0)
+
+    async def scenario():
+        held = await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 1
+        with pytest.raises(LimiterRejected) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.reason == "queue_full"
+        assert excinfo.value.retry_after >= 1
+        # 释放后排队的请求按顺序拿到名额
+        held.release()
+        permit = await queued
+        assert limiter.stats()["in_flight"] == 1
+        permit.release()
+
+    asyncio.run(scenario())
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.rejected == 1
+
+
+def test_queue_wait_times_out():
+    limiter = AdaptiveLimiter("test", initial_limit=1, max_queue=4, queue_timeout=0.05)
+
+    async def scenario():
+        held = await limiter.acquire()
+        with pytest.raises(LimiterRejected) as excinfo:
+            await limiter.acquire()
+        assert excinfo.value.reason == "queue_timeout"
+        held.release()
+
+    asyncio.run(scenario())
+    stats = limiter.stats()
+    assert (stats["in_flight"], stats["queued"], stats["queue_timeouts"]) == (0, 0, 1)
+
+
+def test_slot_classifies_upstream_errors():
+    limiter = AdaptiveLimiter("test", initial_limit=4, backoff=0.5)
+    request = httpx.Request("POST", "http://llm/chat")
+
+    async def scenario():
+        with pytest.raises(httpx.ConnectError):
+            async with limiter.slot():
+                raise httpx.ConnectError("refused", request=request)
+
+    asyncio.run(scenario())
+    assert limiter.limit == 2
+    assert limiter.in_flight == 0
+    assert is_overload_error(httpx.HTTPStatusError("x", request=request, response=httpx.Response(503)))
+    assert not is_overload_error(httpx.HTTPStatusError("x", request=request, response=httpx.Response(400)))
@@ -0,0 +1,57 @@
+# 聊天端点的上游限流与熔断降级测试
+import json
+import os
+import sys
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from breaker import CircuitOpenError
+from limiter import LimiterRejected
+from main import app, chat_breaker, chat_limiter, crisis_resources_cache
+
+client = TestClient(app)
+
+
+def test_chat_rejected_by_limiter_returns_retry_after(workspace_chat_calls):
+
+    async def reject():
+        raise LimiterRejected("queue_full", 7)
+
+    with patch.object(chat_limiter, "acquire", reject):
+        response = client.post("/api/chat", json={"message": "限流测试"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "7"
+    assert workspace_chat_calls == []
+
+
+def test_chat_returns_degraded_reply_when_circuit_is_open(workspace_chat_calls, fake_db_pool):
+
+    def circuit_open():
+        raise CircuitOpenError("anythingllm", 30)
+
+    crisis_resources_cache.clear()
+    fake_db_pool.conn.fetchall.return_value = [
+        {"title": "全国心理援助热线", "description": "24小时", "contact_info": "400-161-9995", "url": None},
+    ]
+    with patch.object(chat_breaker, "allow", circuit_open):
+        response = client.post("/api/chat", json={"message": "我很难受"}, headers={"X-Cache-Bypass": "1"})
+        stream = client.post("/api/chat/stream?format=ndjson", json={"message": "我很难受"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["degraded"] is True
+    assert "400-161-9995" in body["reply"]
+    assert body["resources"][0]["title"] == "全国心理援助热线"
+    assert workspace_chat_calls == []
+    # 危机资源只查询一次，之后走缓存
+    assert fake_db_pool.conn.fetchall.await_count == 1
+
+    events = [json.loads(line) for line in stream.text.splitlines() if line]
+    assert [e["type"] for e in events] == ["token", "done"]
+    assert events[-1]["degraded"] is True
+    crisis_resources_cache.clear()
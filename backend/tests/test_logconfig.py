@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueListener
+
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from logconfig import (
+    DeferredQueueHandler, JsonFormatter, MessageCapFilter, RequestContextFilter, SamplingFilter,
+    parse_sample_rates, request_id_var, route_uvicorn_loggers,
+)
+from main import app
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def make_record(name="main.chat", level=logging.INFO, msg="hello %s", args=("world",), **extra):
+    record = logging.LogRecord(name, level, __file__, 1, msg, args, None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+
+def make_pipeline(**sample_rates):
+    """Queue handler + listener wired like setup_logging(), writing to a list."""
+    target = ListHandler()
+    target.setFormatter(JsonFormatter())
+    target.addFilter(MessageCapFilter(50))
+    handler = DeferredQueueHandler(queue.Queue(100))
+    handler.addFilter(RequestContextFilter())
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+    listener = QueueListener(handler.queue, target, respect_handler_level=True)
+    logger = logging.getLogger("test_logconfig.pipeline")
+    logger.propagate = False
+    logger.handlers = [handler]
+    logger.setLevel(logging.DEBUG)
+    return logger, listener, target
+
+
+def test_records_carry_request_id_and_are_formatted_on_the_listener():
+    logger, listener, target = make_pipeline()
+    payload = {"textResponse": "x" * 100}
+
+    token = request_id_var.set("req-1")
+    try:
+        logger.info("Raw response: %s", payload)
+    finally:
+        request_id_var.reset(token)
+    # Nothing has been formatted on the calling thread
+    record = listener.queue.get_nowait()
+    assert record.msg == "Raw response: %s"
+    listener.queue.put_nowait(record)
+
+    listener.start()
+    listener.stop()
+    entry = json.loads(target.lines[0])
+    assert entry["request_id"] == "req-1"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "test_logconfig.pipeline"
+    assert entry["msg"].startswith("Raw response: {'textResponse': 'xxx")
+    assert entry["msg"].endswith("...(+84 chars)")
+
+
+def test_exception_is_rendered_before_queueing():
+    logger, listener, target = make_pipeline()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("failed")
+    listener.start()
+    listener.stop()
+    entry = json.loads(target.lines[0])
+    assert entry["msg"] == "failed"
+    assert "ValueError: boom" in entry["exc"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DeferredQueueHandler(queue.Queue(1))
+    handler.handle(make_record())
+    handler.handle(make_record())
+    assert handler.dropped == 1
+
+
+def test_sampling_filter():
+    sampler = SamplingFilter({"main.chat": 0.0, "httpx": 0.5})
+    assert sampler.filter(make_record("main.chat")) is False
+    assert sampler.filter(make_record("main.chat", level=logging.WARNING)) is True
+    assert sampler.filter(make_record("main")) is True  # Parent of a sampled logger is not sampled
+    assert sampler.rate_for("httpx._client") == 0.5
+
+    # Decided per request: every line of a request is kept or dropped together
+    decisions = {
+        request_id: {sampler.filter(make_record("httpx", request_id=request_id)) for _ in range(5)}
+        for request_id in (f"req-{i}" for i in range(200))
+    }
+    assert all(len(d) == 1 for d in decisions.values())
+    kept = sum(d == {True} for d in decisions.values())
+    assert 60 < kept < 140
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("httpx=0.05, main.chat=0.2,") == {"httpx": 0.05, "main.chat": 0.2}
+    assert parse_sample_rates("") == {}
+
+
+def test_request_id_header():
+    client = TestClient(app)
+
+    response = client.get("/", headers={"X-Request-ID": "abc123"})
+    assert response.headers["X-Request-ID"] == "abc123"
+
+    generated = client.get("/").headers["X-Request-ID"]
+    assert len(generated) == 32
+
+
+def test_route_uvicorn_loggers_undoes_worker_handlers():
+    error_logger = logging.getLogger("uvicorn.error")
+    access_logger = logging.getLogger("uvicorn.access")
+    try:
+        # 模拟 gunicorn 的 UvicornWorker: 使用 gunicorn 自己的处理器且不向 root 传播
+        for logger in (error_logger, access_logger):
+            logger.handlers = [logging.StreamHandler()]
+            logger.setLevel(logging.WARNING)
+            logger.propagate = False
+
+        route_uvicorn_loggers(access_log=False)
+        assert error_logger.handlers == [] and error_logger.propagate
+        assert error_logger.level == logging.NOTSET
+        assert access_logger.disabled  # 与未设置 accesslog 的 gunicorn 一致
+
+        route_uvicorn_loggers()
+        assert not access_logger.disabled and access_logger.propagate
+    finally:
+        for logger in (error_logger, access_logger):
+            logger.handlers.clear()
+            logger.propagate = True
+            logger.setLevel(logging.NOTSET)
+            logger.disabled = False
@@ -0,0 +1,61 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+from main import app, get_http_client
+from metrics import track_upstream
+
+client = TestClient(app)
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture
+def db_pool(fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {"1": 1}
+    app.state.db_pool = fake_db_pool
+    yield fake_db_pool
+    del app.state.db_pool
+
+
+def test_metrics_endpoint_counts_requests_by_route_template(db_pool):
+    before = sample("psychat_http_requests_total", method="GET", route="/health", status="200")
+    client.get("/health")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "psychat_http_request_duration_seconds_bucket" in response.text
+    assert sample("psychat_http_requests_total", method="GET", route="/health", status="200") == before + 1
+    # 未匹配的路径统一记为 unmatched，避免标签基数无限增长
+    client.get("/no-such-path/12345")
+    assert sample("psychat_http_requests_total", method="GET", route="unmatched", status="404") >= 1
+
+
+def test_upstream_errors_are_counted_by_status(db_pool):
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda r: httpx.Response(502, text="bad gateway")))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    before = sample("psychat_upstream_errors_total", call="chat", status="502")
+    try:
+        response = client.post("/api/chat", json={"message": "你好"}, headers={"X-Cache-Bypass": "1"})
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+
+    assert response.status_code == 502
+    assert sample("psychat_upstream_errors_total", call="chat", status="502") == before + 1
+    assert sample("psychat_upstream_requests_in_flight", call="chat") == 0
+
+
+def test_track_upstream_counts_network_errors():
+    before = sample("psychat_upstream_errors_total", call="thread_new", status="network")
+    count_before = sample("psychat_upstream_request_duration_seconds_count", call="thread_new")
+    with pytest.raises(httpx.ConnectError):
+        with track_upstream("thread_new"):
+            raise httpx.ConnectError("connection refused")
+
+    assert sample("psychat_upstream_errors_total", call="thread_new", status="network") == before + 1
+    assert sample("psychat_upstream_request_duration_seconds_count", call="thread_new") == count_before + 1
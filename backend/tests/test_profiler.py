@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from profiler import collapsed, sample_stacks
+import main
+
+client = TestClient(main.app)
+
+
+def busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sample_stacks_collapsed_format():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+    worker.start()
+    try:
+        counts = sample_stacks(0.1, interval=0.002, thread_ids={worker.ident})
+    finally:
+        stop.set()
+        worker.join()
+
+    assert counts
+    assert all(stack.startswith("busy;") for stack in counts)
+    assert any("busy_loop (test_profiler.py:" in stack for stack in counts)
+    lines = collapsed(counts).splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) == max(counts.values())
+
+
+def test_admin_profile_disabled_without_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "")
+    assert client.get("/admin/profile?seconds=0.01").status_code == 404
+
+
+def test_admin_profile_requires_token(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    response = client.get("/admin/profile?seconds=0.01", headers={"Authorization": "Bearer wrong"})
+    assert response.status_code == 403
+
+
+def test_admin_profile_returns_folded_stacks(monkeypatch):
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    response = client.get(
+        "/admin/profile?seconds=0.05&interval_ms=1&all_threads=true", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert response.headers["X-Profile-Pid"] == str(os.getpid())
+    assert int(response.headers["X-Profile-Samples"]) > 0
+    assert ".folded" in response.headers["content-disposition"]
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
@@ -0,0 +1,89 @@
+# 无会话聊天回复缓存 (/api/chat) 的测试
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, chat_reply_cache, get_http_client, normalize_chat_message, session_thread_cache
+
+client = TestClient(app)
+
+
+def test_normalize_chat_message_folds_width_punctuation_and_spaces():
+    assert normalize_chat_message("  失眠 怎么办？ ") == normalize_chat_message("失眠怎么办?")
+    assert normalize_chat_message("ＡＢＣ，焦虑！") == normalize_chat_message("abc焦虑")
+    assert normalize_chat_message("失眠怎么办") != normalize_chat_message("焦虑怎么办")
+
+
+def test_stateless_chat_reply_is_cached(workspace_chat_calls):
+    first = client.post("/api/chat", json={"message": "失眠怎么办？"})
+    second = client.post("/api/chat", json={"message": " 失眠怎么办 ?"})
+
+    assert first.json()["reply"] == second.json()["reply"] == "回复1"
+    assert first.headers["X-Cache"] == "MISS"
+    assert second.headers["X-Cache"] == "HIT"
+    assert len(workspace_chat_calls) == 1
+    assert chat_reply_cache.stats()["hits"] == 1
+
+
+def test_stateless_chat_cache_bypass_header(workspace_chat_calls):
+    client.post("/api/chat", json={"message": "失眠怎么办"})
+    response = client.post("/api/chat", json={"message": "失眠怎么办"}, headers={"X-Cache-Bypass": "1"})
+
+    assert response.headers["X-Cache"] == "BYPASS"
+    assert response.json()["reply"] == "回复2"
+    assert len(workspace_chat_calls) == 2
+    # 绕过缓存得到的新回复会刷新缓存
+    assert client.post("/api/chat", json={"message": "失眠怎么办"}).json()["reply"] == "回复2"
+
+
+def test_threaded_chat_is_not_cached(workspace_chat_calls, fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {"anythingllm_thread_id": "t-1"}
+    session_thread_cache.clear()
+    for _ in range(2):
+        response = client.post("/api/chat", json={"message": "失眠怎么办", "session_id": "s-cache"})
+        assert "X-Cache" not in response.headers
+
+    assert len(workspace_chat_calls) == 2
+    assert len(chat_reply_cache) == 0
+
+
+def test_bypass_does_not_join_an_identical_call_in_flight(fake_db_pool):
+    calls = []
+
+    async def handler(request: httpx.Request):
+        calls.append(json.loads(request.content))
+        reply = f"回复{len(calls)}"
+        await asyncio.sleep(0.05)  # 让两个请求在上游调用期间重叠
+        return httpx.Response(200, json={"textResponse": reply})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    chat_reply_cache.clear()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            miss = asyncio.ensure_future(ac.post("/api/chat", json={"message": "失眠怎么办"}))
+            await asyncio.sleep(0.01)
+            bypass = await ac.post("/api/chat", json={"message": "失眠怎么办"}, headers={"X-Cache-Bypass": "1"})
+            return await miss, bypass
+
+    try:
+        miss, bypass = asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        del app.state.db_pool
+        chat_reply_cache.clear()
+
+    # 绕过缓存的请求自己调用一次上游，得到新的回复
+    assert len(calls) == 2
+    assert (miss.headers["X-Cache"], miss.json()["reply"]) == ("MISS", "回复1")
+    assert (bypass.headers["X-Cache"], bypass.json()["reply"]) == ("BYPASS", "回复2")
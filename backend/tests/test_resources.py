@@ -1,7 +1,8 @@
 # If "Import pytest could not be resolved", ensure pytest is installed in your Python environment (e.g., pip install pytest).
+import base64
+import json
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, MagicMock
 import sys
 from pathlib import Path
 
@@ -9,7 +10,7 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
 # 导入主应用
-from backend.main import app
+from backend.main import app, resources_cache, resources_version_cache
 
 # 创建测试客户端
 client = TestClient(app)
@@ -40,15 +41,21 @@ def mock_db_resources():
         }
     ]
 
+# 用假连接池替换数据库连接池，并清空响应缓存
+@pytest.fixture
+def mock_conn(fake_db_pool):
+    app.state.db_pool = fake_db_pool
+    resources_cache.clear()
+    resources_version_cache.clear()
+    # 表版本查询: 行数 + MAX(updated_at)
+    fake_db_pool.conn.fetchone.return_value = {"row_count": 2, "last_updated": "2023-01-02T00:00:00"}
+    yield fake_db_pool.conn
+    del app.state.db_pool
+
 # 测试资源API端点 - 获取所有资源
-@patch("backend.main.get_db_connection")
-def test_get_resources(mock_get_db, mock_db_resources):
-    # 设置模拟数据库连接和游标
-    mock_cursor = MagicMock()
-    mock_cursor.fetchall.return_value = mock_db_resources
-    mock_conn = MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-    mock_get_db.return_value = mock_conn
+def test_get_resources(mock_conn, mock_db_resources):
+    # 设置模拟查询结果
+    mock_conn.fetchall.return_value = mock_db_resources
     
     # 发送测试请求
     response = client.get("/api/resources")
@@ -59,20 +66,15 @@ def test_get_resources(mock_get_db, mock_db_resources):
     assert response.json()[0]["title"] == mock_db_resources[0]["title"]
     
     # 验证SQL查询
-    mock_cursor.execute.assert_called_once()
+    mock_conn.fetchall.assert_awaited_once()
     
 # 测试资源API端点 - 使用过滤条件
-@patch("backend.main.get_db_connection")
-def test_get_resources_with_filters(mock_get_db, mock_db_resources):
+def test_get_resources_with_filters(mock_conn, mock_db_resources):
     # 筛选后的结果
     filtered_results = [mock_db_resources[0]]  # 只包含crisis类别的资源
     
-    # 设置模拟数据库连接和游标
-    mock_cursor = MagicMock()
-    mock_cursor.fetchall.return_value = filtered_results
-    mock_conn = MagicMock()
-    mock_conn.cursor.return_value.__enter__.return_value = mock_cursor
-    mock_get_db.return_value = mock_conn
+    # 设置模拟查询结果
+    mock_conn.fetchall.return_value = filtered_results
     
     # 发送测试请求 - 按类别筛选
     response = client.get("/api/resources?category=crisis")
@@ -83,4 +85,110 @@ def test_get_resources_with_filters(mock_get_db, mock_db_resources):
     assert response.json()[0]["category"] == "crisis"
     
     # 验证SQL查询包含过滤条件
-    mock_cursor.execute.assert_called_once()
+    mock_conn.fetchall.assert_awaited_once()
+    query, params = mock_conn.fetchall.call_args.args
+    assert "category = %s" in query
+    assert "crisis" in params
+
+# 测试资源缓存 - 表未变化时不再查询数据
+def test_get_resources_served_from_cache(mock_conn, mock_db_resources):
+    mock_conn.fetchall.return_value = mock_db_resources
+
+    first = client.get("/api/resources?category=crisis")
+    resources_version_cache.clear()  # 强制重新检查表版本
+    second = client.get("/api/resources?category=crisis")
+
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    mock_conn.fetchall.assert_awaited_once()
+    assert mock_conn.fetchone.await_count == 2
+
+    # 表版本变化 (例如新增资源) 后缓存失效
+    mock_conn.fetchone.return_value = {"row_count": 3, "last_updated": "2023-01-03T00:00:00"}
+    resources_version_cache.clear()
+    client.get("/api/resources?category=crisis")
+    assert mock_conn.fetchall.await_count == 2
+
+# 测试 ETag / If-None-Match 返回 304
+def test_get_resources_etag_not_modified(mock_conn, mock_db_resources):
+    mock_conn.fetchall.return_value = mock_db_resources
+
+    response = client.get("/api/resources")
+    etag = response.headers["etag"]
+    assert etag.startswith('"') and etag.endswith('"')
+    assert "max-age" in response.headers["cache-control"]
+
+    revalidated = client.get("/api/resources", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    mock_conn.fetchall.assert_awaited_once()
+
+    changed = client.get("/api/resources", headers={"If-None-Match": '"stale"'})
+    assert changed.status_code == 200
+
+# 测试游标分页 - 多取一行判断是否有下一页
+def test_get_resources_keyset_pagination(mock_conn, mock_db_resources):
+    mock_conn.fetchall.return_value = list(reversed(mock_db_resources))  # 按 created_at 倒序
+
+    first_page = client.get("/api/resources?limit=1")
+    assert first_page.status_code == 200
+    assert len(first_page.json()) == 1
+    next_cursor = first_page.headers["x-next-cursor"]
+    query, params = mock_conn.fetchall.call_args.args
+    assert "ORDER BY created_at DESC, id DESC" in query
+    assert params[-1] == 2  # limit + 1
+
+    mock_conn.fetchall.return_value = [mock_db_resources[0]]
+    second_page = client.get(f"/api/resources?limit=1&cursor={next_cursor}")
+    assert second_page.status_code == 200
+    assert "x-next-cursor" not in second_page.headers  # 最后一页
+    query, params = mock_conn.fetchall.call_args.args
+    assert "created_at < %s OR (created_at = %s AND id < %s)" in query
+    assert params[2] == 2  # 上一页最后一行的 id
+
+# 测试字段投影
+def test_get_resources_fields_projection(mock_conn):
+    mock_conn.fetchall.return_value = []
+
+    response = client.get("/api/resources?fields=title,category")
+    assert response.status_code == 200
+    query, _ = mock_conn.fetchall.call_args.args
+    assert query.startswith("SELECT id, title, category, created_at FROM resources")
+
+    assert client.get("/api/resources?fields=title,password").status_code == 400
+    assert client.get("/api/resources?cursor=not-a-cursor").status_code == 400
+
+# 测试全文搜索 - 相关度排序、过滤条件与游标分页
+def test_search_resources(mock_conn, mock_db_resources):
+    mock_conn.fetchall.return_value = [
+        dict(mock_db_resources[0], relevance=1.5),
+        dict(mock_db_resources[1], relevance=0.75),
+    ]
+
+    response = client.get("/api/resources/search?q=心理热线&category=crisis&limit=1")
+    assert response.status_code == 200
+    assert len(response.json()) == 1
+    assert response.json()[0]["relevance"] == 1.5
+    query, params = mock_conn.fetchall.call_args.args
+    assert "MATCH(title, description) AGAINST" in query
+    assert "category = %s" in query
+    assert "ORDER BY relevance DESC, id DESC" in query
+    assert params[:3] == ("心理热线", "心理热线", "crisis")
+
+    next_cursor = response.headers["x-next-cursor"]
+    mock_conn.fetchall.return_value = [dict(mock_db_resources[1], relevance=0.75)]
+    response = client.get(f"/api/resources/search?q=心理热线&category=crisis&limit=1&cursor={next_cursor}")
+    assert response.status_code == 200
+    assert "x-next-cursor" not in response.headers
+    query, params = mock_conn.fetchall.call_args.args
+    assert "HAVING (relevance < %s OR (relevance = %s AND id < %s))" in query
+    assert params[3:6] == (1.5, 1.5, 1)
+
+    # 伪造的游标 (类型错误、非有限数) 返回 400 而不是 500
+    for values in (["x", 1], [[1], 1], [1.5, {"id": 1}], [1.5, "abc"], [float("nan"), 1]):
+        bad = base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip("=")
+        assert client.get(f"/api/resources/search?q=心理热线&cursor={bad}").status_code == 400
+
+    # 关键词过短
+    assert client.get("/api/resources/search?q=失").status_code == 422
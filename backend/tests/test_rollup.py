@@ -0,0 +1,112 @@
+# system_metrics 汇总 (rollup.MetricsRollup) 的单元测试
+import asyncio
+import datetime
+import os
+import sys
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rollup import MetricsRollup, percentile
+
+NOW = datetime.datetime(2024, 5, 1, 12, 0, 0)
+
+
+def test_percentile_nearest_rank():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 99) == 7.0
+
+
+def test_collect_produces_per_route_and_total_rows():
+    rollup = MetricsRollup()
+    for ms in range(1, 101):
+        rollup.observe_request("/api/chat", 200, ms / 1000)
+    rollup.observe_request("/api/resources", 500, 0.002)
+    rollup.observe_upstream("chat", 1.5, error=False)
+    rollup.observe_upstream("chat", 0.5, error=True)
+
+    rows = {name: value for name, value, measured_at in rollup.collect(NOW)}
+
+    assert rows["http./api/chat.count"] == 100
+    assert rows["http./api/chat.p50_ms"] == 50
+    assert rows["http./api/chat.p99_ms"] == 99
+    assert rows["http./api/resources.errors"] == 1
+    assert rows["http.count"] == 101
+    assert rows["http.errors"] == 1
+    assert rows["upstream.chat.error_rate"] == 0.5
+    assert all(len(name) <= 50 for name in rows)
+    # 取走后窗口清空
+    assert rollup.collect(NOW) == []
+
+
+def test_latency_samples_are_bounded():
+    rollup = MetricsRollup(max_samples=10)
+    for i in range(1000):
+        rollup.observe_request("/health", 200, 0.001)
+    assert len(rollup._requests["/health"].samples) == 10
+    rows = {name: value for name, value, _ in rollup.collect(NOW)}
+    assert rows["http./health.count"] == 1000
+
+
+def test_flush_writes_one_batched_insert(fake_db_pool):
+    rollup = MetricsRollup()
+    rollup._pool = fake_db_pool
+    rollup.observe_request("/api/chat", 200, 0.1)
+    rollup.observe_upstream("thread_new", 0.3, error=False)
+
+    written = asyncio.run(rollup.flush())
+
+    fake_db_pool.conn.executemany.assert_awaited_once()
+    sql, rows = fake_db_pool.conn.executemany.call_args.args
+    assert sql.startswith("INSERT INTO system_metrics")
+    assert written == len(rows) == rollup.rows_written == 18  # 2 个路由级 + 1 个上游，各 6 个指标
+    # 没有新数据时不访问数据库
+    assert asyncio.run(rollup.flush()) == 0
+    assert fake_db_pool.checkouts == 1
+
+
+def test_flush_failure_drops_window(fake_db_pool):
+    rollup = MetricsRollup()
+    rollup._pool = fake_db_pool
+    fake_db_pool.acquire_error = RuntimeError("db down")
+    rollup.observe_request("/api/chat", 200, 0.1)
+
+    assert asyncio.run(rollup.flush()) == 0
+    assert rollup.failed_flushes == 1
+    assert rollup.collect(NOW) == []
+
+
+def test_maintain_prunes_and_downsamples(fake_db_pool):
+    conn = fake_db_pool.conn
+    conn.fetchone.return_value = {"locked": 1}
+    conn.fetchall.return_value = [
+        {"metric_name": "http.count", "bucket": "2024-04-28 10:00:00", "n": 60, "total": 600.0, "average": 10.0, "max_id": 42},
+        {"metric_name": "http.p95_ms", "bucket": "2024-04-28 10:00:00", "n": 60, "total": 6000.0, "average": 100.0, "max_id": 43},
+    ]
+    rollup = MetricsRollup()
+    rollup._pool = fake_db_pool
+
+    asyncio.run(rollup.maintain(now=NOW))
+
+    assert conn.execute.call_args.args[1] == (NOW - datetime.timedelta(days=30),)
+    inserted = conn.executemany.call_args_list[0].args[1]
+    # 计数类指标求和，延迟类指标取平均
+    assert inserted == [("http.count", 600.0, "2024-04-28 10:00:00"), ("http.p95_ms", 100.0, "2024-04-28 10:00:00")]
+    deleted = conn.executemany.call_args_list[1].args[1]
+    assert [d[-1] for d in deleted] == [42, 43]
+    conn.commit.assert_awaited_once()
+    assert "RELEASE_LOCK" in conn.fetchone.call_args.args[0]
+
+
+def test_maintain_skips_when_another_worker_holds_lock(fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {"locked": 0}
+    rollup = MetricsRollup()
+    rollup._pool = fake_db_pool
+
+    asyncio.run(rollup.maintain(now=NOW))
+
+    fake_db_pool.conn.execute.assert_not_awaited()
+    fake_db_pool.conn.executemany.assert_not_awaited()
@@ -0,0 +1,48 @@
+# serialize.py (orjson 行序列化) 的单元测试
+import datetime
+import decimal
+import json
+import os
+import sys
+
+from pymysql.constants import FIELD_TYPE
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialize import column_converters, dumps_rows
+
+# cursor.description 的格式: (name, type_code, display_size, internal_size, precision, scale, null_ok)
+DESCRIPTION = (
+    ("id", FIELD_TYPE.LONG, None, 11, 11, 0, False),
+    ("title", FIELD_TYPE.VAR_STRING, None, 1020, 1020, 0, False),
+    ("score", FIELD_TYPE.NEWDECIMAL, None, 6, 6, 2, True),
+    ("opens_at", FIELD_TYPE.TIME, None, 10, 10, 0, True),
+    ("created_at", FIELD_TYPE.TIMESTAMP, None, 19, 19, 0, True),
+)
+
+
+def test_only_columns_needing_conversion_get_converters():
+    assert [name for name, _ in column_converters(DESCRIPTION)] == ["score", "opens_at"]
+    assert column_converters(None) == []
+
+
+def test_dumps_rows_matches_the_api_format():
+    rows = [
+        {"id": 1, "title": "心理援助热线", "score": decimal.Decimal("4.50"), "opens_at": datetime.timedelta(hours=8, minutes=30),
+         "created_at": datetime.datetime(2024, 1, 2, 3, 4, 5)},
+        {"id": 2, "title": "在线咨询", "score": None, "opens_at": None, "created_at": None},
+    ]
+
+    body = dumps_rows(rows, DESCRIPTION)
+
+    assert "心理援助热线".encode("utf-8") in body  # 不转义非 ASCII 字符
+    assert json.loads(body) == [
+        {"id": 1, "title": "心理援助热线", "score": 4.5, "opens_at": "08:30:00", "created_at": "2024-01-02T03:04:05"},
+        {"id": 2, "title": "在线咨询", "score": None, "opens_at": None, "created_at": None},
+    ]
+
+
+def test_without_description_falls_back_to_default_hook():
+    rows = [{"price": decimal.Decimal("1.25"), "blob": b"abc", "bad": b"\xff"}]
+
+    assert json.loads(dumps_rows(rows)) == [{"price": 1.25, "blob": "abc", "bad": "b'\\xff'"}]
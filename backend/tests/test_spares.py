@@ -0,0 +1,184 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spares import SpareThreadPool
+
+
+def make_create():
+    created = []
+
+    async def create():
+        created.append(f"t-{len(created) + 1}")
+        return created[-1]
+
+    return create, created
+
+
+def executed_sql(conn):
+    return [call.args[0] for call in conn.execute.await_args_list]
+
+
+def test_claim_without_spares_falls_back():
+    spares = SpareThreadPool(low_watermark=1, high_watermark=2)
+    assert spares.claim() is None
+
+
+def test_refill_to_high_watermark_and_store(fake_db_pool):
+    spares = SpareThreadPool(low_watermark=2, high_watermark=3)
+    create, created = make_create()
+
+    async def run():
+        spares._pool, spares._create, spares._workspace = fake_db_pool, create, "demo"
+        return await spares.refill()
+
+    assert asyncio.run(run()) == 3
+    assert len(spares) == 3
+    assert created == ["t-1", "t-2", "t-3"]
+    inserts = [call.args[1] for call in fake_db_pool.conn.execute.await_args_list]
+    assert [row[0] for row in inserts] == created
+    assert all(row[1] == "demo" for row in inserts)
+
+    assert spares.claim() == "t-1"
+    assert spares.stats()["claims"] == 1
+
+
+def test_background_refill_after_claims_and_release_on_stop(fake_db_pool):
+    create, created = make_create()
+    spares = SpareThreadPool(low_watermark=2, high_watermark=3, retry_delay=0.01)
+
+    async def run():
+        spares.start(fake_db_pool, create, "demo")
+        await asyncio.sleep(0.05)
+        assert len(spares) == 3
+        # Two claims leave 1 spare (< low watermark): refilled back to the high watermark
+        assert spares.claim() == "t-1"
+        assert spares.claim() == "t-2"
+        await asyncio.sleep(0.05)
+        assert len(spares) == 3
+        await spares.stop()
+
+    asyncio.run(run())
+    assert created == ["t-1", "t-2", "t-3", "t-4", "t-5"]
+    assert len(spares) == 0
+    assert "SET owner = NULL" in executed_sql(fake_db_pool.conn)[-1]
+
+
+def test_adopts_stored_spares_on_start(fake_db_pool):
+    fake_db_pool.conn.fetchall.return_value = [{"thread_slug": "old-1"}, {"thread_slug": "old-2"}]
+    create, created = make_create()
+    spares = SpareThreadPool(low_watermark=1, high_watermark=3, retry_delay=0.01)
+
+    claimed = []
+
+    async def run():
+        spares.start(fake_db_pool, create, "demo")
+        await asyncio.sleep(0.05)
+        claimed.extend(spares.claim() for _ in range(3))
+        await spares.stop()
+
+    asyncio.run(run())
+    assert claimed == ["old-1", "old-2", "t-1"]
+    assert spares.stats()["adopted"] == 2
+    adopt_sql = executed_sql(fake_db_pool.conn)[0]
+    assert "leased_until <= NOW()" in adopt_sql
+    assert fake_db_pool.conn.execute.await_args_list[0].args[1][-1] == 3  # Up to the high watermark
+
+
+def test_instance_pools_adopt_and_store_their_own_spares(fake_db_pool):
+    create, _ = make_create()
+    primary = SpareThreadPool(low_watermark=1, high_watermark=1, upstream="http://llm-1:3001")
+    other = SpareThreadPool(low_watermark=1, high_watermark=1, upstream="http://llm-2:3001", adopt_unpinned=False)
+
+    async def run(spares):
+        spares._pool, spares._create, spares._workspace = fake_db_pool, create, "demo"
+        await spares.adopt()
+        await spares.refill()
+
+    asyncio.run(run(primary))
+    asyncio.run(run(other))
+    (adopt_primary, insert_primary, adopt_other, insert_other) = fake_db_pool.conn.execute.await_args_list
+    # Rows stored before instances were recorded (NULL) belong to the primary
+    assert "(upstream = %s OR upstream IS NULL)" in adopt_primary.args[0]
+    assert "upstream = %s AND" in adopt_other.args[0] and "IS NULL" not in adopt_other.args[0]
+    assert adopt_other.args[1][-2:] == ("http://llm-2:3001", 1)
+    assert insert_primary.args[1][2] == "http://llm-1:3001"
+    assert insert_other.args[1][2] == "http://llm-2:3001"
+
+
+def test_paused_and_failing_refills(fake_db_pool):
+    attempts = []
+
+    async def failing_create():
+        attempts.append(1)
+        raise ConnectionError("upstream down")
+
+    paused = SpareThreadPool(low_watermark=1, high_watermark=2)
+    failing = SpareThreadPool(low_watermark=1, high_watermark=2, retry_delay=0.01)
+
+    async def run():
+        paused.start(fake_db_pool, failing_create, "demo", paused=lambda: True)
+        failing.start(fake_db_pool, failing_create, "demo")
+        await asyncio.sleep(0.05)
+        await paused.stop()
+        await failing.stop()
+
+    asyncio.run(run())
+    assert len(paused) == len(failing) == 0
+    assert failing.stats()["failures"] >= 2
+    assert len(attempts) == failing.stats()["failures"]  # The paused pool never called create
+
+
+def test_give_back_keeps_thread_for_next_session():
+    spares = SpareThreadPool(low_watermark=0, high_watermark=2)
+    spares._spares.extend(["t-1", "t-2"])
+    slug = spares.claim()
+    spares.give_back(slug)
+    assert spares.claim() == "t-1"
+    assert spares.stats()["claims"] == 1
+
+
+def test_leases_are_renewed_while_refills_keep_failing(fake_db_pool):
+    async def failing_create():
+        raise ConnectionError("thread/new returned 500")
+
+    spares = SpareThreadPool(low_watermark=1, high_watermark=2, lease_seconds=0.15, retry_delay=0.01)
+
+    async def run():
+        spares.start(fake_db_pool, failing_create, "demo")
+        await asyncio.sleep(0.2)
+        await spares.stop()
+
+    asyncio.run(run())
+    renewals = [sql for sql in executed_sql(fake_db_pool.conn) if sql.startswith("UPDATE") and "WHERE owner" in sql
+                and "SET leased_until" in sql]
+    assert len(renewals) >= 2
+    assert spares.stats()["failures"] > len(renewals)
+
+
+def test_spares_taken_over_by_another_worker_are_dropped(fake_db_pool):
+    spares = SpareThreadPool(low_watermark=0, high_watermark=3)
+    spares._pool = fake_db_pool
+    spares._spares.extend(["t-1", "t-2", "t-3"])
+    spares._unstored.add("t-3")  # Never stored, so no other worker can have it
+    # Only t-1 is still leased to this worker; t-2's lease lapsed and another worker adopted it
+    fake_db_pool.conn.fetchall.return_value = [{"thread_slug": "t-1"}]
+
+    asyncio.run(spares.renew_leases())
+
+    assert list(spares._spares) == ["t-1", "t-3"]
+    assert spares.stats()["lost"] == 1
+
+
+def test_claim_drops_stored_spares_once_the_lease_may_have_lapsed():
+    spares = SpareThreadPool(low_watermark=0, high_watermark=3)
+    spares._spares.extend(["t-1", "t-2"])
+    spares._unstored.add("t-2")
+    spares._lease_deadline = time.monotonic() - 1  # Renewals have been failing for a whole lease
+
+    assert spares.claim() == "t-2"
+    assert spares.claim() is None
+    assert spares.stats()["lost"] == 1
@@ -0,0 +1,156 @@
+# 流式聊天 /api/chat/stream 的测试 (会话线程解析、线程缓存、聊天记录)
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import AsyncMock, MagicMock
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import app, chat_limiter, get_http_client, session_thread_cache
+from upstreams import UpstreamPool, UpstreamTransport
+
+client = TestClient(app)
+
+
+def test_chat_stream_relays_tokens_as_ndjson(upstream_requests):
+    response = client.post("/api/chat/stream?format=ndjson", json={"message": "你好"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines() if line]
+    assert [e["type"] for e in events] == ["token", "token", "done"]
+    assert "".join(e.get("text", "") for e in events) == "你好，朋友"
+    # 无 session_id 时使用工作区的 stream-chat 接口
+    assert upstream_requests[-1].url.path.endswith("/stream-chat")
+    assert "/thread/" not in upstream_requests[-1].url.path
+
+
+def test_chat_stream_sse_with_new_session(upstream_requests, fake_db_pool):
+    response = client.post("/api/chat/stream", json={"message": "你好", "session_id": "s-123"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    frames = [f for f in response.text.split("\n\n") if f]
+    assert all(f.startswith("data: ") for f in frames)
+    # 新会话: 先创建线程并写入 chat_sessions，再调用线程的 stream-chat 接口
+    assert upstream_requests[0].url.path.endswith("/thread/new")
+    assert upstream_requests[1].url.path.endswith("/thread/t-1/stream-chat")
+    fake_db_pool.conn.execute.assert_awaited_once()
+
+
+def test_chat_stream_reuses_cached_thread(upstream_requests, fake_db_pool):
+    # 第一条消息创建线程并写入缓存
+    client.post("/api/chat/stream", json={"message": "第一条", "session_id": "s-456"})
+    lookups = fake_db_pool.conn.fetchone.await_count
+
+    # 后续消息直接命中缓存，不再查询 chat_sessions
+    response = client.post("/api/chat/stream", json={"message": "第二条", "session_id": "s-456"})
+
+    assert response.status_code == 200
+    assert fake_db_pool.conn.fetchone.await_count == lookups
+    assert upstream_requests[-1].url.path.endswith("/thread/t-1/stream-chat")
+    assert session_thread_cache.stats()["hits"] >= 1
+
+
+def test_concurrent_first_messages_create_one_thread(fake_db_pool):
+    thread_creations = []
+
+    async def handler(request: httpx.Request):
+        if request.url.path.endswith("/thread/new"):
+            thread_creations.append(request)
+            await asyncio.sleep(0.05)  # 让并发请求在创建线程期间重叠
+            return httpx.Response(200, json={"threadSlug": "t-race"})
+        chunk = {"type": "textResponseChunk", "textResponse": "好", "close": True, "error": None}
+        return httpx.Response(200, content=f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    session_thread_cache.clear()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            return await asyncio.gather(*[
+                ac.post("/api/chat/stream", json={"message": f"消息{i}", "session_id": "s-race"})
+                for i in range(3)
+            ])
+
+    try:
+        responses = asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        del app.state.db_pool
+
+    assert all(r.status_code == 200 for r in responses)
+    assert len(thread_creations) == 1
+    # 只执行一次 upsert
+    fake_db_pool.conn.execute.assert_awaited_once()
+    assert "ON DUPLICATE KEY UPDATE" in fake_db_pool.conn.execute.call_args.args[0]
+
+
+def test_chat_stream_records_turn_for_history(upstream_requests):
+    writer = MagicMock()
+    writer.put = AsyncMock(return_value=True)
+    app.state.message_writer = writer
+    try:
+        response = client.post("/api/chat/stream", json={"message": "最近睡不好", "session_id": "s-789"})
+    finally:
+        del app.state.message_writer
+
+    assert response.status_code == 200
+    rows = [c.args[0] for c in writer.put.await_args_list]
+    assert [(r[1], r[2], r[3]) for r in rows] == [
+        ("s-789", "user", "最近睡不好"),
+        ("s-789", "assistant", "你好，朋友"),
+    ]
+    # 消息ID按时间排序
+    assert rows[0][0] < rows[1][0]
+
+
+def test_stream_cleans_up_when_client_is_gone_before_the_body(fake_db_pool):
+    pool = UpstreamPool(["http://llm:3001"])
+
+    def handler(request: httpx.Request):
+        chunk = {"type": "textResponseChunk", "textResponse": "好", "close": True, "error": None}
+        return httpx.Response(200, content=f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    mock_client = httpx.AsyncClient(transport=UpstreamTransport(pool, pool.primary, httpx.MockTransport(handler)))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    body = json.dumps({"message": "你好"}).encode("utf-8")
+    scope = {
+        "type": "http", "method": "POST", "path": "/api/chat/stream", "raw_path": b"/api/chat/stream",
+        "query_string": b"", "headers": [(b"content-type", b"application/json")],
+        "scheme": "http", "server": ("test", 80), "client": ("test", 1234), "root_path": "",
+    }
+
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()  # 之后不再有请求数据
+
+    async def send(message):
+        raise OSError("client disconnected")  # 连响应头都没发出去，响应体从未被读取
+
+    async def scenario():
+        with pytest.raises(OSError):
+            await app(scope, receive, send)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        del app.state.db_pool
+
+    # 上游响应已关闭 (实例的未完成请求归零)，限流名额已归还
+    assert pool.primary.requests == 1 and pool.primary.outstanding == 0
+    assert chat_limiter.stats()["in_flight"] == 0
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing import RequestTimer, current_timer, span
+from main import app, resources_cache, resources_version_cache, session_thread_cache
+
+client = TestClient(app)
+
+
+def test_span_accumulates_repeated_stages():
+    async def run():
+        timer = RequestTimer()
+        token = current_timer.set(timer)
+        try:
+            with span("db"):
+                await asyncio.sleep(0.01)
+
+            async def query():
+                with span("db"):
+                    await asyncio.sleep(0.01)
+
+            # Spans from concurrent tasks land on the same request's timer
+            await asyncio.gather(query(), query())
+            with span("serialize"):
+                time.sleep(0.001)
+        finally:
+            current_timer.reset(token)
+        return timer
+
+    timer = asyncio.run(run())
+    assert timer.spans["db"][1] == 3
+    assert timer.spans_ms()["db"] >= 30
+    header = timer.header()
+    metrics = [metric.split(";")[0] for metric in header.split(", ")]
+    assert metrics == ["db", "serialize", "app"]
+    assert 'db;dur=' in header and 'desc="x3"' in header
+
+
+def test_span_outside_request_is_noop():
+    with span("db"):
+        pass
+    assert current_timer.get() is None
+
+
+@pytest.fixture
+def db_pool(fake_db_pool):
+    app.state.db_pool = fake_db_pool
+    resources_cache.clear()
+    resources_version_cache.clear()
+    fake_db_pool.conn.fetchone.return_value = {"row_count": 1, "last_updated": "2023-01-02T00:00:00"}
+    fake_db_pool.conn.fetchall.return_value = [{"id": 1, "title": "全国心理援助热线", "created_at": "2023-01-01T00:00:00"}]
+    yield fake_db_pool
+    del app.state.db_pool
+
+
+def test_resources_server_timing_header_and_log(db_pool, caplog):
+    with caplog.at_level(logging.INFO, logger="timing"):
+        response = client.get("/api/resources")
+    assert response.status_code == 200
+    names = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert names == ["db", "serialize", "app"]
+
+    record = next(r for r in caplog.records if r.name == "timing")
+    assert record.route == "/api/resources"
+    assert record.status == 200
+    assert set(record.spans_ms) == {"db", "serialize"}
+
+    # Served from the response cache: no DB or serialize stage
+    response = client.get("/api/resources")
+    assert response.headers["Server-Timing"].startswith("app;dur=")
+
+
+def test_threaded_chat_server_timing_spans(workspace_chat_calls, fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {"anythingllm_thread_id": "t-1"}
+    session_thread_cache.clear()
+    response = client.post("/api/chat", json={"message": "失眠怎么办", "session_id": "s-timing"})
+
+    assert response.status_code == 200
+    names = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert names == ["db", "upstream", "serialize", "app"]
@@ -0,0 +1,149 @@
+# 多实例负载均衡 (upstreams.UpstreamPool) 的单元测试
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstreams import UpstreamPool, UpstreamTransport
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_pool(*urls, **kwargs):
+    clock = FakeClock()
+    pool = UpstreamPool(urls or ("http://llm-1:3001", "http://llm-2:3001"), clock=clock, **kwargs)
+    return pool, clock
+
+
+def fail(pool, upstream, times=1):
+    for _ in range(times):
+        pool.started(upstream)
+        pool.finished(upstream, failed=True)
+
+
+def test_pick_prefers_least_outstanding_and_rotates_ties():
+    pool, _ = make_pool("http://llm-1:3001", "http://llm-2:3001", "http://llm-3:3001")
+    first, second, third = pool.upstreams
+
+    # 负载相同时轮流分配
+    assert [pool.pick() for _ in range(3)] == [first, second, third]
+
+    pool.started(first)
+    pool.started(second)
+    assert pool.pick() is third
+    pool.started(third)
+    pool.started(third)
+    assert pool.pick() in (first, second)
+    pool.finished(first, failed=False)
+    assert pool.pick() is first
+
+
+def test_consecutive_failures_eject_with_backoff():
+    pool, clock = make_pool(failure_threshold=3, eject_seconds=10, max_eject_seconds=25)
+    bad, good = pool.upstreams
+
+    fail(pool, bad, times=2)
+    assert not pool.ejected(bad)
+    fail(pool, bad)
+    assert pool.ejected(bad)
+    assert [pool.pick() for _ in range(4)] == [good] * 4
+    assert pool.stats()["healthy"] == 1
+
+    # 摘除结束后再次连续失败: 摘除时长加倍 (不超过上限)
+    clock.now = 10
+    assert not pool.ejected(bad)
+    fail(pool, bad)
+    assert pool.ejected(bad) and bad.ejected_until == 30
+    clock.now = 30
+    fail(pool, bad)
+    assert bad.ejected_until == 55
+
+    # 一次成功即清零
+    clock.now = 55
+    pool.started(bad)
+    pool.finished(bad, failed=False)
+    assert bad.consecutive_failures == 0 and bad.ejections == 0
+    assert bad.failures == 5 and bad.requests == 6
+
+
+def test_all_ejected_falls_back_to_the_one_due_back_first():
+    pool, clock = make_pool(failure_threshold=1, eject_seconds=10)
+    first, second = pool.upstreams
+    fail(pool, first)
+    clock.now = 5
+    fail(pool, second)
+
+    assert pool.pick() is first
+    assert pool.stats()["healthy"] == 0
+
+
+def test_get_resolves_pinned_instances():
+    pool, _ = make_pool("http://llm-1:3001/", "http://llm-2:3001")
+
+    assert pool.get(None) is pool.primary
+    assert pool.get("http://llm-2:3001/") is pool.upstreams[1]
+    assert pool.get("http://llm-9:3001") is None
+
+
+def test_mounts_need_distinct_origins():
+    pool, _ = make_pool("http://llm:3001/a", "http://llm:3001/b")
+    with pytest.raises(ValueError):
+        pool.mounts(httpx.Limits())
+
+    pool, _ = make_pool()
+    assert sorted(pool.mounts(httpx.Limits())) == ["http://llm-1:3001", "http://llm-2:3001"]
+
+
+def test_transport_tracks_requests_until_the_body_is_closed():
+    pool, _ = make_pool("http://llm:3001", failure_threshold=2)
+    upstream = pool.primary
+    statuses = iter([200, 502, 500])
+
+    def handler(request):
+        return httpx.Response(next(statuses), content=b"data: x\n\n")
+
+    async def scenario():
+        transport = UpstreamTransport(pool, upstream, httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=transport) as client:
+            async with client.stream("POST", "http://llm:3001/stream-chat") as response:
+                assert upstream.outstanding == 1
+                await response.aread()
+            assert upstream.outstanding == 0
+
+            await client.get("http://llm:3001/ping")  # 502: 网关错误计为失败
+            assert upstream.consecutive_failures == 1
+            await client.get("http://llm:3001/ping")  # 500: 实例本身可用，不计失败
+            assert upstream.consecutive_failures == 0
+
+    asyncio.run(scenario())
+    assert upstream.requests == 3 and upstream.failures == 1
+
+
+def test_transport_errors_count_as_failures():
+    pool, _ = make_pool("http://llm:3001", failure_threshold=2)
+    upstream = pool.primary
+
+    def handler(request):
+        raise httpx.ConnectError("connection refused", request=request)
+
+    async def scenario():
+        transport = UpstreamTransport(pool, upstream, httpx.MockTransport(handler))
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                with pytest.raises(httpx.ConnectError):
+                    await client.get("http://llm:3001/ping")
+
+    asyncio.run(scenario())
+    assert upstream.outstanding == 0
+    assert pool.ejected(upstream)
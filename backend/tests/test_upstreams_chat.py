@@ -0,0 +1,49 @@
+# 预创建线程与多实例会话亲和在聊天端点上的测试
+import os
+import sys
+from unittest.mock import patch
+
+from fastapi.testclient import TestClient
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+from main import ThreadBinding, anythingllm_upstreams, app, session_thread_cache, spare_threads
+from upstreams import UpstreamPool
+
+client = TestClient(app)
+
+
+def test_new_session_claims_pre_created_thread(upstream_requests, fake_db_pool):
+    spares = spare_threads[anythingllm_upstreams.primary.base_url]
+    spares._spares.append("t-spare")
+    # upsert 之后读回的线程就是领取的备用线程
+    fake_db_pool.conn.fetchone.side_effect = [None, {"anythingllm_thread_id": "t-spare"}]
+    try:
+        response = client.post("/api/chat/stream", json={"message": "你好", "session_id": "s-spare"})
+    finally:
+        spares._spares.clear()
+
+    assert response.status_code == 200
+    # 不再调用 /thread/new，直接使用备用线程；该线程从备用表中删除
+    assert [r.url.path.rsplit("/", 2)[-2] for r in upstream_requests] == ["t-spare"]
+    statements = [call.args[0] for call in fake_db_pool.conn.execute.await_args_list]
+    assert statements[0].startswith("INSERT INTO chat_sessions")
+    assert statements[1] == "DELETE FROM anythingllm_spare_threads WHERE thread_slug = %s"
+    assert session_thread_cache.get("s-spare").thread_id == "t-spare"
+
+
+def test_session_is_sent_to_the_instance_of_its_thread(upstream_requests, fake_db_pool):
+    fake_db_pool.conn.fetchone.return_value = {
+        "anythingllm_thread_id": "t-9", "anythingllm_upstream": "http://llm-2:3001"}
+    with patch.object(main, "anythingllm_upstreams", UpstreamPool(["http://llm-1:3001", "http://llm-2:3001"])):
+        response = client.post("/api/chat/stream", json={"message": "你好", "session_id": "s-pinned"})
+        assert response.status_code == 200
+        assert str(upstream_requests[-1].url).startswith("http://llm-2:3001/")
+        assert session_thread_cache.get("s-pinned") == ThreadBinding("t-9", "http://llm-2:3001")
+
+        # 线程所在实例已从配置中移除: 无法继续该会话
+        session_thread_cache.set("s-gone", ThreadBinding("t-8", "http://llm-3:3001"))
+        response = client.post("/api/chat/stream", json={"message": "你好", "session_id": "s-gone"})
+    assert response.status_code == 503
@@ -0,0 +1,89 @@
+# 异步批量写入队列 (writebehind.BatchWriter) 的单元测试
+import asyncio
+import os
+import sys
+
+# 添加父目录到Python路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from writebehind import BatchWriter
+
+
+def test_flushes_when_batch_is_full():
+    batches = []
+
+    async def flush(batch):
+        batches.append(list(batch))
+
+    async def scenario():
+        writer = BatchWriter("test", flush, max_queue=10, batch_size=3, flush_interval=10)
+        writer.start()
+        for i in range(3):
+            await writer.put(i)
+        await asyncio.sleep(0.05)  # 远小于 flush_interval，只能是按数量触发
+        assert batches == [[0, 1, 2]]
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_flushes_on_interval_and_drains_on_stop():
+    batches = []
+
+    async def flush(batch):
+        batches.append(list(batch))
+
+    async def scenario():
+        writer = BatchWriter("test", flush, max_queue=100, batch_size=50, flush_interval=0.05)
+        writer.start()
+        await writer.put("a")
+        await asyncio.sleep(0.2)
+        assert batches == [["a"]]
+        # 关闭时剩余的条目必须全部写入
+        for i in range(5):
+            await writer.put(i)
+        await writer.stop()
+        assert writer.stats()["written"] == 6
+
+    asyncio.run(scenario())
+    assert sum(len(b) for b in batches) == 6
+
+
+def test_drops_after_put_timeout_when_full():
+    release = None
+
+    async def slow_flush(batch):
+        await release.wait()
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        writer = BatchWriter("test", slow_flush, max_queue=2, batch_size=1, flush_interval=0.01, put_timeout=0.01)
+        writer.start()
+        results = [await writer.put(i) for i in range(5)]
+        assert results.count(False) >= 1
+        assert writer.stats()["dropped"] >= 1
+        release.set()
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+
+def test_coalesces_items_with_the_same_key():
+    batches = []
+
+    async def flush(batch):
+        batches.append(list(batch))
+
+    async def scenario():
+        writer = BatchWriter("test", flush, max_queue=10, batch_size=10, flush_interval=0.05, key=lambda item: item[0])
+        writer.start()
+        for item in [("a", 1), ("b", 1), ("a", 2), ("a", 3)]:
+            assert await writer.put(item)
+        await writer.stop()
+        # 每个键只写入最新的值，顺序按键第一次出现的位置
+        assert batches == [[("a", 3), ("b", 1)]]
+        assert writer.stats()["coalesced"] == 2
+        assert writer.stats()["written"] == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,188 @@
+# WebSocket 聊天通道 /ws/chat 的测试
+import asyncio
+import json
+import os
+import sys
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import main
+from breaker import CircuitOpenError
+from main import app, get_http_client, session_thread_cache, chat_limiter
+
+client = TestClient(app)
+
+
+def sse_body(*texts):
+    chunks = [{"type": "textResponseChunk", "textResponse": t, "close": False, "error": None} for t in texts]
+    chunks.append({"type": "finalizeResponseStream", "textResponse": "", "close": True, "error": None})
+    return "".join(f"data: {json.dumps(c, ensure_ascii=False)}\n\n" for c in chunks).encode("utf-8")
+
+
+@pytest.fixture
+def upstream(fake_db_pool):
+    """模拟 AnythingLLM: 消息以 "慢" 开头时延迟 0.3 秒再响应，回复为 "回:" + 消息"""
+    seen = []
+
+    async def handler(request: httpx.Request):
+        seen.append(request)
+        if request.url.path.endswith("/thread/new"):
+            return httpx.Response(200, json={"threadSlug": "t-1"})
+        message = json.loads(request.content)["message"]
+        if message.startswith("慢"):
+            await asyncio.sleep(0.3)
+        return httpx.Response(200, content=sse_body("回:", message), headers={"Content-Type": "text/event-stream"})
+
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    session_thread_cache.clear()
+    yield seen
+    app.dependency_overrides.pop(get_http_client, None)
+    del app.state.db_pool
+
+
+def receive_until_done(ws, ids):
+    """收集帧直到 ids 中每条消息都收到 done/error；返回 id -> 帧列表 以及全部帧的顺序"""
+    frames, order, pending = {}, [], set(ids)
+    while pending:
+        frame = ws.receive_json()
+        if frame["type"] in ("ping", "pong"):
+            continue
+        order.append(frame)
+        frames.setdefault(frame["id"], []).append(frame)
+        if frame["type"] in ("done", "error"):
+            pending.discard(frame["id"])
+    return frames, order
+
+
+def reply_text(frames):
+    return "".join(f.get("text", "") for f in frames if f["type"] == "token")
+
+
+def test_one_socket_multiplexes_sessions(upstream):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"type": "ping"})
+        assert ws.receive_json() == {"type": "pong"}
+
+        ws.send_json({"type": "chat", "id": "a", "message": "你好", "session_id": "s-1"})
+        ws.send_json({"type": "chat", "id": "b", "message": "在吗", "session_id": "s-2"})
+        ws.send_json({"id": "c", "message": "失眠怎么办"})  # type 默认为 chat，无会话
+        frames, _ = receive_until_done(ws, ["a", "b", "c"])
+
+    assert reply_text(frames["a"]) == "回:你好"
+    assert reply_text(frames["b"]) == "回:在吗"
+    assert reply_text(frames["c"]) == "回:失眠怎么办"
+    assert frames["a"][-1] == {"id": "a", "session_id": "s-1", "type": "done"}
+    assert all(f["session_id"] == "s-2" for f in frames["b"])
+    # 会话消息走线程的 stream-chat，无会话消息走工作区的 stream-chat
+    paths = [r.url.path for r in upstream]
+    assert sum(p.endswith("/thread/t-1/stream-chat") for p in paths) == 2
+    assert any(p.endswith("/workspace/" + main.WORKSPACE_SLUG + "/stream-chat") for p in paths)
+    assert chat_limiter.stats()["in_flight"] == 0
+
+
+def test_same_session_messages_are_answered_in_order(upstream):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "1", "message": "慢一点的问题", "session_id": "s-1"})
+        ws.send_json({"id": "2", "message": "第二个问题", "session_id": "s-1"})
+        _, order = receive_until_done(ws, ["1", "2"])
+
+    # 第二条消息等第一条回复完才开始，即使它本身更快
+    assert [f["id"] for f in order] == ["1", "1", "1", "2", "2", "2"]
+
+
+def test_in_flight_cap_and_duplicate_ids_are_rejected(upstream):
+    with patch.object(main, "WS_MAX_IN_FLIGHT", 1), client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "a", "message": "慢慢说"})
+        ws.send_json({"id": "a", "message": "重复"})
+        ws.send_json({"id": "b", "message": "插队"})
+        duplicate, over_cap = ws.receive_json(), ws.receive_json()
+        frames, _ = receive_until_done(ws, ["a"])
+
+    assert duplicate["id"] == "a" and duplicate["status_code"] == 409
+    assert over_cap == {"id": "b", "session_id": None, "type": "error", "status_code": 429,
+                        "detail": "同时处理的消息过多，请等待之前的回复完成"}
+    assert reply_text(frames["a"]) == "回:慢慢说"
+
+
+def test_invalid_frames_get_error_frames(upstream):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_text("不是JSON")
+        not_json = ws.receive_json()
+        ws.send_json({"type": "chat", "id": "x"})
+        missing_message = ws.receive_json()
+        ws.send_json({"type": "subscribe"})
+        unknown_type = ws.receive_json()
+
+    assert not_json["type"] == "error" and not_json["status_code"] == 400
+    assert missing_message["id"] == "x" and missing_message["status_code"] == 422
+    assert missing_message["detail"][0]["loc"] == ["message"]
+    assert unknown_type["status_code"] == 400
+    assert upstream == []
+
+
+def test_cancel_stops_an_in_flight_message(upstream):
+    with client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "a", "message": "慢慢说"})
+        ws.send_json({"type": "cancel", "id": "a"})
+        assert ws.receive_json() == {"id": "a", "type": "cancelled"}
+        # 连接仍可继续使用
+        ws.send_json({"id": "b", "message": "还在吗"})
+        frames, _ = receive_until_done(ws, ["b"])
+
+    assert reply_text(frames["b"]) == "回:还在吗"
+    assert "a" not in frames
+    assert chat_limiter.stats()["in_flight"] == 0
+
+
+def test_degraded_reply_when_circuit_is_open(upstream, fake_db_pool):
+    def circuit_open():
+        raise CircuitOpenError("anythingllm", 30)
+
+    main.crisis_resources_cache.clear()
+    with patch.object(main.chat_breaker, "allow", circuit_open), client.websocket_connect("/ws/chat") as ws:
+        ws.send_json({"id": "a", "message": "我很难受", "session_id": "s-1"})
+        frames, _ = receive_until_done(ws, ["a"])
+
+    assert [f["type"] for f in frames["a"]] == ["token", "done"]
+    assert frames["a"][-1]["degraded"] is True
+    assert "400-161-9995" in frames["a"][0]["text"]
+    assert upstream == []
+    main.crisis_resources_cache.clear()
+
+
+def test_upstream_error_becomes_error_frame(fake_db_pool):
+    mock_client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(500, json={"error": {"message": "model overloaded"}})))
+    app.dependency_overrides[get_http_client] = lambda: mock_client
+    app.state.db_pool = fake_db_pool
+    try:
+        with client.websocket_connect("/ws/chat") as ws:
+            ws.send_json({"id": "a", "message": "你好"})
+            frame = ws.receive_json()
+    finally:
+        app.dependency_overrides.pop(get_http_client, None)
+        del app.state.db_pool
+
+    assert frame["type"] == "error" and frame["status_code"] == 500
+    assert "model overloaded" in frame["detail"]
+
+
+def test_heartbeat_and_idle_timeout(upstream):
+    with patch.object(main, "WS_HEARTBEAT_INTERVAL", 0.05), patch.object(main, "WS_IDLE_TIMEOUT", 0.2):
+        with client.websocket_connect("/ws/chat") as ws:
+            assert ws.receive_json() == {"type": "ping"}
+            ws.send_json({"type": "pong"})
+            with pytest.raises(WebSocketDisconnect) as closed:
+                while True:  # 之后不再回应，服务器在空闲超时后关闭连接
+                    assert ws.receive_json() == {"type": "ping"}
+
+    assert closed.value.code == 1000
+    assert main.websocket_stats["idle_timeouts"] >= 1
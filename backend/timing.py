@@ -0,0 +1,110 @@
+"""
+Per-request stage timing.
+
+``ServerTimingMiddleware`` gives every HTTP request a ``RequestTimer`` through
+a context variable; code on the request path wraps its stages in
+``with span("db"):``. The spans are
+
+* sent back in a ``Server-Timing`` header (shown per request in the browser's
+  network panel), together with ``app`` (time until the response started);
+* logged as one structured line (``timing`` logger, fields ``route``,
+  ``status``, ``total_ms`` and ``spans_ms``) for requests that recorded any.
+
+A span name used several times in a request (e.g. two DB round trips, or
+concurrent chats in one batch) is reported once with the summed duration and
+its count. ``span`` is a no-op outside a request (background tasks, tests).
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RequestTimer:
+    __slots__ = ("started", "spans")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}  # name -> [total seconds, count]
+
+    def add(self, name: str, seconds: float) -> None:
+        entry = self.spans.get(name)
+        if entry is None:
+            self.spans[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def spans_ms(self) -> Dict[str, float]:
+        return {name: round(total * 1000, 2) for name, (total, _) in self.spans.items()}
+
+    def header(self) -> str:
+        """``Server-Timing`` value: one metric per span, then ``app`` (time so far)."""
+        metrics = []
+        for name, (total, count) in self.spans.items():
+            desc = f';desc="x{count}"' if count > 1 else ""
+            metrics.append(f"{name};dur={total * 1000:.2f}{desc}")
+        metrics.append(f"app;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(metrics)
+
+
+current_timer: ContextVar[Optional[RequestTimer]] = ContextVar("request_timer", default=None)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as stage ``name`` of the current request."""
+    timer = current_timer.get()
+    if timer is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, time.perf_counter() - started)
+
+
+class ServerTimingMiddleware:
+    """Pure ASGI middleware adding ``Server-Timing`` and the per-request timing log line."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timer = RequestTimer()
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"server-timing", timer.header().encode("latin-1"))]
+            await send(message)
+
+        token = current_timer.set(timer)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_timer.reset(token)
+            if timer.spans:
+                route = getattr(scope.get("route"), "path", None) or "unmatched"
+                logger.info(
+                    "Request timings %s %s", scope["method"], route,
+                    extra={
+                        "route": route,
+                        "status": status_code,
+                        "total_ms": round(timer.elapsed() * 1000, 2),
+                        "spans_ms": timer.spans_ms(),
+                    },
+                )
@@ -0,0 +1,219 @@
+"""
+Several AnythingLLM instances behind one backend.
+
+``ANYTHINGLLM_API_BASE_URL`` may list several base URLs. Calls that can go to
+any instance (stateless workspace chat, creating a thread for a new session)
+are sent by ``pick()`` to the instance with the fewest requests in progress from
+this worker (least outstanding requests); ties rotate round-robin. A thread
+only exists on the instance that created it, so every later message of that
+session goes back there: the caller stores the instance's base URL next to the
+thread (``chat_sessions.anythingllm_upstream``) and looks it up with ``get()``.
+
+Every instance gets its own transport in the shared ``httpx.AsyncClient``
+(``mounts()``), with its own connection pool (``httpx.Limits``, optional
+HTTP/2) so one slow instance cannot use up the connections of the others. The
+transport also keeps the per-instance bookkeeping, for every call made through
+the client:
+
+* ``outstanding`` counts requests from send until the response is closed (for
+  streamed replies, until the stream ends).
+* Passive health: transport errors (connect/read failures, timeouts) and
+  gateway errors (502/503/504) are failures; any other response is a success.
+  After ``failure_threshold`` consecutive failures the instance is ejected from
+  ``pick()`` for ``eject_seconds``, doubling with each repeated ejection up to
+  ``max_eject_seconds``; a success resets the count. Sessions pinned to an
+  ejected instance keep using it (their thread is there), and if every
+  instance is ejected ``pick()`` returns the one that is due back first.
+"""
+import logging
+import time
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from metrics import UPSTREAM_EJECTIONS, UPSTREAM_OUTSTANDING
+
+logger = logging.getLogger(__name__)
+
+GATEWAY_ERRORS = (502, 503, 504)
+
+
+class Upstream:
+    __slots__ = ("base_url", "outstanding", "requests", "failures", "consecutive_failures", "ejections", "ejected_until")
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0  # Consecutive ejections, for the back-off
+        self.ejected_until = 0.0
+
+    def is_ejected(self, now: float) -> bool:
+        return now < self.ejected_until
+
+
+class UpstreamPool:
+    def __init__(
+        self,
+        base_urls: Sequence[str],
+        *,
+        failure_threshold: int = 5,
+        eject_seconds: float = 30.0,
+        max_eject_seconds: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.upstreams = [Upstream(url.rstrip("/")) for url in base_urls]
+        self._by_url = {upstream.base_url: upstream for upstream in self.upstreams}
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self._clock = clock
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self.upstreams)
+
+    @property
+    def primary(self) -> Upstream:
+        """The first configured instance; threads stored without an instance (single-instance era) live there."""
+        return self.upstreams[0]
+
+    def get(self, base_url: Optional[str]) -> Optional[Upstream]:
+        """The instance a thread is pinned to (None -> the primary), or None if it is no longer configured."""
+        if not base_url:
+            return self.primary
+        return self._by_url.get(base_url.rstrip("/"))
+
+    def ejected(self, upstream: Upstream) -> bool:
+        return upstream.is_ejected(self._clock())
+
+    def pick(self) -> Upstream:
+        """The healthy instance with the fewest outstanding requests."""
+        now = self._clock()
+        count = len(self.upstreams)
+        start = self._next
+        self._next = (start + 1) % count
+        best: Optional[Upstream] = None
+        for offset in range(count):
+            upstream = self.upstreams[(start + offset) % count]
+            if upstream.is_ejected(now):
+                continue
+            if best is None or upstream.outstanding < best.outstanding:
+                best = upstream
+        if best is None:
+            # Everything is ejected: trying the instance due back first beats refusing outright
+            best = min(self.upstreams, key=lambda upstream: upstream.ejected_until)
+        return best
+
+    # --- Bookkeeping (called by UpstreamTransport) ---
+
+    def started(self, upstream: Upstream) -> None:
+        upstream.outstanding += 1
+        upstream.requests += 1
+        UPSTREAM_OUTSTANDING.labels(upstream.base_url).inc()
+
+    def finished(self, upstream: Upstream, failed: bool) -> None:
+        upstream.outstanding -= 1
+        UPSTREAM_OUTSTANDING.labels(upstream.base_url).dec()
+        if not failed:
+            upstream.consecutive_failures = 0
+            upstream.ejections = 0
+            return
+        upstream.failures += 1
+        upstream.consecutive_failures += 1
+        now = self._clock()
+        if upstream.consecutive_failures >= self.failure_threshold and not upstream.is_ejected(now):
+            duration = min(self.eject_seconds * 2 ** upstream.ejections, self.max_eject_seconds)
+            upstream.ejected_until = now + duration
+            upstream.ejections += 1
+            UPSTREAM_EJECTIONS.labels(upstream.base_url).inc()
+            logger.warning(
+                "Ejecting AnythingLLM upstream %s for %.0fs after %d consecutive failures",
+                upstream.base_url, duration, upstream.consecutive_failures)
+
+    # --- httpx wiring ---
+
+    def mounts(self, limits: httpx.Limits, http2: bool = False) -> Dict[str, httpx.AsyncBaseTransport]:
+        """One transport (own connection pool) per instance, for ``httpx.AsyncClient(mounts=...)``."""
+        mounts: Dict[str, httpx.AsyncBaseTransport] = {}
+        for upstream in self.upstreams:
+            url = httpx.URL(upstream.base_url)
+            pattern = f"{url.scheme}://{url.netloc.decode('ascii')}"
+            if pattern in mounts:
+                raise ValueError(f"AnythingLLM upstreams must differ in scheme, host or port: {pattern} is listed twice")
+            mounts[pattern] = UpstreamTransport(self, upstream, httpx.AsyncHTTPTransport(limits=limits, http2=http2))
+        return mounts
+
+    def stats(self) -> Dict[str, Any]:
+        now = self._clock()
+        upstreams: List[Dict[str, Any]] = []
+        for upstream in self.upstreams:
+            ejected = upstream.is_ejected(now)
+            upstreams.append({
+                "base_url": upstream.base_url,
+                "outstanding": upstream.outstanding,
+                "requests": upstream.requests,
+                "failures": upstream.failures,
+                "consecutive_failures": upstream.consecutive_failures,
+                "ejected": ejected,
+                "ejected_for_seconds": round(upstream.ejected_until - now, 1) if ejected else 0,
+            })
+        return {"upstreams": upstreams, "healthy": sum(not u["ejected"] for u in upstreams)}
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports the call as finished when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, done: Callable[[bool], None], failed: bool):
+        self._stream = stream
+        self._done = done
+        self._failed = failed
+        self._closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except httpx.TransportError:
+            self._failed = True
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._done(self._failed)
+
+
+class UpstreamTransport(httpx.AsyncBaseTransport):
+    """Wraps one instance's transport to count its outstanding requests and judge its health."""
+
+    def __init__(self, pool: UpstreamPool, upstream: Upstream, transport: httpx.AsyncBaseTransport):
+        self.pool = pool
+        self.upstream = upstream
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.pool.started(self.upstream)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException as e:
+            self.pool.finished(self.upstream, failed=isinstance(e, httpx.TransportError))
+            raise
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(
+                response.stream,
+                lambda failed: self.pool.finished(self.upstream, failed),
+                failed=response.status_code in GATEWAY_ERRORS,
+            ),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
@@ -0,0 +1,159 @@
+"""
+Write-behind buffering for rows that do not need to be on disk before we reply.
+
+Producers put items into a bounded in-process queue; one background task
+drains it and hands batches to an async ``flush`` callback (typically one
+multi-row INSERT). A batch is flushed as soon as it reaches ``batch_size`` or
+``flush_interval`` seconds after its first item arrived, whichever is first.
+
+With a ``key`` function, items are coalesced per key while they wait: a later
+item with the same key replaces the queued one instead of taking another slot,
+so only the latest value per key reaches ``flush``.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_WAKE = object()  # Nudges the drain loop at shutdown; never passed to flush
+
+
+class BatchWriter(Generic[T]):
+    """
+    Bounded queue + background drain task with batched flushes.
+
+    Backpressure: when the queue is full, ``put()`` waits up to ``put_timeout``
+    seconds for space and then drops the item (counted in ``stats()["dropped"]``),
+    so a slow database can delay callers by at most ``put_timeout``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[T]], Awaitable[Any]],
+        *,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 1.0,
+        put_timeout: float = 0.05,
+        key: Optional[Callable[[T], Hashable]] = None,
+    ):
+        if batch_size < 1 or max_queue < batch_size:
+            raise ValueError(f"Invalid sizes for {name}: batch_size={batch_size}, max_queue={max_queue}")
+        self.name = name
+        self._flush_fn = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self._queue: "asyncio.Queue[Any]" = asyncio.Queue(maxsize=max_queue)
+        self._key = key
+        self._pending: Dict[Hashable, T] = {}  # Latest item per queued key (key mode only)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        self.coalesced = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+            "coalesced": self.coalesced,
+        }
+
+    # --- Producer side ---
+
+    async def put(self, item: T) -> bool:
+        """Enqueue one item; returns False if it had to be dropped."""
+        if self._stopping:
+            self.dropped += 1
+            return False
+        entry: Any = item
+        if self._key is not None:
+            entry = self._key(item)
+            if entry in self._pending:
+                self._pending[entry] = item  # Still waiting to be flushed; the newer value wins
+                self.coalesced += 1
+                return True
+            self._pending[entry] = item  # The queue carries the key; the value is read at flush time
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._queue.put(entry), self.put_timeout)
+            return True
+        except asyncio.TimeoutError:
+            if self._key is not None:
+                self._pending.pop(entry, None)
+            self.dropped += 1
+            logger.warning(f"{self.name}: write-behind queue full, dropping item")
+            return False
+
+    # --- Lifecycle ---
+
+    def start(self) -> None:
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name=f"{self.name}-writer")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop accepting items and flush everything still queued (bounded by ``timeout``)."""
+        if self._task is None:
+            return
+        self._stopping = True
+        try:
+            self._queue.put_nowait(_WAKE)
+        except asyncio.QueueFull:
+            pass  # The drain loop is busy and will notice _stopping on its own
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"{self.name}: drain timed out with {self._queue.qsize()} items still queued")
+        self._task = None
+
+    # --- Drain loop ---
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not (self._stopping and self._queue.empty()):
+            try:
+                first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+            batch: List[T] = [] if first is _WAKE else [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - loop.time()
+                    if self._stopping or remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                if item is not _WAKE:
+                    batch.append(item)
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[Any]) -> None:
+        if self._key is not None:
+            batch = [self._pending.pop(key) for key in dict.fromkeys(batch) if key in self._pending]
+            if not batch:
+                return
+        try:
+            await self._flush_fn(batch)
+            self.written += len(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            self.dropped += len(batch)
+            logger.error(f"{self.name}: failed to flush batch of {len(batch)}: {e}")
@@ -29,9 +29,103 @@ export default { // 导出包含API方法的对象
   sendMessage(message) { // 定义sendMessage方法，用于发送聊天消息
     return api.post('/chat', { message }); // 使用创建的api实例发送POST请求到'/chat'，请求体包含message
   }, // sendMessage方法结束
+
+  // Streaming chat API // 流式聊天API：token到达即回调，长回复不再受30秒axios超时限制
+  async sendMessageStream(message, { sessionId, onToken, signal } = {}) { // 返回完整回复文本
+    const response = await fetch('/api/chat/stream?format=ndjson', { // axios不支持逐块读取响应体，这里使用fetch
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ message, session_id: sessionId }),
+      signal, // 可选的AbortSignal，用于取消请求
+    });
+    if (!response.ok) { // 建立流之前的错误以普通HTTP错误返回
+      const error = await response.json().catch(() => ({}));
+      throw new Error(error.detail || `HTTP ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = ''; // 只缓存尚未完整的一行
+    let reply = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      for (const line of lines) {
+        if (!line) continue;
+        const event = JSON.parse(line);
+        if (event.type === 'token') {
+          reply += event.text;
+          if (onToken) onToken(event.text);
+        } else if (event.type === 'error') {
+          throw new Error(event.detail);
+        }
+      }
+    }
+    return reply;
+  }, // sendMessageStream方法结束
+
+  // WebSocket chat API // WebSocket聊天：一个连接发送多条消息 (可属于不同会话)，回复帧按消息id分发
+  createChatSocket() { // 返回 { send(message, { sessionId, onToken }), close() }
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}/ws/chat`);
+    const opened = new Promise((resolve, reject) => {
+      socket.addEventListener('open', resolve, { once: true });
+      socket.addEventListener('error', reject, { once: true });
+    });
+    const pending = new Map(); // 消息id -> { reply, onToken, resolve, reject }
+    let nextId = 0;
+
+    socket.addEventListener('message', (event) => {
+      const frame = JSON.parse(event.data);
+      if (frame.type === 'ping') { // 服务器心跳，不回应会被当作空闲连接关闭
+        socket.send(JSON.stringify({ type: 'pong' }));
+        return;
+      }
+      const entry = pending.get(frame.id);
+      if (!entry) return;
+      if (frame.type === 'token') {
+        entry.reply += frame.text;
+        if (entry.onToken) entry.onToken(frame.text);
+      } else if (frame.type === 'done') {
+        pending.delete(frame.id);
+        entry.resolve(entry.reply);
+      } else if (frame.type === 'error') {
+        pending.delete(frame.id);
+        entry.reject(new Error(frame.detail));
+      }
+    });
+    socket.addEventListener('close', () => { // 连接断开时未完成的消息全部失败
+      for (const entry of pending.values()) entry.reject(new Error('WebSocket连接已关闭'));
+      pending.clear();
+    });
+
+    return {
+      async send(message, { sessionId, onToken } = {}) { // 返回完整回复文本
+        await opened;
+        const id = String(++nextId);
+        const reply = new Promise((resolve, reject) => pending.set(id, { reply: '', onToken, resolve, reject }));
+        socket.send(JSON.stringify({ type: 'chat', id, message, session_id: sessionId }));
+        return reply;
+      },
+      close() {
+        socket.close();
+      },
+    };
+  }, // createChatSocket方法结束
   
   // Resources API // 资源相关的API
   getResources(params = {}) { // 定义getResources方法，用于获取资源列表，可接受可选的params参数
     return api.get('/resources', { params }); // 使用创建的api实例发送GET请求到'/resources'，并将params作为查询参数
-  } // getResources方法结束
+  }, // getResources方法结束
+
+  // Chat history API // 聊天记录：按游标分页加载会话消息
+  async getSessionMessages(sessionId, { cursor, limit, order } = {}) { // 返回 { messages, nextCursor }，nextCursor 为 null 表示没有更多
+    const response = await api.get(`/sessions/${encodeURIComponent(sessionId)}/messages`, {
+      params: { cursor, limit, order },
+    });
+    return { messages: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+  } // getSessionMessages方法结束
 }; // 导出对象结束
@@ -11,6 +11,11 @@ export default defineConfig({ // 导出Vite配置对象
         target: 'http://127.0.0.1:8000', // Your backend address // 目标地址是FastAPI后端运行的地址
         changeOrigin: true, // 改变请求的源，使其与目标地址一致
       }, // 代理配置结束
+      // WebSocket chat channel // 将/ws请求 (WebSocket) 代理到FastAPI后端
+      '/ws': {
+        target: 'ws://127.0.0.1:8000',
+        ws: true,
+      },
       // Optional: Direct proxy for AnythingLLM API
       '/v1': {
         target: 'http://localhost:3001',